@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Version-neutral BEL terms and statements
+
+toBel() builds Term and Statement objects once per entity.  They are
+rendered to BEL 1 or BEL 2 text on demand and each rendering is memoized,
+so one traversal serves both versions and no global BEL version is needed.
+
+BEL 2 differences reproduced here
+  - a loc(REACTCOMP:"...") argument when the entity has a compartment
+  - located set and genome encoded entity names are written unquoted
+  - named complexes with a compartment are written as abundances
+"""
+
+bel2 = '2'
+
+
+class Term(object):
+    """BEL term - func(arg) or, in BEL 2 with a location, func(arg, loc(...))
+
+    Inputs:
+        func          BEL function, e.g. a, p, complex
+        arg           function argument as written, e.g. CHEBIID:15377 or "name"
+        location      compartment name, only rendered in BEL 2
+        locatedArg    replaces arg when the location is rendered
+        locatedFunc   replaces func when the location is rendered
+        replace       (old, new) applied to the rendered term
+    """
+
+    __slots__ = ('func', 'arg', 'location', 'locatedArg', 'locatedFunc', 'replace', 'rendered')
+
+    def __init__(self, func, arg, location=None, locatedArg=None, locatedFunc=None, replace=None):
+        self.func = func
+        self.arg = arg
+        self.location = location
+        self.locatedArg = locatedArg
+        self.locatedFunc = locatedFunc
+        self.replace = replace
+        self.rendered = {}
+
+    def renderArg(self, version, located):
+        if located and self.locatedArg is not None:
+            return self.locatedArg
+        return self.arg
+
+    def render(self, version):
+        text = self.rendered.get(version)
+        if text is None:
+            located = version == bel2 and bool(self.location)
+            func = self.locatedFunc if located and self.locatedFunc else self.func
+            arg = self.renderArg(version, located)
+            if located:
+                text = '{}({}, loc(REACTCOMP:"{}"))'.format(func, arg, self.location)
+            else:
+                text = '{}({})'.format(func, arg)
+            if self.replace:
+                text = text.replace(*self.replace)
+            self.rendered[version] = text
+        return text
+
+    def __repr__(self):
+        return 'Term({})'.format(self.render('1'))
+
+
+class ComplexTerm(Term):
+    """complex() of component terms, components rendering the same are listed once"""
+
+    __slots__ = ('components',)
+
+    def __init__(self, components, location=None):
+        Term.__init__(self, 'complex', None, location=location)
+        self.components = components
+
+    def renderArg(self, version, located):
+        return ', '.join(dict.fromkeys(render(component, version) for component in self.components))
+
+    def render(self, version):
+        if version not in self.rendered:
+            # Nested complexes are rendered innermost first so deep nesting does not recurse
+            stack = [self]
+            while stack:
+                term = stack[-1]
+                pending = [component for component in term.components
+                           if isinstance(component, ComplexTerm) and version not in component.rendered]
+                if pending:
+                    stack.extend(pending)
+                else:
+                    stack.pop()
+                    Term.render(term, version)
+        return self.rendered[version]
+
+
+class Statement(object):
+    """subject relation object, e.g. complex(...) hasComponent p(...)"""
+
+    __slots__ = ('subject', 'relation', 'object', 'rendered')
+
+    def __init__(self, subject, relation, object):
+        self.subject = subject
+        self.relation = relation
+        self.object = object
+        self.rendered = {}
+
+    def render(self, version):
+        text = self.rendered.get(version)
+        if text is None:
+            text = '{} {} {}'.format(render(self.subject, version), self.relation, render(self.object, version))
+            self.rendered[version] = text
+        return text
+
+    def __repr__(self):
+        return 'Statement({})'.format(self.render('1'))
+
+
+def render(item, version):
+    """BEL text of a Term or Statement, plain strings are passed through"""
+
+    if isinstance(item, str):
+        return item
+    return item.render(str(version))
+
+
+def renderResult(result, version):
+    """Render a toBel() result {Term: [Statement]} to {term text: [statement texts]}
+
+    Annotation results (plain strings) and None are returned unchanged.
+    """
+
+    if not isinstance(result, dict):
+        return result
+    return {render(term, version): [render(statement, version) for statement in statements]
+            for term, statements in result.items()}
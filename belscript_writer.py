@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Streaming writers for the BEL script and bad evidence outputs
+
+The document header is written once when the writer is opened and every
+statement group is rendered and written as soon as it is handed over, so
+memory use does not grow with the number of reactions converted.  Outputs
+are compressed on the fly when compression is configured, see compression.py.
+"""
+
+import os
+import json
+
+from metrics import metrics
+from compression import compressedFilename, openText
+
+
+class BelScriptWriter(object):
+    """Write a BEL script one statement group at a time
+
+    Inputs:
+        fn         output filename, a compression suffix is added when configured
+        template   jinja2 Template defining a statement_group(evidence, index)
+                   macro and looping over context['evidences']
+        context    template context, evidences are ignored
+        resume     state() of an earlier writer of this plain text file - the
+                   file is truncated to that state and appended to
+    """
+
+    def __init__(self, fn, template, context, resume=None):
+        self.fn = compressedFilename(fn)
+        self.groupCnt = 0
+        self.statementCnt = 0
+        self.byteCnt = 0
+        self.statementGroup = template.module.statement_group
+
+        if resume:
+            os.truncate(self.fn, resume['size'])
+            self.f = openText(self.fn, 'a')
+            self.groupCnt, self.statementCnt, self.byteCnt = resume['groups'], resume['statements'], resume['size']
+            return
+
+        context = dict(context)
+        context['evidences'] = []
+
+        self.f = openText(self.fn, 'w')
+        self.writeText(template.render(context))
+
+    def write(self, evidence):
+        self.groupCnt += 1
+        self.statementCnt += len(evidence['statements'])
+        with metrics.timer('render'):
+            text = self.statementGroup(evidence, self.groupCnt)
+        with metrics.timer('write'):
+            self.writeText(text)
+
+    def writeText(self, text):
+        self.f.write(text)
+        self.byteCnt += len(text.encode('utf-8'))
+
+    def state(self):
+        """Flush to disk and return what is needed to resume writing, see checkpoint.py"""
+
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return {'size': os.path.getsize(self.fn), 'groups': self.groupCnt, 'statements': self.statementCnt}
+
+    def close(self):
+        if self.f:
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonListWriter(object):
+    """Stream objects into a JSON list - same layout as json.dump(objects, f, indent=4)
+
+    With resume, the state() of an earlier writer of this plain text file,
+    the file is truncated to that state and appended to.
+    """
+
+    def __init__(self, fn, resume=None):
+        self.fn = compressedFilename(fn)
+        self.cnt = 0
+
+        if resume:
+            os.truncate(self.fn, resume['size'])
+            self.f = openText(self.fn, 'a')
+            self.cnt = resume['cnt']
+            return
+
+        self.f = openText(self.fn, 'w')
+        self.f.write('[')
+
+    def write(self, obj):
+        with metrics.timer('render'):
+            text = json.dumps(obj, indent=4).replace('\n', '\n    ')
+        with metrics.timer('write'):
+            self.f.write(',\n    ' if self.cnt else '\n    ')
+            self.f.write(text)
+        self.cnt += 1
+
+    def state(self):
+        """Flush to disk and return what is needed to resume writing, see checkpoint.py"""
+
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return {'size': os.path.getsize(self.fn), 'cnt': self.cnt}
+
+    def close(self):
+        if self.f:
+            self.f.write('\n]' if self.cnt else ']')
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Usage:  benchmark.py run [--sizes 100,1000,5000] [--repeat 3] [--output results.json]
+        benchmark.py compare <baseline.json> <results.json> [--threshold 10]
+        benchmark.py fetch [--concurrency 1,4,16,32] [--mode crawl|get] [--latency 0.05]
+
+Converter benchmarks on synthetic Reactome fixtures
+
+For every size a fixture is generated with synthetic_reactome.py and the
+converter runs offline against it, timing
+
+  getReactions.build   pathway index built from the hierarchy XML
+  getReactions.load    reactions answered from the saved pathway index
+  toBel                all reaction participants, conversion cache cleared
+  buildStatements      statements from already converted participants
+  render               statement groups rendered into a BEL script
+  buildBelEvidences    end to end, entity and conversion caches cleared
+
+Results are written as JSON keyed by the git commit so a run on one commit
+can be compared against a run on another.
+
+benchmark.py fetch measures the fetch layer instead: it crawls a fixture
+served by fake_reactome_server.py with injected latency, errors and rate
+limits at several concurrency levels and reports throughput and the client's
+tail latencies.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from processReactome import buildStatements, buildContext, buildBelEvidences, convertReaction, TEMPLATE_ENVIRONMENT, template_filename
+import reactome_webservice
+from reactome_webservice import getEntityData, getReactions, setEntityStore, setOffline, preloadEntities, setEntityCacheSize, setWsUrl, setBatchSize
+from toBel import toBel, renderBel, dedup, setBelVersion, setBelCacheSize, clearBelCache, getBelCacheStats
+from belscript_writer import BelScriptWriter
+from pathway_index import indexFilename
+from synthetic_reactome import generateFixture
+from fake_reactome_server import fixtureServer
+from prefetch import prefetchEntities
+from reactome_client import configureClient
+from entity_store import openEntityStore
+
+import logging
+log = logging.getLogger('root')
+
+resultsFormat = 1
+benchmarkSpecies = 'Homo sapiens'
+benchmarkRelease = 'benchmark'
+
+
+def gitCommit():
+    """Current git commit and whether the working tree has local changes"""
+
+    path = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=path, stderr=subprocess.DEVNULL).decode().strip()
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=path, stderr=subprocess.DEVNULL).decode()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, bool(status.strip())
+
+
+def timeStage(fn, repeat, setup=None):
+    """Run fn repeat times, setup before each run is not timed
+
+    Returns:
+        dict with min/median/mean seconds and the individual runs
+    """
+
+    runs = []
+    for i in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+
+    return {
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'mean': statistics.mean(runs),
+        'runs': runs,
+    }
+
+
+def participants(rxnData):
+    """dbIds of catalysts, inputs and outputs the way convertReaction walks them"""
+
+    catalysts = [c['dbId'] for c in rxnData.get('catalystActivity', [])]
+    inputs = [i['dbId'] for i in dedup(rxnData.get('input', []))]
+    outputs = [o['dbId'] for o in dedup(rxnData.get('output', []))]
+    return catalysts, inputs, outputs
+
+
+def benchmarkSize(size, workDir, repeat, belversion, fanout, depth, sharing, seed):
+    """Generate a fixture of size reactions in workDir and time every stage"""
+
+    start = time.perf_counter()
+    fixture = generateFixture(workDir, reactions=size, fanout=fanout, depth=depth, sharing=sharing, seed=seed)
+    generateTime = time.perf_counter() - start
+
+    setEntityStore(fixture['store'])
+    setOffline(True)
+    setBelVersion(belversion)
+    setBelCacheSize(0)
+    setEntityCacheSize(0)
+
+    stages = {}
+    indexFn = indexFilename(benchmarkSpecies, benchmarkRelease)
+
+    def dropIndex():
+        if os.path.isfile(indexFn):
+            os.remove(indexFn)
+
+    def collectReactions():
+        return getReactions(benchmarkSpecies, xmlFn=fixture['hierarchy'], release=benchmarkRelease)
+
+    stages['getReactions.build'] = timeStage(collectReactions, repeat, setup=dropIndex)
+    stages['getReactions.load'] = timeStage(collectReactions, repeat)
+    reactionList = sorted(collectReactions())
+
+    # Stages below measure conversion, not entity store reads
+    preloadEntities()
+    rxnParticipants = [participants(getEntityData(rxnId)) for rxnId, rxnName in reactionList]
+
+    def convertParticipants():
+        for catalysts, inputs, outputs in rxnParticipants:
+            for dbId in catalysts + inputs + outputs:
+                toBel(dbId)
+
+    stages['toBel'] = timeStage(convertParticipants, repeat, setup=clearBelCache)
+    belCacheStats = getBelCacheStats()
+
+    converted = [([renderBel(toBel(dbId)) for dbId in catalysts], [renderBel(toBel(dbId)) for dbId in inputs], [renderBel(toBel(dbId)) for dbId in outputs])
+                 for catalysts, inputs, outputs in rxnParticipants]
+
+    def statements():
+        for catalysts, inputs, outputs in converted:
+            buildStatements(catalysts, inputs, outputs)
+
+    stages['buildStatements'] = timeStage(statements, repeat)
+
+    evidences = [result[0] for result in (convertReaction(rxnId) for rxnId, rxnName in reactionList) if result]
+    template = TEMPLATE_ENVIRONMENT.get_template(template_filename)
+    context = buildContext([])
+
+    def render():
+        with BelScriptWriter(os.path.join(workDir, 'render.bels'), template, context) as belscript:
+            for evidence in evidences:
+                belscript.write(evidence)
+
+    stages['render'] = timeStage(render, repeat)
+
+    def resetCaches():
+        clearBelCache()
+        reactome_webservice.entityCache.clear()
+
+    stages['buildBelEvidences'] = timeStage(lambda: buildBelEvidences(reactionList, belversion), repeat, setup=resetCaches)
+
+    return {
+        'fixture': {
+            'reactions': len(reactionList),
+            'entities': fixture['entities'],
+            'generateSeconds': generateTime,
+        },
+        'stages': stages,
+        'reactionsPerSecond': len(reactionList) / stages['buildBelEvidences']['median'],
+        'belCache': belCacheStats,
+    }
+
+
+def runBenchmarks(sizes, repeat=3, belversion='1', fanout=3, depth=3, sharing=0.8, seed=1, keep=False):
+    """Benchmark every fixture size
+
+    Each size runs in its own temporary directory, which is also the working
+    directory while it runs so outputs and pathway indexes stay out of the tree.
+
+    Returns:
+        results dict, see resultsFormat
+    """
+
+    commit, dirty = gitCommit()
+    results = {
+        'format': resultsFormat,
+        'commit': commit,
+        'dirty': dirty,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'belversion': belversion,
+        'repeat': repeat,
+        'fixture': {'fanout': fanout, 'depth': depth, 'sharing': sharing, 'seed': seed},
+        'sizes': {},
+    }
+
+    cwd = os.getcwd()
+    for size in sizes:
+        workDir = tempfile.mkdtemp(prefix='reactome-benchmark-{}-'.format(size))
+        os.chdir(workDir)
+        try:
+            results['sizes'][str(size)] = benchmarkSize(size, workDir, repeat, belversion, fanout, depth, sharing, seed)
+        finally:
+            os.chdir(cwd)
+            if keep:
+                log.info('Kept benchmark fixture {}'.format(workDir))
+            else:
+                shutil.rmtree(workDir, ignore_errors=True)
+
+        for stage, timing in results['sizes'][str(size)]['stages'].items():
+            log.info('Size: {}  {:<20} median {:.4f}s'.format(size, stage, timing['median']))
+
+    return results
+
+
+def fetchLevel(server, reactionList, dbIds, concurrency, mode='crawl', batchSize=100, retries=5, backoff=0.1):
+    """Fetch a fixture through the webservice layer into an empty entity store
+
+    Inputs:
+        mode   crawl - prefetchEntities over the reactions with batched requests
+               get   one queryById request per entity from a thread pool
+
+    Returns:
+        dict with throughput, client latency stats and server request counts
+    """
+
+    storeDir = tempfile.mkdtemp(prefix='fetch-{}-'.format(concurrency))
+    setEntityStore(storeDir)
+    reactome_webservice.entityCache.clear()
+    setWsUrl(server.url)
+    setOffline(False)
+    setBatchSize(batchSize)
+    client = configureClient(retries=retries, backoff=backoff, maxBackoff=5, poolSize=max(concurrency, 10))
+    serverBefore = server.stats()
+
+    start = time.perf_counter()
+    if mode == 'crawl':
+        entities = prefetchEntities(reactionList, workers=concurrency)['entities']
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            entities = sum(1 for entity in executor.map(getEntityData, dbIds) if entity is not None)
+    seconds = time.perf_counter() - start
+
+    serverAfter = server.stats()
+    shutil.rmtree(storeDir, ignore_errors=True)
+
+    return {
+        'concurrency': concurrency,
+        'mode': mode,
+        'batchSize': batchSize,
+        'entities': entities,
+        'seconds': seconds,
+        'entitiesPerSecond': entities / seconds if seconds else 0.0,
+        'client': client.stats(),
+        'server': {name: serverAfter.get(name, 0) - serverBefore.get(name, 0) for name in serverAfter},
+    }
+
+
+def runFetchBenchmarks(levels, reactions=500, mode='crawl', batchSize=100, latency=0.02, jitter=0.02, errorRate=0.0,
+                       rateLimit=None, retries=5, backoff=0.1):
+    """Fetch a served synthetic fixture at every concurrency level
+
+    Returns:
+        results dict with a 'fetch' list, one entry per level
+    """
+
+    commit, dirty = gitCommit()
+    results = {
+        'format': resultsFormat,
+        'commit': commit,
+        'dirty': dirty,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'server': {'reactions': reactions, 'latency': latency, 'jitter': jitter, 'errorRate': errorRate, 'rateLimit': rateLimit},
+        'fetch': [],
+    }
+
+    fixtureDir = tempfile.mkdtemp(prefix='reactome-fetch-')
+    cwd = os.getcwd()
+    os.chdir(fixtureDir)
+    try:
+        server, fixture = fixtureServer(reactions, fixtureDir=fixtureDir, latency=latency, jitter=jitter,
+                                        errorRate=errorRate, rateLimit=rateLimit, seed=1)
+        dbIds = [dbId for dbId, entity in openEntityStore(fixture['store']).items()]
+        with server:
+            for concurrency in levels:
+                level = fetchLevel(server, fixture['reactionList'], dbIds, concurrency, mode=mode, batchSize=batchSize,
+                                   retries=retries, backoff=backoff)
+                results['fetch'].append(level)
+                log.info('Concurrency: {}  {:.1f} entities/s  p50 {:.4f}s  p99 {:.4f}s'.format(
+                    concurrency, level['entitiesPerSecond'], level['client']['latency_p50'], level['client']['latency_p99']))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(fixtureDir, ignore_errors=True)
+
+    return results
+
+
+def writeResults(results, output, prefix=''):
+    """Write results JSON, default benchmarks/<prefix><commit>-<date>.json"""
+
+    if not output:
+        output = 'benchmarks/{}{}{}-{}.json'.format(prefix, results['commit'], '-dirty' if results['dirty'] else '', time.strftime('%Y%m%d-%H%M%S'))
+    dirname = os.path.dirname(output)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=4)
+    return output
+
+
+def compareResults(baseline, results, threshold=10.0):
+    """Median timing changes between two result sets
+
+    Returns:
+        list of (size, stage, baseline median, median, change in percent, regression flag)
+    """
+
+    rows = []
+    for size in sorted(set(baseline.get('sizes', {})) & set(results.get('sizes', {})), key=int):
+        baseStages = baseline['sizes'][size]['stages']
+        stages = results['sizes'][size]['stages']
+        for stage in baseStages:
+            if stage not in stages:
+                continue
+            before = baseStages[stage]['median']
+            after = stages[stage]['median']
+            change = (after - before) / before * 100 if before else 0.0
+            rows.append((size, stage, before, after, change, change > threshold))
+    return rows
+
+
+@click.group()
+def main():
+    """Benchmark the Reactome to BEL converter on synthetic fixtures"""
+
+
+@main.command()
+@click.option('--sizes', default='100,1000,5000', help="Comma separated numbers of reactions")
+@click.option('--repeat', default=3, type=int, help="Runs per stage, the median is compared")
+@click.option('--belversion', '-b', default='1', type=click.Choice(['1', '2']))
+@click.option('--fanout', default=3, type=int, help="Max inputs/outputs per reaction and components per complex")
+@click.option('--depth', default=3, type=int, help="Max nesting depth of complexes and sets")
+@click.option('--sharing', default=0.8, type=float, help="0..1, higher means more reuse of the same participants")
+@click.option('--seed', default=1, type=int, help="Fixture random seed")
+@click.option('--output', '-o', default=None, help="Results file, default benchmarks/<commit>-<date>.json")
+@click.option('--keep', is_flag=True, default=False, help="Keep the generated fixtures")
+def run(sizes, repeat, belversion, fanout, depth, sharing, seed, output, keep):
+    """Time the converter stages at several fixture sizes
+
+    Example:  ./benchmark.py run --sizes 100,1000 --repeat 5
+    """
+    sizes = [int(size) for size in sizes.split(',') if size.strip()]
+    results = runBenchmarks(sizes, repeat=repeat, belversion=belversion, fanout=fanout, depth=depth, sharing=sharing, seed=seed, keep=keep)
+
+    output = writeResults(results, output)
+    print('Results: {}'.format(output))
+
+
+@main.command()
+@click.option('--concurrency', default='1,4,16,32', help="Comma separated numbers of concurrent fetches")
+@click.option('--mode', default='crawl', type=click.Choice(['crawl', 'get']), help="Batched prefetch crawl or one GET per entity")
+@click.option('--reactions', default=500, type=int, help="Reactions in the served fixture")
+@click.option('--batch-size', default=100, type=int, help="dbIds per batched request in crawl mode")
+@click.option('--latency', default=0.02, type=float, help="Server delay per response in seconds")
+@click.option('--jitter', default=0.02, type=float, help="Mean extra exponentially distributed server delay in seconds")
+@click.option('--error-rate', default=0.0, type=float, help="Fraction of requests the server answers with 503")
+@click.option('--rate-limit', default=None, type=float, help="Server side requests per second before answering 429")
+@click.option('--retries', default=5, type=int, help="Client retries per request")
+@click.option('--backoff', default=0.1, type=float, help="Client first retry delay in seconds")
+@click.option('--output', '-o', default=None, help="Results file, default benchmarks/fetch-<commit>-<date>.json")
+def fetch(concurrency, mode, reactions, batch_size, latency, jitter, error_rate, rate_limit, retries, backoff, output):
+    """Fetch throughput and tail latency against a local fake Reactome server
+
+    Example:  ./benchmark.py fetch --mode get --concurrency 1,8,32 --latency 0.05 --error-rate 0.01
+    """
+    levels = [int(level) for level in concurrency.split(',') if level.strip()]
+    results = runFetchBenchmarks(levels, reactions=reactions, mode=mode, batchSize=batch_size, latency=latency, jitter=jitter,
+                                 errorRate=error_rate, rateLimit=rate_limit, retries=retries, backoff=backoff)
+
+    print('{:>11} {:>9} {:>11} {:>9} {:>9} {:>9} {:>8} {:>7} {:>9}'.format(
+        'concurrency', 'entities', 'entities/s', 'p50', 'p95', 'p99', 'retries', 'errors', 'requests'))
+    for level in results['fetch']:
+        client = level['client']
+        print('{:>11} {:>9} {:>11.1f} {:>9.4f} {:>9.4f} {:>9.4f} {:>8} {:>7} {:>9}'.format(
+            level['concurrency'], level['entities'], level['entitiesPerSecond'], client['latency_p50'], client['latency_p95'],
+            client['latency_p99'], client['retries'], client['errors'], level['server'].get('requests', 0)))
+
+    output = writeResults(results, output, prefix='fetch-')
+    print('Results: {}'.format(output))
+
+
+@main.command()
+@click.argument('baseline')
+@click.argument('results')
+@click.option('--threshold', default=10.0, type=float, help="Percent slowdown of a median reported as regression")
+def compare(baseline, results, threshold):
+    """Compare two benchmark result files, exit status 1 on regressions
+
+    Example:  ./benchmark.py compare benchmarks/3be9a6f-*.json benchmarks/a9f51d7-*.json
+    """
+    with open(baseline, 'r') as f:
+        baseline = json.load(f)
+    with open(results, 'r') as f:
+        results = json.load(f)
+
+    print('{} -> {}'.format(baseline['commit'], results['commit']))
+    rows = compareResults(baseline, results, threshold=threshold)
+    for size, stage, before, after, change, regression in rows:
+        print('{:>7} {:<20} {:>10.4f}s {:>10.4f}s {:>+8.1f}%{}'.format(size, stage, before, after, change, '  REGRESSION' if regression else ''))
+
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Usage:  bulk_import.py entities <source>... [--store downloadedEntities]
+        bulk_import.py hierarchy <species> <xmlFn> [--release 55]
+
+Offline import of a locally downloaded Reactome export into the entity store
+
+Sources can be
+  - a directory of exported objects (*.json, *.json.gz, *.json.zst), each
+    file holding one object or a list of objects
+  - a JSON lines file (*.jsonl, *.ndjson, optionally .gz or .zst) with one
+    object per line
+  - a JSON file (optionally .gz or .zst) holding one large list of objects, which
+    is read incrementally rather than loaded in one go
+
+Objects are stored as is, so they must have the shape queryById/DatabaseObject
+of the RESTful API returns: a dbId, schemaClass and displayName, with
+referenced entities as nested objects carrying their dbId.  Anything else -
+e.g. a ContentService export referring to entities by stId strings - is
+rejected with an error rather than stored; there is no adapter for other
+shapes.  Together with an imported pathway hierarchy this lets
+processReactome.py --offline run without network.
+"""
+
+import os
+import re
+import json
+import shutil
+
+import click
+
+import reactome_webservice
+from reactome_webservice import hierarchyFilename, loadPathwayIndex
+from prefetch import referenceKeys
+from pathway_index import indexFilename
+from entity_store import openEntityStore
+from compression import openText, plainFilename
+
+import logging
+log = logging.getLogger('root')
+
+# Whitespace and list separators between objects in a JSON list
+separatorRegex = re.compile(r'[\s,]*')
+
+# Keys of every queryById/DatabaseObject object - the shape conversion reads
+requiredKeys = ('dbId', 'schemaClass', 'displayName')
+
+
+def openSource(fn):
+    """Open plain, gzip or zstd compressed text file"""
+
+    return openText(fn, 'r')
+
+
+def iterJsonLines(fn):
+    """Objects from a JSON lines file"""
+
+    with openSource(fn) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iterJsonArray(fn, chunkSize=1 << 20):
+    """Objects from a file holding a JSON list (or a single object), read incrementally"""
+
+    decoder = json.JSONDecoder()
+    with openSource(fn) as f:
+        buf = f.read(chunkSize).lstrip()
+        if not buf.startswith('['):
+            # Single object per file - small enough to load in one go
+            yield json.loads(buf + f.read())
+            return
+
+        pos = 1
+        eof = False
+        while True:
+            match = separatorRegex.match(buf, pos)
+            pos = match.end()
+            if buf.startswith(']', pos):
+                return
+
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                # Object continues in the next chunk - drop consumed text and read on
+                chunk = f.read(chunkSize)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+
+            yield obj
+            pos = end
+
+
+def iterExportObjects(source):
+    """All objects in source - a directory, JSON lines file or JSON file"""
+
+    if os.path.isdir(source):
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for fn in sorted(filenames):
+                if plainFilename(fn).endswith(('.json', '.jsonl', '.ndjson')):
+                    for obj in iterExportObjects(os.path.join(dirpath, fn)):
+                        yield obj
+        return
+
+    if plainFilename(source).endswith(('.jsonl', '.ndjson')):
+        objects = iterJsonLines(source)
+    else:
+        objects = iterJsonArray(source)
+
+    for obj in objects:
+        if isinstance(obj, list):
+            for item in obj:
+                yield item
+        else:
+            yield obj
+
+
+def exportObjectProblem(obj):
+    """Why obj does not have the queryById/DatabaseObject shape, None if it does"""
+
+    if not isinstance(obj, dict):
+        return 'not an object'
+
+    missing = [key for key in requiredKeys if key not in obj]
+    if missing:
+        return 'missing {}'.format(', '.join(missing))
+    if not str(obj['dbId']).isdigit():
+        return 'dbId {!r} is not numeric'.format(obj['dbId'])
+
+    for key in referenceKeys:
+        value = obj.get(key)
+        if not value:
+            continue
+        for ref in value if isinstance(value, list) else [value]:
+            if not isinstance(ref, dict) or 'dbId' not in ref:
+                return '{} refers to {!r} instead of a nested object with a dbId (ContentService export?)'.format(key, ref)
+    return None
+
+
+def importEntities(sources, store, batchSize=5000):
+    """Fill entity store from local export sources
+
+    Raises ValueError on the first object without the queryById/DatabaseObject
+    shape - objects of earlier batches are already stored.
+
+    Returns:
+        dict with number of objects imported
+    """
+
+    imported = 0
+    batch = []
+    for source in sources:
+        for obj in iterExportObjects(source):
+            problem = exportObjectProblem(obj)
+            if problem:
+                raise ValueError('Cannot import {} object {}: {}'.format(
+                    source, obj.get('dbId', obj.get('stId')) if isinstance(obj, dict) else repr(obj)[:80], problem))
+            batch.append((str(obj['dbId']), obj))
+            if len(batch) >= batchSize:
+                imported += store.putMany(batch)
+                batch = []
+                log.info('importEntities  Imported: {}'.format(imported))
+        imported += store.putMany(batch)
+        batch = []
+
+    stats = {'imported': imported}
+    log.info('importEntities  {}'.format(stats))
+    return stats
+
+
+def importHierarchy(species, xmlFn, release=None):
+    """Install a local pathway hierarchy XML for species and build its pathway index"""
+
+    release = release or reactome_webservice.defaultRelease
+    destFn = hierarchyFilename(species, release)
+    dirname = os.path.dirname(destFn)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    shutil.copyfile(xmlFn, destFn)
+
+    # Drop any index built from an earlier hierarchy for this release
+    if os.path.isfile(indexFilename(species, release)):
+        os.remove(indexFilename(species, release))
+    reactome_webservice.pathwayIndexes.pop((species, str(release)), None)
+
+    return loadPathwayIndex(species, release=release, xmlFn=destFn)
+
+
+@click.group()
+def main():
+    """Import a locally downloaded Reactome export for offline conversion"""
+
+
+@main.command()
+@click.argument('sources', nargs=-1, required=True)
+@click.option('--store', default='./downloadedEntities', help="Entity store to fill - a directory or a *.sqlite file")
+@click.option('--compress', is_flag=True, default=False, help="Compress entities - zlib in a new SQLite store, gzip files in a directory")
+@click.option('--batch-size', default=5000, type=int, help="Objects written per store transaction")
+def entities(sources, store, compress, batch_size):
+    """Import exported Reactome objects into the entity store
+
+    Example:  ./bulk_import.py entities reactome_export/ --store entities.sqlite
+    """
+    entityStore = openEntityStore(store, compress=compress)
+    try:
+        stats = importEntities(sources, entityStore, batchSize=batch_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        entityStore.close()
+    print('Imported {imported} objects'.format(**stats))
+
+
+@main.command()
+@click.argument('species')
+@click.argument('xmlfn')
+@click.option('--release', default=None, help="Reactome release of the hierarchy")
+def hierarchy(species, xmlfn, release):
+    """Install a downloaded pathway hierarchy XML for a species
+
+    Example:  ./bulk_import.py hierarchy "Homo sapiens" homo_sapiens_hierarchy.xml --release 55
+    """
+    index = importHierarchy(species, xmlfn, release=release)
+    print('{}: {} pathways, {} reactions'.format(species, len(index.pathways), len(index.reactions)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bounded in-memory caches shared by the conversion modules
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Least-recently-used cache with hit/miss/eviction counters
+
+    A maxsize of None or 0 means unbounded.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        """Return cached value and mark it as recently used"""
+
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """Store value, evicting the least recently used entries if full"""
+
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if self.maxsize:
+                while len(self.data) > self.maxsize:
+                    self.data.popitem(last=False)
+                    self.evictions += 1
+
+    def resize(self, maxsize):
+        """Change capacity, evicting immediately if shrinking"""
+
+        with self.lock:
+            self.maxsize = maxsize
+            if maxsize:
+                while len(self.data) > maxsize:
+                    self.data.popitem(last=False)
+                    self.evictions += 1
+
+    def clear(self):
+        """Drop all entries and reset counters"""
+
+        with self.lock:
+            self.data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Cache statistics as a dict"""
+
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Checkpoints of long conversion runs
+
+Every written reaction and its converted evidence is appended to a JSON
+lines checkpoint file.  Records are buffered and saved every interval
+seconds together with the state of the outputs (file sizes and counts) at
+that point, then fsynced - a crash loses at most one interval of work.
+
+    {"checkpoint": 1, "settings": {...}}                            header
+    {"rxnId": "109581", "result": {"1": [evidence, false]}}         reaction
+    {"saved": 1530000000.0, "outputs": {"reactome.bels": {...}}}    save point
+
+On --resume reactions recorded before the last save point are skipped.
+Plain outputs are truncated to their size at the save point and appended
+to; compressed, sharded or deduplicated outputs cannot be appended to, so
+they are written again from the checkpointed evidence instead of
+reconverting.  Reactions without a result are not recorded and are
+retried on resume.
+"""
+
+import os
+import json
+import time
+
+import logging
+log = logging.getLogger('root')
+
+checkpointFormat = 1
+
+
+class Checkpoint(object):
+    """Completed reactions and their converted evidence, saved as the run goes
+
+    Inputs:
+        fn          checkpoint filename
+        settings    run settings - a checkpoint written with other settings is not resumed
+        interval    seconds between saves
+    """
+
+    def __init__(self, fn, settings, interval=60.0):
+        self.fn = fn
+        self.settings = settings
+        self.interval = interval
+
+        self.done = set()  # rxnIds recorded before the last save point
+        self.outputs = None  # output state at the last save point, None if outputs cannot be appended to
+        self.validBytes = 0  # checkpoint file length up to the last save point
+
+        self.f = None
+        self.outputState = None
+        self.pending = []
+        self.lastSave = time.time()
+        self.saves = 0
+
+    def load(self):
+        """Load reactions recorded before the last save point, returns True if the checkpoint can be resumed"""
+
+        if not os.path.isfile(self.fn):
+            log.info('No checkpoint {} - starting from scratch'.format(self.fn))
+            return False
+
+        done = set()
+        recorded = []
+        offset = 0
+        with open(self.fn, 'rb') as f:
+            for lineNo, line in enumerate(f):
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # Torn write at the end of a crashed run
+                    break
+                offset += len(line)
+
+                if lineNo == 0:
+                    if record.get('checkpoint') != checkpointFormat or record.get('settings') != self.settings:
+                        log.warning('Checkpoint {} was written with other settings - starting from scratch'.format(self.fn))
+                        return False
+                elif 'rxnId' in record:
+                    recorded.append(str(record['rxnId']))
+                elif 'saved' in record:
+                    done.update(recorded)
+                    recorded = []
+                    self.outputs = record['outputs']
+                    self.validBytes = offset
+                else:
+                    break
+
+        if not self.validBytes:
+            log.info('Checkpoint {} has no save point yet - starting from scratch'.format(self.fn))
+            return False
+
+        self.done = done
+        log.info('Resuming from checkpoint {}  Reactions done: {}'.format(self.fn, len(done)))
+        return True
+
+    def canAppend(self):
+        """True if every output still holds at least what the last save point recorded"""
+
+        if not self.outputs:
+            return False
+        for fn, state in self.outputs.items():
+            if not os.path.isfile(fn) or os.path.getsize(fn) < state['size']:
+                log.warning('{} is shorter than at the last checkpoint - writing outputs again'.format(fn))
+                return False
+        return True
+
+    def replay(self):
+        """(rxnId, result) of every reaction recorded before the last save point"""
+
+        with open(self.fn, 'rb') as f:
+            data = f.read(self.validBytes)
+
+        for line in data.splitlines()[1:]:
+            record = json.loads(line.decode('utf-8'))
+            if 'rxnId' in record:
+                yield record['rxnId'], {version: tuple(item) for version, item in record['result'].items()}
+
+    def start(self, outputState):
+        """Open the checkpoint for recording, after the last save point when resuming
+
+        outputState is a function returning the output state saved with every
+        save point, or None when outputs cannot be appended to.
+        """
+
+        self.outputState = outputState
+        if self.validBytes:
+            os.truncate(self.fn, self.validBytes)
+            self.f = open(self.fn, 'a', encoding='utf-8')
+        else:
+            dirname = os.path.dirname(self.fn)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            self.f = open(self.fn, 'w', encoding='utf-8')
+            self.f.write(json.dumps({'checkpoint': checkpointFormat, 'settings': self.settings}) + '\n')
+        self.lastSave = time.time()
+
+    def record(self, rxnId, result):
+        """Record a reaction whose evidences were written, saving when the interval has passed"""
+
+        if result:
+            self.pending.append(json.dumps({'rxnId': rxnId, 'result': result}, separators=(',', ':')) + '\n')
+        if time.time() - self.lastSave >= self.interval:
+            self.save()
+
+    def save(self):
+        """Write recorded reactions and a save point with the current output state"""
+
+        self.pending.append(json.dumps({'saved': time.time(), 'outputs': self.outputState()}) + '\n')
+        self.f.write(''.join(self.pending))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.pending = []
+        self.lastSave = time.time()
+        self.saves += 1
+
+    def close(self):
+        if self.f:
+            self.f.close()
+            self.f = None
+
+    def finish(self):
+        """Run completed - the checkpoint is no longer needed"""
+
+        self.close()
+        if os.path.isfile(self.fn):
+            os.remove(self.fn)
+        log.info('Checkpoint {} removed after {} saves'.format(self.fn, self.saves))
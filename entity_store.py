@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Usage:  entity_store.py migrate <srcDir> <dbFn> [--compress]
+        entity_store.py compress <dir> [--compression gzip]
+        entity_store.py stats <store>
+
+Storage backends for downloaded Reactome entities
+
+  DirectoryStore   one pretty-printed JSON file per dbId (original layout),
+                   or compact gzip/zstd compressed JSON files
+  SqliteStore      single SQLite file, dbId primary key, compact JSON with
+                   optional zlib compression
+
+Both backends offer get/put/putMany/items/close so reactome_webservice can
+use either one behind getEntityData.
+"""
+
+import os
+import glob
+import json
+import sqlite3
+import threading
+import zlib
+
+import click
+
+import compression
+from compression import compressedFilename, detectCompression, plainFilename, openText
+
+import logging
+log = logging.getLogger('root')
+
+
+def encodeEntity(entity, compress=False):
+    """Compact JSON encoding of an entity, optionally zlib compressed"""
+
+    data = json.dumps(entity, separators=(',', ':')).encode('utf-8')
+    if compress:
+        data = zlib.compress(data)
+    return data
+
+
+def decodeEntity(data, compress=False):
+    """Inverse of encodeEntity"""
+
+    if compress:
+        data = zlib.decompress(data)
+    return json.loads(data.decode('utf-8'))
+
+
+class DirectoryStore(object):
+    """One JSON file per dbId - the original downloadedEntities layout
+
+    With compression (gzip or zstd) entities are written as compact
+    <dbId>.json.gz or <dbId>.json.zst files.  Entities are read whatever they
+    were written with, so plain and compressed files can be mixed.
+    """
+
+    def __init__(self, path='./downloadedEntities', compression=None):
+        self.path = path
+        self.compression = None if compression == 'none' else compression
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        # The suffix this store writes is tried first
+        suffix = compressedFilename('.json', self.compression)
+        self.suffixes = [suffix] + [s for s in readSuffixes() if s != suffix]
+
+    def filename(self, dbId, suffix='.json'):
+        return '{}/{}{}'.format(self.path, dbId, suffix)
+
+    def __contains__(self, dbId):
+        return any(os.path.isfile(self.filename(dbId, suffix)) for suffix in self.suffixes)
+
+    def get(self, dbId):
+        """Return entity or None if not stored"""
+
+        for suffix in self.suffixes:
+            try:
+                with openText(self.filename(dbId, suffix), 'r') as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                continue
+        return None
+
+    def put(self, dbId, entity):
+        # Write then rename so concurrent fetches never leave a truncated file behind - the
+        # tmp file is per process and thread, forked workers share their main thread ident
+        fn = self.filename(dbId, self.suffixes[0])
+        tmpFn = compressedFilename('{}.{}-{}.tmp'.format(fn, os.getpid(), threading.current_thread().ident), detectCompression(fn))
+        with openText(tmpFn, 'w') as f:
+            if self.compression:
+                json.dump(entity, f, separators=(',', ':'))
+            else:
+                json.dump(entity, f, indent=4)
+        os.replace(tmpFn, fn)
+
+    def putMany(self, items):
+        """Store (dbId, entity) pairs, returns count stored"""
+
+        cnt = 0
+        for dbId, entity in items:
+            self.put(dbId, entity)
+            cnt += 1
+        return cnt
+
+    def files(self):
+        """Iterate over (dbId, filename) of all stored entity files"""
+
+        for suffix in readSuffixes():
+            for fn in glob.iglob('{}/*{}'.format(self.path, suffix)):
+                yield os.path.basename(plainFilename(fn))[:-len('.json')], fn
+
+    def items(self):
+        """Iterate over (dbId, entity) for all stored entities"""
+
+        seen = set()
+        for dbId, fn in self.files():
+            if dbId in seen:
+                continue
+            seen.add(dbId)
+            with openText(fn, 'r') as f:
+                yield dbId, json.load(f)
+
+    def __len__(self):
+        return len(set(dbId for dbId, fn in self.files()))
+
+    def reopen(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteStore(object):
+    """Single-file entity store - ship a warm cache between machines as one file
+
+    The compression setting is recorded in the file on creation and used on
+    every later open, so readers do not need to know how it was written.
+    """
+
+    def __init__(self, path, compress=False):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = None
+        self.compress = compress
+        self.reopen()
+
+    def reopen(self):
+        """(Re)connect - required after fork() as SQLite connections are not fork safe"""
+
+        with self.lock:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS entities (dbId INTEGER PRIMARY KEY, data BLOB NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'compression'").fetchone()
+            if row:
+                self.compress = row[0] == 'zlib'
+            else:
+                self.conn.execute("INSERT INTO meta VALUES ('compression', ?)", ('zlib' if self.compress else 'none',))
+            self.conn.commit()
+
+    def __contains__(self, dbId):
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM entities WHERE dbId = ?', (int(dbId),)).fetchone()
+        return row is not None
+
+    def get(self, dbId):
+        """Return entity or None if not stored"""
+
+        with self.lock:
+            row = self.conn.execute('SELECT data FROM entities WHERE dbId = ?', (int(dbId),)).fetchone()
+        if row is None:
+            return None
+        return decodeEntity(row[0], self.compress)
+
+    def put(self, dbId, entity):
+        data = encodeEntity(entity, self.compress)
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO entities VALUES (?, ?)', (int(dbId), data))
+            self.conn.commit()
+
+    def putMany(self, items):
+        """Store (dbId, entity) pairs in a single transaction, returns count stored"""
+
+        rows = [(int(dbId), encodeEntity(entity, self.compress)) for dbId, entity in items]
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO entities VALUES (?, ?)', rows)
+            self.conn.commit()
+        return len(rows)
+
+    def items(self):
+        """Iterate over (dbId, entity) for all stored entities"""
+
+        lastId = -1
+        while True:
+            # Fetch in batches so the lock is not held while the caller works
+            with self.lock:
+                rows = self.conn.execute('SELECT dbId, data FROM entities WHERE dbId > ? ORDER BY dbId LIMIT 1000', (lastId,)).fetchall()
+            if not rows:
+                break
+            for dbId, data in rows:
+                yield str(dbId), decodeEntity(data, self.compress)
+            lastId = rows[-1][0]
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM entities').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.conn:
+                self.conn.close()
+                self.conn = None
+
+
+def readSuffixes():
+    """Entity file suffixes DirectoryStore can read"""
+
+    suffixes = ['.json', '.json.gz']
+    if compression.zstandard is not None:
+        suffixes.append('.json.zst')
+    return suffixes
+
+
+def openEntityStore(location, compress=None):
+    """Open entity store - *.sqlite/*.db files use SqliteStore, anything else is a directory
+
+    compress is True or a compression mode (see compression.py) - zlib for a
+    new SqliteStore, gzip or zstd files for a DirectoryStore.  By default the
+    configured compression is used.
+    """
+
+    if compress is None:
+        compress = compression.getCompression()
+    if compress == 'none':
+        compress = None
+
+    if os.path.splitext(location)[1] in ('.sqlite', '.sqlite3', '.db'):
+        return SqliteStore(location, compress=bool(compress))
+    return DirectoryStore(location, compression='gzip' if compress is True else compress)
+
+
+def compressDirectory(path, mode='gzip'):
+    """Rewrite the plain JSON files of a DirectoryStore compressed with mode, in place
+
+    Returns:
+        number of entities compressed
+    """
+
+    store = DirectoryStore(path, compression=mode)
+
+    cnt = 0
+    for fn in glob.iglob('{}/*.json'.format(path)):
+        dbId = os.path.basename(fn)[:-len('.json')]
+        with open(fn, 'r') as f:
+            store.put(dbId, json.load(f))
+        os.remove(fn)
+        cnt += 1
+        if cnt % 10000 == 0:
+            log.info('compressDirectory  Cnt: {}'.format(cnt))
+
+    log.info('compressDirectory  {}  Compression: {}  Cnt: {}'.format(path, mode, cnt))
+    return cnt
+
+
+def migrateDirectory(srcDir, dbFn, compress=False, batchSize=5000):
+    """One-shot copy of a downloadedEntities directory into a SqliteStore
+
+    Returns:
+        number of entities migrated
+    """
+
+    src = DirectoryStore(srcDir)
+    dest = SqliteStore(dbFn, compress=compress)
+
+    cnt = 0
+    batch = []
+    for dbId, entity in src.items():
+        batch.append((dbId, entity))
+        if len(batch) >= batchSize:
+            cnt += dest.putMany(batch)
+            batch = []
+            log.info('migrateDirectory  Cnt: {}'.format(cnt))
+    cnt += dest.putMany(batch)
+
+    dest.conn.execute('VACUUM')
+    dest.close()
+
+    log.info('migrateDirectory  {} -> {}  Cnt: {}'.format(srcDir, dbFn, cnt))
+    return cnt
+
+
+@click.group()
+def main():
+    """Manage the downloaded Reactome entity store"""
+
+
+@main.command()
+@click.argument('srcdir')
+@click.argument('dbfn')
+@click.option('--compress', is_flag=True, default=False, help="zlib compress stored entities")
+def migrate(srcdir, dbfn, compress):
+    """Copy a downloadedEntities directory into a single SQLite file
+
+    Example:  ./entity_store.py migrate downloadedEntities entities.sqlite --compress
+    """
+    cnt = migrateDirectory(srcdir, dbfn, compress=compress)
+    print('Migrated {} entities into {}'.format(cnt, dbfn))
+
+
+@main.command()
+@click.argument('path')
+@click.option('--compression', 'mode', default='gzip', type=click.Choice(['gzip', 'zstd']), help="Compression of the rewritten entity files")
+def compress(path, mode):
+    """Compress the JSON files of a downloadedEntities directory in place
+
+    Example:  ./entity_store.py compress downloadedEntities --compression zstd
+    """
+    compression.setCompression(mode)
+    cnt = compressDirectory(path, mode=mode)
+    print('Compressed {} entities in {}'.format(cnt, path))
+
+
+@main.command()
+@click.argument('store')
+def stats(store):
+    """Show number of stored entities"""
+
+    print('{}: {} entities'.format(store, len(openEntityStore(store))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Document-wide deduplication of BEL evidence groups and statements
+
+Converted evidences are spooled to a temporary file while a fingerprint of
+every group is indexed.  Groups with the same citation, compartment,
+reaction type and statement set - the same reaction listed for several
+species - collapse into the first one, which carries the combined Species
+and rxnIds.  A BEL statement group has a single Citation, so groups curated
+from different citations are never merged and each keeps its provenance.
+Only the index of the first group per fingerprint is kept in memory, what
+later groups add to it is spooled as well and sorted on disk by that index
+so the output pass reads it alongside the evidences.
+
+Structural statements (hasComponent, hasMember) do not depend on the
+evidence they appear in, so each one is written only the first time it
+occurs in the document.  Seen statements are kept as 64 bit blake2b
+fingerprints rather than strings, which keeps memory bounded on all-species
+runs.
+"""
+
+import os
+import json
+import heapq
+import hashlib
+import tempfile
+
+from compression import compressedFilename, openText
+
+import logging
+log = logging.getLogger('root')
+
+# Relations asserting structure rather than a curated observation
+structuralRelations = (' hasComponent ', ' hasMember ')
+
+# Merge records sorted in memory before they are written out as a sorted run
+mergeRunSize = 100000
+
+
+def fingerprint(*parts):
+    """64 bit blake2b fingerprint of strings as an int"""
+
+    h = hashlib.blake2b(digest_size=8)
+    for part in parts:
+        h.update(part.encode('utf-8'))
+        h.update(b'\x1f')
+    return int.from_bytes(h.digest(), 'big')
+
+
+def groupFingerprint(evidence):
+    """Fingerprint of the citation and assertions in a group - species and rxnId excluded"""
+
+    return fingerprint(evidence['citation'], evidence['compartment'], evidence['rxnType'], *sorted(evidence['statements']))
+
+
+def isStructural(statement):
+    return any(relation in statement for relation in structuralRelations)
+
+
+class EvidenceDeduplicator(object):
+    """Collect evidences, then yield them merged and without repeated structural statements
+
+    Inputs:
+        spoolDir   directory for the temporary spool file (default: system temp),
+                   the spool is compressed when compression is configured
+    """
+
+    def __init__(self, spoolDir=None):
+        self.spoolDir = spoolDir
+        self.spoolFn = self.tempFile('evidences-')
+        self.spool = openText(self.spoolFn, 'w')
+        self.firsts = {}  # group fingerprint -> index of its first group
+        self.merges = []  # [first index, index, species, tax id, rxnId] of merged groups not yet in a run
+        self.runs = []  # filenames of sorted runs of merge records
+        self.readers = []
+        self.cnt = 0
+        self.mergedCnt = 0
+        self.droppedStatementCnt = 0
+
+    def tempFile(self, prefix):
+        fd, fn = tempfile.mkstemp(prefix=prefix, suffix=compressedFilename('.jsonl'), dir=self.spoolDir)
+        os.close(fd)
+        return fn
+
+    def add(self, evidence):
+        key = groupFingerprint(evidence)
+        first = self.firsts.get(key)
+        if first is None:
+            self.firsts[key] = self.cnt
+        else:
+            self.mergedCnt += 1
+            self.merges.append([first, self.cnt, evidence['species'], evidence['species_tax_id'], evidence['rxnId']])
+            if len(self.merges) >= mergeRunSize:
+                self.writeRun()
+
+        self.spool.write('{}\t{}\n'.format(key, json.dumps(evidence)))
+        self.cnt += 1
+
+    def writeRun(self):
+        """Write buffered merge records sorted by first index"""
+
+        fn = self.tempFile('merges-')
+        self.runs.append(fn)
+        with openText(fn, 'w') as f:
+            for record in sorted(self.merges):
+                f.write(json.dumps(record) + '\n')
+        self.merges = []
+
+    def mergeRecords(self):
+        """All merge records in order of first index"""
+
+        self.merges.sort()
+        self.readers = [openText(fn, 'r') for fn in self.runs]
+        return heapq.merge(*[(json.loads(line) for line in reader) for reader in self.readers], self.merges)
+
+    def evidences(self, dropStructural=True):
+        """Merged evidences in order of first appearance
+
+        With dropStructural=False repeated structural statements are kept, for
+        callers that split the evidences over several documents.
+        """
+
+        self.spool.close()
+        self.spool = openText(self.spoolFn, 'r')
+
+        merges = self.mergeRecords()
+        merge = next(merges, None)
+
+        seen = set()
+        for index, line in enumerate(self.spool):
+            key, data = line.split('\t', 1)
+            if self.firsts[int(key)] != index:
+                continue
+
+            evidence = json.loads(data)
+            species, taxIds, rxnIds = [evidence['species']], [evidence['species_tax_id']], [evidence['rxnId']]
+            while merge is not None and merge[0] == index:
+                for values, value in zip((species, taxIds, rxnIds), merge[2:]):
+                    if value not in values:
+                        values.append(value)
+                merge = next(merges, None)
+
+            if len(taxIds) > 1:
+                evidence['species'] = ', '.join(species)
+                evidence['species_tax_id'] = '{{{}}}'.format(', '.join('"{}"'.format(taxId) for taxId in taxIds))
+            if len(rxnIds) > 1:
+                evidence['rxnId'] = ', '.join(str(rxnId) for rxnId in rxnIds)
+
+            statements = []
+            for statement in evidence['statements']:
+                if dropStructural and isStructural(statement):
+                    statementKey = fingerprint(statement)
+                    if statementKey in seen:
+                        self.droppedStatementCnt += 1
+                        continue
+                    seen.add(statementKey)
+                statements.append(statement)
+            evidence['statements'] = statements
+
+            yield evidence
+
+        log.info('Deduplication  Groups: {}  Merged: {}  Repeated structural statements dropped: {}'.format(
+            self.cnt, self.mergedCnt, self.droppedStatementCnt))
+
+    def close(self):
+        if self.spool:
+            self.spool.close()
+            self.spool = None
+            os.remove(self.spoolFn)
+        for reader in self.readers:
+            reader.close()
+        self.readers = []
+        for fn in self.runs:
+            os.remove(fn)
+        self.runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
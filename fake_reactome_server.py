@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Usage:  fake_reactome_server.py [<store>] [--hierarchy "Homo sapiens=hierarchy.xml"] [--port 8080]
+                                [--latency 0.05] [--jitter 0.02] [--error-rate 0.01] [--rate-limit 50]
+        fake_reactome_server.py --fixture 1000
+
+Local stand-in for the Reactome RESTfulWS
+
+Serves entities from an entity store (see entity_store.py) or a generated
+synthetic fixture, with the endpoints reactome_webservice.py uses
+
+  GET  queryById/DatabaseObject/<dbId>
+  POST queryByIds/DatabaseObject            body ID=<dbId>,<dbId>,...
+  GET  pathwayHierarchy/<species>
+  GET  pathwayComplexes/<dbId>, pathwayParticipants/<dbId>
+  GET  getReferenceMolecules, getUniProtRefSeqs
+
+Every response can be delayed by a fixed latency plus exponentially
+distributed jitter (long tail), replaced by a 503 at the given error rate
+or refused with 429 when requests exceed the server side rate limit.
+Point the converter at it with processReactome.py --ws-url <url>.
+"""
+
+import json
+import time
+import random
+import tempfile
+import threading
+from collections import Counter
+from urllib.parse import unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import click
+
+from entity_store import openEntityStore
+from reactome_client import RateLimiter
+from synthetic_reactome import generateFixture
+
+import logging
+log = logging.getLogger('root')
+
+basePath = '/ReactomeRESTfulAPI/RESTfulWS'
+
+
+class FakeReactomeHandler(BaseHTTPRequestHandler):
+    """Request handler, all state lives on the server"""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive so client connection pooling behaves as against reactome.org
+    disable_nagle_algorithm = True  # headers and body are separate writes - avoid delayed ACK stalls
+
+    def log_message(self, format, *args):
+        log.debug('FakeReactome  {}'.format(format % args))
+
+    def send(self, status, body=b'', contentType='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def sendJson(self, obj):
+        self.send(200, json.dumps(obj).encode('utf-8'))
+
+    def endpoint(self):
+        """Path below the RESTfulWS base as a list of segments"""
+
+        path = self.path.split('?')[0]
+        if path.startswith(basePath):
+            path = path[len(basePath):]
+        return [unquote(part) for part in path.strip('/').split('/')]
+
+    def handle_one(self, method):
+        body = b''
+        if self.headers.get('Content-Length'):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+
+        parts = self.endpoint()
+        name = parts[0] if parts else ''
+
+        # Injected faults are decided before the (simulated) work is done
+        status = self.server.fault(name)
+        self.server.delay()
+        if status == 429:
+            self.send(429, b'Too Many Requests', 'text/plain', {'Retry-After': '1'})
+        elif status:
+            self.send(status, b'Service Unavailable', 'text/plain')
+        else:
+            self.dispatch(method, parts, body)
+
+    def dispatch(self, method, parts, body):
+        server = self.server
+
+        if method == 'GET' and parts[:2] == ['queryById', 'DatabaseObject'] and len(parts) == 3:
+            entity = server.store.get(parts[2])
+            if entity is None:
+                self.send(404, b'', 'text/plain')
+            else:
+                self.sendJson(entity)
+
+        elif method == 'POST' and parts[:2] == ['queryByIds', 'DatabaseObject']:
+            text = body.decode('utf-8').strip()
+            if text.startswith('ID='):
+                text = text[3:]
+            entities = [server.store.get(dbId.strip()) for dbId in text.split(',') if dbId.strip()]
+            self.sendJson([entity for entity in entities if entity is not None])
+
+        elif method == 'GET' and parts[0] == 'pathwayHierarchy' and len(parts) == 2:
+            xmlFn = server.hierarchies.get(parts[1])
+            if not xmlFn:
+                self.send(404, b'', 'text/plain')
+            else:
+                with open(xmlFn, 'rb') as f:
+                    self.send(200, f.read(), 'text/xml')
+
+        elif method == 'GET' and parts[0] in ('pathwayComplexes', 'pathwayParticipants'):
+            self.sendJson(server.collection(parts[0]))
+
+        elif method == 'GET' and parts[0] in ('getReferenceMolecules', 'getUniProtRefSeqs'):
+            self.send(200, server.collection(parts[0]).encode('utf-8'), 'text/plain')
+
+        else:
+            self.send(404, b'', 'text/plain')
+
+    def do_GET(self):
+        self.handle_one('GET')
+
+    def do_POST(self):
+        self.handle_one('POST')
+
+
+class FakeReactomeServer(ThreadingHTTPServer):
+    """Threaded stand-in Reactome webservice
+
+    Inputs:
+        store         entity store (DirectoryStore, SqliteStore or a location)
+        hierarchies   dict of species -> pathway hierarchy XML filename
+        latency       fixed delay per response in seconds
+        jitter        mean of an extra exponentially distributed delay in seconds
+        errorRate     fraction of requests answered with 503
+        rateLimit     requests per second before answering 429 (None = unlimited)
+        port          0 picks a free port, see url
+    """
+
+    daemon_threads = True
+    request_queue_size = 128  # high concurrency must not overflow the listen backlog
+
+    def __init__(self, store, hierarchies=None, latency=0.0, jitter=0.0, errorRate=0.0, rateLimit=None, host='127.0.0.1', port=0, seed=None):
+        ThreadingHTTPServer.__init__(self, (host, port), FakeReactomeHandler)
+        if not hasattr(store, 'get'):
+            store = openEntityStore(store)
+        self.store = store
+        self.hierarchies = hierarchies or {}
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.rateLimiter = RateLimiter(rateLimit) if rateLimit else None
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.collections = {}
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}{}'.format(host, port, basePath)
+
+    def fault(self, name):
+        """Status code of an injected failure for this request, or None"""
+
+        with self.lock:
+            self.counts['requests'] += 1
+            self.counts[name] += 1
+            if self.rateLimiter and not self.rateLimiter.tryAcquire():
+                self.counts['throttled'] += 1
+                return 429
+            if self.errorRate and self.random.random() < self.errorRate:
+                self.counts['errors'] += 1
+                return 503
+        return None
+
+    def delay(self):
+        with self.lock:
+            seconds = self.latency + (self.random.expovariate(1.0 / self.jitter) if self.jitter else 0.0)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def collection(self, name):
+        """getSets collections derived from the stored entities, built once"""
+
+        with self.lock:
+            if name in self.collections:
+                return self.collections[name]
+
+            entities = [entity for dbId, entity in self.store.items()]
+            references = lambda classes: [
+                {'dbId': e['dbId'], 'displayName': e.get('displayName'), 'schemaClass': e['schemaClass']}
+                for e in entities if e.get('schemaClass') in classes]
+            referenceLines = lambda classes: ''.join(
+                '{}\t{}\n'.format(e['dbId'], e['referenceEntity']['displayName'])
+                for e in entities if e.get('schemaClass') in classes and 'referenceEntity' in e)
+
+            if name == 'pathwayComplexes':
+                data = references(('Complex',))
+            elif name == 'pathwayParticipants':
+                data = references(('SimpleEntity', 'EntityWithAccessionedSequence', 'Complex', 'Polymer', 'OtherEntity',
+                                   'GenomeEncodedEntity', 'DefinedSet', 'CandidateSet', 'OpenSet'))
+            elif name == 'getReferenceMolecules':
+                data = referenceLines(('SimpleEntity',))
+            else:
+                data = referenceLines(('EntityWithAccessionedSequence',))
+
+            self.collections[name] = data
+            return data
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def start(self):
+        """Serve from a background thread, returns the base url"""
+
+        self.thread = threading.Thread(target=self.serve_forever, name='FakeReactomeServer', daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def fixtureServer(reactions, fixtureDir=None, species='Homo sapiens', **kwargs):
+    """FakeReactomeServer over a freshly generated synthetic fixture
+
+    Returns:
+        (server, fixture) - see synthetic_reactome.generateFixture
+    """
+
+    fixtureDir = fixtureDir or tempfile.mkdtemp(prefix='fake-reactome-')
+    fixture = generateFixture(fixtureDir, reactions=reactions, species=[species])
+    server = FakeReactomeServer(fixture['store'], hierarchies={species: fixture['hierarchy']}, **kwargs)
+    return server, fixture
+
+
+@click.command()
+@click.argument('store', required=False)
+@click.option('--fixture', default=None, type=int, help="Serve a generated synthetic fixture with this many reactions instead of a store")
+@click.option('--hierarchy', multiple=True, help="Species=hierarchy.xml served by pathwayHierarchy, can be repeated")
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8080, type=int)
+@click.option('--latency', default=0.0, type=float, help="Fixed delay per response in seconds")
+@click.option('--jitter', default=0.0, type=float, help="Mean extra exponentially distributed delay in seconds")
+@click.option('--error-rate', default=0.0, type=float, help="Fraction of requests answered with 503")
+@click.option('--rate-limit', default=None, type=float, help="Requests per second before answering 429")
+def main(store, fixture, hierarchy, host, port, latency, jitter, error_rate, rate_limit):
+    """Run a local stand-in Reactome webservice
+
+    Example:  ./fake_reactome_server.py --fixture 1000 --latency 0.05 --jitter 0.05 --error-rate 0.01
+    """
+    options = dict(latency=latency, jitter=jitter, errorRate=error_rate, rateLimit=rate_limit, host=host, port=port)
+    if fixture:
+        server, fixtureInfo = fixtureServer(fixture, **options)
+        print('Fixture: {} reactions, {} entities in {}'.format(len(fixtureInfo['reactionList']), fixtureInfo['entities'], fixtureInfo['store']))
+    else:
+        hierarchies = dict(item.split('=', 1) for item in hierarchy)
+        server = FakeReactomeServer(store or './downloadedEntities', hierarchies=hierarchies, **options)
+
+    print('Serving {}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print('Requests: {}'.format(server.stats()))
+
+
+if __name__ == '__main__':
+    main()
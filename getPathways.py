@@ -15,10 +15,9 @@ Options:
 
 import os
 import json
-from bioservices import Reactome
 from jinja2 import Environment, FileSystemLoader
 
-s = Reactome()
+from reactome_webservice import fetchPathwayHierarchy
 
 PATH = os.path.dirname(os.path.abspath(__file__))
 TEMPLATE_ENVIRONMENT = Environment(
@@ -40,7 +39,7 @@ def getPathways():
     # with open('reactions.txt', 'w') as f:
     #     json.dump(reactions, f, indent=4)
 
-    hierarchy = s.pathway_hierarchy('homo sapiens')
+    hierarchy = fetchPathwayHierarchy('homo sapiens')
     with open('hierarchy.xml', 'w') as f:
         f.write(hierarchy)
 
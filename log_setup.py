@@ -1,3 +1,4 @@
+import copy
 import logging
 import logging.config
 
@@ -43,7 +44,7 @@ log_conf = {
         },
 
         'root': {
-            'level': 'DEBUG',
+            'level': 'INFO',
             'handlers': ['console', 'file', 'errors'],
 
         },
@@ -51,9 +52,28 @@ log_conf = {
 }
 
 
-def getLogger(name='root'):
-    logging.config.dictConfig(log_conf)
+def getLogger(name='root', level='INFO', consoleLevel=None):
+    """Configure logging, DEBUG records are only created when level is DEBUG"""
+
+    conf = copy.deepcopy(log_conf)
+    conf['loggers']['root']['level'] = level
+    conf['handlers']['console']['level'] = consoleLevel or level
+    logging.config.dictConfig(conf)
+    logger = logging.getLogger(name)
+    return logger
+
+
+def setLevel(level='INFO', consoleLevel=None, name='root'):
+    """Change logger and console levels of an already configured logger
+
+    Log files opened by getLogger are kept, so nothing logged so far is lost.
+    """
+
     logger = logging.getLogger(name)
+    logger.setLevel(level)
+    for handler in logger.handlers:
+        if type(handler) is logging.StreamHandler:
+            handler.setLevel(consoleLevel or level)
     return logger
 
 
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Conversion manifest for incremental reconversion
+
+For every converted reaction the manifest records the content hash of each
+entity the conversion depended on and the evidence it produced.  On a rerun
+a reaction whose dependency hashes are unchanged reuses the recorded
+evidence instead of being converted again.
+"""
+
+import os
+import json
+import hashlib
+
+from reactome_webservice import getEntityData
+from compression import openText, compressedFilename, detectCompression
+from prefetch import entityReferences
+
+import logging
+log = logging.getLogger('root')
+
+manifestFormat = 2
+
+# Source files whose changes invalidate every recorded conversion - everything that shapes the output
+converterSources = ['toBel.py', 'bel_terms.py', 'processReactome.py', 'evidence_dedup.py', 'shards.py', 'belscript.jinja2']
+
+
+def entityHash(entity):
+    """Content hash of an entity, independent of key order and formatting"""
+
+    data = json.dumps(entity, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def converterHash():
+    """Hash of the converter source so code changes force a full rebuild"""
+
+    path = os.path.dirname(os.path.abspath(__file__))
+    sha = hashlib.sha1()
+    for fn in converterSources:
+        with open(os.path.join(path, fn), 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+class ConversionManifest(object):
+    """Per-reaction dependency hashes and converted evidence
+
+    Inputs:
+        fn           manifest filename, loaded if it exists - gzip or zstd
+                     compressed when it ends in .gz or .zst
+        belversion   BEL version(s) of the recorded evidence - '1', '2' or 'both',
+                     a manifest written for another version or converter is ignored
+    """
+
+    def __init__(self, fn, belversion):
+        self.fn = fn
+        self.belversion = str(belversion)
+        self.converter = converterHash()
+        self.reactions = {}
+        self.hashes = {}  # dbId -> entity hash, memoized for this run
+        self.refs = {}  # dbId -> referenced dbIds, memoized for this run
+        self.reused = 0
+        self.reconverted = 0
+
+        if os.path.isfile(fn):
+            with openText(fn, 'r') as f:
+                data = json.load(f)
+            if (data.get('format') == manifestFormat and data.get('belversion') == self.belversion
+                    and data.get('converter') == self.converter):
+                self.reactions = data['reactions']
+            else:
+                log.info('Manifest {} was written for another BEL version or converter - reconverting everything'.format(fn))
+
+    def dependencyHashes(self, rxnId):
+        """Hashes of the reaction and every entity reachable from it
+
+        Returns:
+            dict of dbId -> entity hash, None for entities that cannot be loaded
+        """
+
+        deps = {}
+        queue = [str(rxnId)]
+        while queue:
+            dbId = queue.pop()
+            if dbId in deps:
+                continue
+            if dbId not in self.hashes:
+                entity = getEntityData(dbId)
+                self.hashes[dbId] = entityHash(entity) if entity else None
+                self.refs[dbId] = entityReferences(entity) if entity else []
+            deps[dbId] = self.hashes[dbId]
+            queue.extend(self.refs[dbId])
+        return deps
+
+    def lookup(self, rxnId, deps):
+        """Recorded conversion result if deps are unchanged
+
+        Returns:
+            (True, dict of version -> (evidence, bad_namespace_flag)) when the
+            recorded result is still valid, else (False, None)
+        """
+
+        entry = self.reactions.get(str(rxnId))
+        if entry is None or entry['deps'] != deps:
+            return False, None
+
+        result = entry['result']
+        return True, {version: tuple(evidence) for version, evidence in result.items()} if result else None
+
+    def record(self, rxnId, deps, result):
+        self.reactions[str(rxnId)] = {'deps': deps, 'result': result}
+
+    def save(self):
+        """Write manifest atomically"""
+
+        data = {
+            'format': manifestFormat,
+            'belversion': self.belversion,
+            'converter': self.converter,
+            'reactions': self.reactions,
+        }
+        tmpFn = compressedFilename('{}.tmp'.format(self.fn), detectCompression(self.fn))
+        with openText(tmpFn, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmpFn, self.fn)
+
+        log.info('Manifest {}  Reactions: {}  Reused: {}  Reconverted: {}'.format(self.fn, len(self.reactions), self.reused, self.reconverted))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Run metrics for a conversion run
+
+Stage timers, grouped counters and value distributions collected while
+converting and written as a JSON report at the end of the run (see
+processReactome.py --metrics).  Worker processes collect into their own
+copy and hand a snapshot back with every chunk, which the parent merges.
+"""
+
+import json
+import time
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+import logging
+log = logging.getLogger('root')
+
+reportFormat = 1
+
+
+class RunMetrics(object):
+    """Thread-safe stage timers, counters and distributions
+
+    timers          stage -> seconds (summed over threads and worker processes)
+    counters        group -> key -> count, e.g. schemaClass -> Complex -> 1234
+    distributions   name -> value -> count, e.g. toBel.depth -> 3 -> 567
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timers = defaultdict(float)
+            self.counters = defaultdict(Counter)
+            self.distributions = defaultdict(Counter)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addTime(stage, time.perf_counter() - start)
+
+    def addTime(self, stage, seconds):
+        with self.lock:
+            self.timers[stage] += seconds
+
+    def count(self, group, key, n=1):
+        with self.lock:
+            self.counters[group][key] += n
+
+    def observe(self, name, value):
+        with self.lock:
+            self.distributions[name][value] += 1
+
+    def snapshot(self):
+        """Plain dict copy, picklable for handing back from worker processes"""
+
+        with self.lock:
+            return {
+                'timers': dict(self.timers),
+                'counters': {group: dict(counts) for group, counts in self.counters.items()},
+                'distributions': {name: dict(values) for name, values in self.distributions.items()},
+            }
+
+    def merge(self, snapshot):
+        """Add a snapshot taken in another process"""
+
+        with self.lock:
+            for stage, seconds in snapshot['timers'].items():
+                self.timers[stage] += seconds
+            for group, counts in snapshot['counters'].items():
+                self.counters[group].update(counts)
+            for name, values in snapshot['distributions'].items():
+                self.distributions[name].update(values)
+
+    def summary(self):
+        """Timers, counters and distribution summaries (count, mean, max, histogram)"""
+
+        snapshot = self.snapshot()
+        distributions = {}
+        for name, values in snapshot['distributions'].items():
+            cnt = sum(values.values())
+            distributions[name] = {
+                'count': cnt,
+                'mean': sum(value * n for value, n in values.items()) / cnt if cnt else 0.0,
+                'max': max(values) if values else 0,
+                'histogram': {str(value): values[value] for value in sorted(values)},
+            }
+
+        return {
+            'stages': {stage: round(seconds, 6) for stage, seconds in sorted(snapshot['timers'].items())},
+            'counters': {group: dict(sorted(counts.items())) for group, counts in sorted(snapshot['counters'].items())},
+            'distributions': distributions,
+        }
+
+
+# Process wide metrics, reset per chunk in worker processes
+metrics = RunMetrics()
+
+
+def getMetrics():
+    return metrics
+
+
+def writeReport(fn, **extra):
+    """Write metrics summary plus extra run information as JSON
+
+    Returns:
+        report dict
+    """
+
+    report = {'format': reportFormat}
+    report.update(extra)
+    report.update(metrics.summary())
+
+    with open(fn, 'w') as f:
+        json.dump(report, f, indent=4)
+
+    log.info('Wrote metrics report {}'.format(fn))
+    return report
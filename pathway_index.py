@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Usage:  pathway_index.py -s "Homo sapiens" -p Metabolism [--match prefix] [--any-depth]
+
+Persistent pathway -> reaction index built from the Reactome pathway hierarchy
+
+The index is built once per species and Reactome release with a single
+streaming pass over the hierarchy XML and saved as JSON.  Pathway filter
+queries by dbId, stable ID or name (contains, exact or prefix, top-level
+only or at any depth) are then answered from the index without fetching or
+parsing XML again.
+"""
+
+import os
+import re
+import json
+
+from lxml import etree
+import click
+
+import logging
+log = logging.getLogger('root')
+
+indexFormat = 1
+
+# Hierarchy elements that are reactions, everything else is a Pathway
+reactionTypes = ['Reaction', 'BlackBoxEvent', 'Polymerisation', 'Depolymerisation', 'FailedReaction']
+
+matchModes = ['contains', 'exact', 'prefix']
+
+stableIdRegex = re.compile(r'^R-[A-Z]{3}-\d+(\.\d+)?$')
+
+
+def parseHierarchy(source):
+    ''' Stream reactions out of pathway hierarchy XML in a single pass
+
+    Elements are freed as soon as they are closed so memory stays flat
+    whatever the size of the hierarchy.
+
+    Inputs:
+        source     filename or binary file object with pathway hierarchy XML
+
+    Yields:
+        (dbId, displayName, reactionType, pathways) for every reaction element,
+        pathways is the list of (dbId, displayName, stId) ancestors, top-level first
+    '''
+
+    pathways = []
+    for event, elem in etree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'Pathway':
+                pathways.append((elem.get('dbId'), elem.get('displayName'), elem.get('stId')))
+            continue
+
+        if elem.tag == 'Pathway':
+            pathways.pop()
+        elif elem.tag in reactionTypes:
+            yield elem.get('dbId'), elem.get('displayName'), elem.tag, list(pathways)
+        else:
+            continue
+
+        # Free the finished element and any already processed siblings
+        elem.clear()
+        parent = elem.getparent()
+        if parent is not None:
+            while elem.getprevious() is not None:
+                del parent[0]
+
+
+def indexFilename(species, release, indexDir='downloads/pathway_index'):
+    """Index location for species and Reactome release"""
+
+    return '{}/{}-{}.json'.format(indexDir, species.replace(' ', '_'), release)
+
+
+class PathwayIndex(object):
+    """Pathway tree with the reactions under every pathway
+
+    pathways   dbId -> {'name', 'stId', 'parent', 'children', 'reactions'}
+               where reactions are the reactions directly in the pathway
+    reactions  reaction dbId -> displayName in hierarchy document order
+    fetched    time the hierarchy was fetched from the webservice, None if it was a local file
+    """
+
+    def __init__(self, species, release, pathways=None, reactions=None, fetched=None):
+        self.species = species
+        self.release = str(release)
+        self.pathways = pathways or {}
+        self.reactions = reactions or {}
+        self.fetched = fetched
+        self.names = None
+        self.stIds = None
+
+    @classmethod
+    def build(cls, hierarchyFn, species, release):
+        """Build index with one streaming pass over hierarchy XML"""
+
+        index = cls(species, release)
+        pathways = index.pathways
+
+        for dbId, displayName, reactionType, ancestors in parseHierarchy(hierarchyFn):
+            index.reactions.setdefault(dbId, displayName)
+
+            # Sub-pathways can appear under several parents, 'parent' is the first one
+            parent = None
+            for pathwayId, pathwayName, stId in ancestors:
+                if pathwayId not in pathways:
+                    pathways[pathwayId] = {'name': pathwayName, 'stId': stId, 'parent': parent, 'children': [], 'reactions': []}
+                if parent and pathwayId not in pathways[parent]['children']:
+                    pathways[parent]['children'].append(pathwayId)
+                parent = pathwayId
+
+            if parent and dbId not in pathways[parent]['reactions']:
+                pathways[parent]['reactions'].append(dbId)
+
+        log.info('PathwayIndex.build  Species: {}  Release: {}  Pathways: {}  Reactions: {}'.format(
+            species, release, len(pathways), len(index.reactions)))
+        return index
+
+    @classmethod
+    def load(cls, fn):
+        with open(fn, 'r') as f:
+            data = json.load(f)
+        if data.get('format') != indexFormat:
+            return None
+        return cls(data['species'], data['release'], pathways=data['pathways'], reactions=data['reactions'], fetched=data.get('fetched'))
+
+    def save(self, fn):
+        """Write index atomically"""
+
+        dirname = os.path.dirname(fn)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        data = {
+            'format': indexFormat,
+            'species': self.species,
+            'release': self.release,
+            'fetched': self.fetched,
+            'pathways': self.pathways,
+            'reactions': self.reactions,
+        }
+        tmpFn = '{}.tmp'.format(fn)
+        with open(tmpFn, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmpFn, fn)
+
+    def findPathways(self, query, match='contains', anyDepth=False):
+        """dbIds of pathways matching query
+
+        Numeric queries match pathway dbIds and R-XXX-nnn queries match stable
+        IDs exactly.  Anything else is compared to the pathway name using the
+        match mode, against top-level pathways only unless anyDepth is set.
+        """
+
+        query = str(query).strip()
+
+        if query.isdigit():
+            return [query] if query in self.pathways else []
+
+        if stableIdRegex.match(query):
+            if self.stIds is None:
+                self.stIds = {}
+                for dbId, pathway in self.pathways.items():
+                    if pathway['stId']:
+                        self.stIds[pathway['stId'].split('.')[0]] = dbId
+            dbId = self.stIds.get(query.split('.')[0])
+            return [dbId] if dbId else []
+
+        if match == 'exact':
+            # Exact name lookups are the common case for scripted exports
+            if self.names is None:
+                self.names = {}
+                for dbId, pathway in self.pathways.items():
+                    self.names.setdefault(pathway['name'], []).append(dbId)
+            return [dbId for dbId in self.names.get(query, []) if anyDepth or not self.pathways[dbId]['parent']]
+
+        matches = []
+        for dbId, pathway in self.pathways.items():
+            if not anyDepth and pathway['parent']:
+                continue
+            name = pathway['name'] or ''
+            if match == 'prefix' and name.startswith(query):
+                matches.append(dbId)
+            elif match == 'contains' and query in name:
+                matches.append(dbId)
+        return matches
+
+    def subtreeReactions(self, pathwayId):
+        """Reaction dbIds in pathway and all its sub-pathways, depth first"""
+
+        reactions = []
+        visited = set()
+        stack = [pathwayId]
+        while stack:
+            pathwayId = stack.pop()
+            if pathwayId in visited:
+                continue
+            visited.add(pathwayId)
+            pathway = self.pathways[pathwayId]
+            reactions.extend(pathway['reactions'])
+            stack.extend(reversed(pathway['children']))
+        return reactions
+
+    def topLevelPathways(self):
+        """Names of the top-level pathways every reaction appears under
+
+        Returns:
+            dict of reaction dbId -> list of top-level pathway names
+        """
+
+        reactionPathways = {}
+        for dbId, pathway in self.pathways.items():
+            if pathway['parent']:
+                continue
+            for rxnId in self.subtreeReactions(dbId):
+                names = reactionPathways.setdefault(rxnId, [])
+                if pathway['name'] not in names:
+                    names.append(pathway['name'])
+        return reactionPathways
+
+    def getReactions(self, pathways=None, match='contains', anyDepth=False):
+        """Reactions under any of the pathway queries, or all reactions
+
+        Returns:
+            list of (dbId, displayName) tuples without duplicates
+        """
+
+        if not pathways:
+            return list(self.reactions.items())
+
+        seen = {}
+        for query in pathways:
+            pathwayIds = self.findPathways(query, match=match, anyDepth=anyDepth)
+            if not pathwayIds:
+                log.warning('No {} pathway match for "{}"  Species: {}'.format(match, query, self.species))
+            for pathwayId in pathwayIds:
+                for dbId in self.subtreeReactions(pathwayId):
+                    seen.setdefault(dbId, self.reactions[dbId])
+
+        return list(seen.items())
+
+
+@click.command()
+@click.option('--species', '-s', default='Homo sapiens', help="Species of the index")
+@click.option('--release', '-r', default='current', help="Reactome release of the index")
+@click.option('--pathways', '-p', multiple=True, help="Pathway dbId, stable ID or name")
+@click.option('--match', default='contains', type=click.Choice(matchModes), help="How pathway names are matched")
+@click.option('--any-depth', is_flag=True, default=False, help="Match sub-pathways as well as top-level pathways")
+def main(species, release, pathways, match, any_depth):
+    """Show pathways and reaction counts matching pathway queries"""
+
+    from reactome_webservice import loadPathwayIndex
+
+    index = loadPathwayIndex(species, release=release)
+    for query in pathways:
+        for dbId in index.findPathways(query, match=match, anyDepth=any_depth):
+            pathway = index.pathways[dbId]
+            print('{}\t{}\t{}\t{}'.format(dbId, pathway['stId'] or '', pathway['name'], len(index.subtreeReactions(dbId))))
+    print('Reactions: {}'.format(len(index.getReactions(pathways, match=match, anyDepth=any_depth))))
+
+
+if __name__ == '__main__':
+    main()
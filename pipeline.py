@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Staged asyncio conversion pipeline
+
+    fetch -> convert -> classify -> write
+
+Reactions flow through four stages connected by bounded queues so slow
+network fetches overlap with conversion and writing:
+
+  fetch      crawls the entity closures of many reactions at once, entities
+             they need are batched into getEntitiesData calls on a thread pool
+  convert    converts reactions whose entities are local, in a thread or a
+             process pool
+  classify   restores reactionList order and splits evidences with good and
+             bad namespaces
+  write      renders and writes evidences on a single writer thread
+
+At most window reactions are between fetch and write at any time, so memory
+stays bounded whatever the number of reactions, and output is written in
+reactionList order, the same as a sequential run.
+"""
+
+import time
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+import reactome_webservice
+from reactome_webservice import getEntitiesData
+from prefetch import entityReferences
+from metrics import metrics
+from progress import ProgressReporter
+
+import logging
+log = logging.getLogger('root')
+
+stages = ['fetch', 'convert', 'classify', 'write']
+
+
+class StageTimer(object):
+    """Wall time during which a stage had at least one task running"""
+
+    def __init__(self):
+        self.active = 0
+        self.since = 0.0
+        self.seconds = 0.0
+
+    def start(self):
+        if not self.active:
+            self.since = time.perf_counter()
+        self.active += 1
+
+    def stop(self):
+        self.active -= 1
+        if not self.active:
+            self.seconds += time.perf_counter() - self.since
+
+
+class ReactionPipeline(object):
+    """Fetch, convert, classify and write reactions concurrently
+
+    Inputs:
+        convertChunk    function(rxnIds) -> (list of (rxnId, result), metrics snapshot or None),
+                        result is a dict of version -> (evidence, bad_namespace_flag) or None
+        write           function(rxnId, version, evidence, bad_namespace_flag), called in order
+        executor        executor running convertChunk - a process pool or a single thread
+        converters      number of chunks converted at the same time
+        fetchWorkers    number of concurrent entity fetches
+        queueSize       capacity of the queues between stages
+        window          max reactions between fetch and write (default 4 x queueSize)
+        chunkSize       reactions per convertChunk call
+        lookup          optional function(rxnId) -> (found, result) returning a result
+                        without converting, e.g. from a ConversionManifest
+        record          optional function(rxnId, result) called for every converted reaction
+        written         optional function(rxnId, result) called on the writer thread once
+                        the evidences of a reaction are written, in order
+    """
+
+    def __init__(self, convertChunk, write, executor, converters=1, fetchWorkers=8, queueSize=100, window=None, chunkSize=1,
+                 lookup=None, record=None, written=None, progressInterval=10.0):
+        self.convertChunk = convertChunk
+        self.write = write
+        self.executor = executor
+        self.converters = max(converters, 1)
+        self.fetchWorkers = max(fetchWorkers, 1)
+        self.queueSize = queueSize
+        self.window = window or 4 * queueSize
+        self.chunkSize = max(chunkSize, 1)
+        self.lookup = lookup
+        self.record = record
+        self.written = written
+        self.progressInterval = progressInterval
+
+        self.known = {}  # dbId -> future of the referenced dbIds, set once the entity is local
+        self.users = {}  # dbId -> number of reactions in the window whose closure holds it
+        self.closures = {}  # reaction index -> dbIds of its closure, until the reaction is converted
+        self.queued = []  # dbIds waiting for a fetch
+        self.running = 0  # fetches in progress
+        self.timers = {stage: StageTimer() for stage in stages}
+        self.cnt = dict.fromkeys(['reactions', 'reused', 'converted', 'good', 'bad', 'failed', 'fetches'], 0)
+
+    def run(self, reactionList):
+        """Run reactionList through the pipeline, returns pipeline statistics"""
+
+        return asyncio.run(self.runAsync(list(reactionList)))
+
+    async def runAsync(self, reactionList):
+        self.loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+
+        batchSize = reactome_webservice.batchSize or 1
+        self.fetchChunkSize = batchSize if batchSize > 1 else 1
+
+        convertQueue = asyncio.Queue(maxsize=self.queueSize)
+        classifyQueue = asyncio.Queue(maxsize=self.queueSize)
+        writeQueue = asyncio.Queue(maxsize=self.queueSize)
+        window = asyncio.Semaphore(self.window)
+        progress = ProgressReporter(len(reactionList), interval=self.progressInterval, label='Reactions')
+
+        with ThreadPoolExecutor(max_workers=self.fetchWorkers, thread_name_prefix='fetch') as fetchExecutor, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix='write') as writeExecutor:
+            self.fetchExecutor = fetchExecutor
+
+            async def fetchReaction(index, rxnId):
+                self.closures[index] = await self.fetchClosure(rxnId)
+                found, result = self.lookup(rxnId) if self.lookup else (False, None)
+                if found:
+                    self.cnt['reused'] += 1
+                    self.release(index)
+                    await classifyQueue.put((index, rxnId, result))
+                else:
+                    await convertQueue.put((index, rxnId))
+
+            async def fetchStage():
+                # Up to window reactions are crawled at once so their fetches can be batched together
+                crawls = set()
+                errors = []
+
+                def crawled(task):
+                    crawls.discard(task)
+                    if not task.cancelled() and task.exception():
+                        errors.append(task.exception())
+
+                try:
+                    for index, (rxnId, rxnName) in enumerate(reactionList):
+                        await window.acquire()
+                        if errors:
+                            raise errors[0]
+                        task = asyncio.ensure_future(fetchReaction(index, rxnId))
+                        crawls.add(task)
+                        task.add_done_callback(crawled)
+                    while crawls:
+                        await asyncio.wait(set(crawls))
+                    if errors:
+                        raise errors[0]
+                finally:
+                    for task in set(crawls):
+                        task.cancel()
+
+                for i in range(self.converters):
+                    await convertQueue.put(None)
+
+            async def convertStage():
+                done = False
+                while not done:
+                    item = await convertQueue.get()
+                    if item is None:
+                        return
+                    batch = [item]
+                    while len(batch) < self.chunkSize and not convertQueue.empty():
+                        item = convertQueue.get_nowait()
+                        if item is None:
+                            done = True
+                            break
+                        batch.append(item)
+
+                    self.timers['convert'].start()
+                    try:
+                        results, snapshot = await self.loop.run_in_executor(self.executor, self.convertChunk, [rxnId for index, rxnId in batch])
+                    finally:
+                        self.timers['convert'].stop()
+                    if snapshot:
+                        metrics.merge(snapshot)
+
+                    for (index, rxnId), (convertedId, result) in zip(batch, results):
+                        self.cnt['converted'] += 1
+                        self.release(index)
+                        if self.record:
+                            self.record(rxnId, result)
+                        await classifyQueue.put((index, rxnId, result))
+
+            async def convertersStage():
+                await asyncio.gather(*[convertStage() for i in range(self.converters)])
+                await classifyQueue.put(None)
+
+            async def classifyStage():
+                pending = {}
+                nextIndex = 0
+                while True:
+                    item = await classifyQueue.get()
+                    if item is None:
+                        break
+                    index, rxnId, result = item
+                    pending[index] = (rxnId, result)
+
+                    # Hand reactions on in reactionList order
+                    while nextIndex in pending:
+                        rxnId, result = pending.pop(nextIndex)
+                        nextIndex += 1
+
+                        self.timers['classify'].start()
+                        classified = []
+                        if result:
+                            for version, (evidence, bad_namespace_flag) in result.items():
+                                self.cnt['bad' if bad_namespace_flag else 'good'] += 1
+                                classified.append((version, evidence, bad_namespace_flag))
+                        else:
+                            self.cnt['failed'] += 1
+                        self.timers['classify'].stop()
+
+                        await writeQueue.put((rxnId, result, classified))
+
+                if pending:
+                    log.error('Pipeline finished with {} reactions out of order'.format(len(pending)))
+                await writeQueue.put(None)
+
+            async def writeStage():
+                while True:
+                    item = await writeQueue.get()
+                    if item is None:
+                        return
+                    batch = [item]
+                    while not writeQueue.empty():
+                        batch.append(writeQueue.get_nowait())
+                    last = batch[-1] is None
+                    if last:
+                        batch.pop()
+
+                    self.timers['write'].start()
+                    try:
+                        await self.loop.run_in_executor(writeExecutor, self.writeBatch, batch)
+                    finally:
+                        self.timers['write'].stop()
+
+                    for item in batch:
+                        window.release()
+                        progress.update()
+                    self.cnt['reactions'] += len(batch)
+                    if last:
+                        return
+
+            tasks = [asyncio.ensure_future(stage) for stage in (fetchStage(), convertersStage(), classifyStage(), writeStage())]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+
+        progress.finish()
+
+        stats = dict(self.cnt)
+        stats['seconds'] = round(time.perf_counter() - start, 3)
+        stats['busy'] = {stage: round(timer.seconds, 3) for stage, timer in self.timers.items()}
+        for stage, timer in self.timers.items():
+            metrics.addTime('pipeline.{}'.format(stage), timer.seconds)
+        log.info('Pipeline: {}'.format(stats))
+        return stats
+
+    def writeBatch(self, batch):
+        for rxnId, result, classified in batch:
+            for version, evidence, bad_namespace_flag in classified:
+                self.write(rxnId, version, evidence, bad_namespace_flag)
+            if self.written:
+                self.written(rxnId, result)
+
+    def request(self, dbIds):
+        """Futures of the references of dbIds, queueing the ones not fetched or queued yet"""
+
+        futures = []
+        for dbId in dbIds:
+            future = self.known.get(dbId)
+            if future is None:
+                future = self.known[dbId] = self.loop.create_future()
+                self.queued.append(dbId)
+            futures.append(future)
+        self.submit()
+        return futures
+
+    def submit(self):
+        """Start fetches - full chunks at once, partial chunks only while a fetch thread is idle"""
+
+        while self.queued and (len(self.queued) >= self.fetchChunkSize or self.running < self.fetchWorkers):
+            chunk = self.queued[:self.fetchChunkSize]
+            del self.queued[:self.fetchChunkSize]
+
+            self.running += 1
+            self.cnt['fetches'] += 1
+            self.timers['fetch'].start()
+            future = self.loop.run_in_executor(self.fetchExecutor, getEntitiesData, chunk)
+            future.add_done_callback(partial(self.fetched, chunk))
+
+    def fetched(self, chunk, future):
+        self.running -= 1
+        self.timers['fetch'].stop()
+
+        try:
+            entities = future.result()
+        except Exception as e:
+            log.error('Pipeline fetch failed for {} dbIds: {}'.format(len(chunk), e))
+            entities = {}
+
+        for dbId in chunk:
+            entity = entities.get(dbId)
+            self.known[dbId].set_result(entityReferences(entity) if entity else [])
+
+        self.submit()
+
+    def release(self, index):
+        """Reaction converted - forget entities no other reaction in the window needs"""
+
+        for dbId in self.closures.pop(index, ()):
+            users = self.users[dbId] - 1
+            if users:
+                self.users[dbId] = users
+                continue
+            del self.users[dbId]
+            if self.known[dbId].done():
+                del self.known[dbId]
+
+    async def fetchClosure(self, rxnId):
+        """Make sure the reaction and every entity conversion visits are local
+
+        Entities fetched or queued for another reaction in the window are not
+        requested again, the crawl waits for them instead.
+
+        Returns:
+            set of the dbIds in the closure
+        """
+
+        visited = set()
+        frontier = [str(rxnId)]
+        while frontier:
+            dbIds = [dbId for dbId in dict.fromkeys(frontier) if dbId not in visited]
+            visited.update(dbIds)
+            for dbId in dbIds:
+                self.users[dbId] = self.users.get(dbId, 0) + 1
+            refs = await asyncio.gather(*self.request(dbIds))
+            frontier = [ref for entityRefs in refs for ref in entityRefs]
+        return visited
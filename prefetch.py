@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Prefetch the full entity closure of a reaction list into the entity store
+
+toBel() fetches entities lazily, one blocking request at a time.  Walking the
+same references breadth-first with a bounded thread pool before conversion
+means the conversion itself only ever hits the local store.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import reactome_webservice
+from reactome_webservice import getEntitiesData
+
+import logging
+log = logging.getLogger('root')
+
+# Entity keys holding references followed by toBel() and buildBelEvidences()
+referenceKeys = ['catalystActivity', 'input', 'output', 'hasComponent', 'hasMember', 'hasCandidate', 'physicalEntity']
+
+
+def entityReferences(entity):
+    """dbIds of the entities referenced by entity that conversion will visit"""
+
+    refs = []
+    for key in referenceKeys:
+        value = entity.get(key)
+        if not value:
+            continue
+        if isinstance(value, dict):
+            value = [value]
+        for ref in value:
+            if isinstance(ref, dict) and 'dbId' in ref:
+                refs.append(str(ref['dbId']))
+    return refs
+
+
+def prefetchEntities(reactionList, workers=8, chunkSize=None):
+    """Fetch every entity reachable from reactionList using up to workers threads
+
+    Newly discovered dbIds are grouped into chunks of chunkSize (default
+    reactome_webservice.batchSize) and each chunk is fetched with one batched
+    getEntitiesData call.
+
+    Inputs:
+        reactionList   iterable of (dbId, displayName) reaction tuples
+        workers        number of concurrent fetches
+        chunkSize      dbIds per fetch task
+
+    Returns:
+        dict of crawl statistics
+    """
+
+    if not chunkSize:
+        chunkSize = reactome_webservice.batchSize or 1
+
+    start = time.time()
+    seen = set()
+    pending = set()
+    queued = []
+    fetched = failed = 0
+    nextReport = 10000
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        def queue(dbId):
+            if dbId not in seen:
+                seen.add(dbId)
+                queued.append(dbId)
+
+        def submit(flush=False):
+            # Partial chunks only go out on flush, i.e. while workers are idle
+            while queued and (len(queued) >= chunkSize or flush):
+                chunk = queued[:chunkSize]
+                del queued[:chunkSize]
+                future = executor.submit(getEntitiesData, chunk)
+                future.chunk = chunk
+                pending.add(future)
+
+        for rxnId, rxnName in reactionList:
+            queue(str(rxnId))
+        submit(flush=True)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                try:
+                    entities = future.result()
+                except Exception as e:
+                    failed += len(future.chunk)
+                    log.error('prefetchEntities fetch failed: {}'.format(e))
+                    continue
+                failed += len([dbId for dbId in future.chunk if dbId not in entities])
+                for dbId in future.chunk:
+                    entity = entities.get(dbId)
+                    if not entity:
+                        continue
+                    fetched += 1
+                    for ref in entityReferences(entity):
+                        queue(ref)
+
+            submit(flush=len(pending) < workers)
+
+            if fetched >= nextReport:
+                log.info('prefetchEntities  Fetched: {}  Pending: {}'.format(fetched, len(pending)))
+                nextReport += 10000
+
+    elapsed = time.time() - start
+    stats = {
+        'entities': fetched,
+        'failed': failed,
+        'seconds': round(elapsed, 3),
+        'entities_per_second': round(fetched / elapsed, 1) if elapsed else 0.0,
+    }
+    log.info('prefetchEntities: {}'.format(stats))
+    return stats
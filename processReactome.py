@@ -21,6 +21,7 @@ Options:
 
 # There are cases of identical “=>” relationships that are not due to identical rxnIds.  I look into one of them (Group-65 and Group-66).  In this case, the evidence lines for these groups are the same except for GYS1-a is in one and GYS1-b is in the other.  A google search tells me that a is the unphosphorylated form, and b is the phosphorylated form.  Everything other than the evidence lines for these groups are the same, which seems like a reasonable interpretation.  I looked up a few more of these cases and they all were cases where there were separate reactions for the phosphorylated and unphosphorylated forms of an enzyme catalyzing the same reaction.
 #   WSH - Not sure how to handle this.  Need a more sophisticated parse of Reactome at the very least to capture these subtleties.
+#   --dedup merges groups with identical citation and statements - see evidence_dedup.py, groups from different reactions keep their own Citation
 
 # There is some weird nesting of the location with complexes.  See Group-10.  Essentially, there are complexes with loc() of this form:
 # complex(complex(p(x,loc(Y)), loc(y)), loc(y)), with a single hasComponent statement showing that it is composed of complex(p(x,loc(Y)), loc(y)).  I’m still working out exactly how we will be using the hasComponent statements – right now I don’t foresee needing this to be fixed, but I may run into scenarios where this structure causes problems.
@@ -28,14 +29,29 @@ Options:
 
 
 import os
-import copy
 import time
 import re
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from jinja2 import Environment, FileSystemLoader
 import click
-
-from toBel import toBel, dedup, dedupList, escapeBelString, setBelVersion
-from reactome_webservice import getEntityData, getReactions
+from functools import partial
+from contextlib import ExitStack
+
+from toBel import toBel, renderBel, dedup, dedupList, escapeBelString, setBelVersion, getBelVersion, setBelCacheSize, getBelCacheStats, setMaxDepth, getMaxDepth, getTraversalStats
+import reactome_webservice
+from reactome_webservice import getEntityData, getSpeciesReactions, getTopLevelPathways, setEntityCacheSize, getEntityCacheStats, preloadEntities, setEntityStore, setBatchSize, setWsUrl, setRelease, setCurrentMaxAge, setOffline
+from prefetch import prefetchEntities
+from belscript_writer import BelScriptWriter, JsonListWriter
+from manifest import ConversionManifest, converterHash
+from reactome_client import configureClient, getClient
+from metrics import metrics, writeReport
+from progress import ProgressReporter
+from evidence_dedup import EvidenceDeduplicator
+from shards import ShardWriter, shardModes
+from compression import compressionModes, setCompression, getCompression
+from pipeline import ReactionPipeline
+from checkpoint import Checkpoint
 
 # Overwrite logs on each run -> filemode = 'w'
 import log_setup
@@ -49,13 +65,20 @@ log = log_setup.getLogger(name='root')
 PATH = os.path.dirname(os.path.abspath(__file__))
 TEMPLATE_ENVIRONMENT = Environment(
     autoescape=False,
-    loader=FileSystemLoader(os.path.join(PATH, 'templates')),
+    loader=FileSystemLoader([os.path.join(PATH, 'templates'), PATH]),
     trim_blocks=False)
 
 template_filename = 'belscript.jinja2'
 
 speciesList = ['Homo sapiens', 'Mus musculus', 'Rattus norvegicus']
 
+# -b both converts once and writes BEL 1 and BEL 2 from the same terms
+belVersionChoices = {'1': ['1'], '2': ['2'], 'both': ['1', '2']}
+
+
+# Author and date in the created displayName, e.g. "Jassal, B, 2008-01-21"
+createdRegex = re.compile(r'(.*?),\s+(\d{4,4}-\d{2,2}-\d{2,2})')
+
 
 def convertSpeciesNameToTaxId(name):
     species = {
@@ -66,7 +89,7 @@ def convertSpeciesNameToTaxId(name):
     return species[name]
 
 
-def render_template(template_filename, evidences, pathways=None):
+def buildContext(evidences, pathways=None, species=None):
 
     context = {}
     # Todo  add the following to a configuration file and automate the date
@@ -74,6 +97,8 @@ def render_template(template_filename, evidences, pathways=None):
         setname = '{} Pathway Reactome Reactions'.format(' and '.join(pathways))
     else:
         setname = 'All Reactome Reactions'
+    if species:
+        setname = '{} for {}'.format(setname, species)
     context['BEL_DOCUMENT_NAME'] = setname
     context['BEL_DOCUMENT_DESCRIPTION'] = '{} converted to BEL 1.0'.format(setname)
     context['AUTHORS'] = 'Selventa; Nimisha Schneider; Natalie Catlett; William Hayes'
@@ -82,13 +107,20 @@ def render_template(template_filename, evidences, pathways=None):
     context['CONTACT_EMAIL'] = 'whayes@selventa.com'
     context['evidences'] = evidences
 
+    return context
+
+
+def render_template(template_filename, evidences, pathways=None):
+
+    context = buildContext(evidences, pathways=pathways)
+
     return TEMPLATE_ENVIRONMENT.get_template(template_filename).render(context)
 
 
 def buildStatements(catalysts, inputs, outputs):
 
-    input_bel = ', '.join([bel for input in inputs for bel in input])
-    output_bel = ', '.join([bel for output in outputs for bel in output])
+    input_bel = ', '.join([bel for input in inputs if input for bel in input])
+    output_bel = ', '.join([bel for output in outputs if output for bel in output])
 
     rxn = 'rxn(reactants({}), products({}))'.format(input_bel, output_bel)
     statements = []
@@ -116,66 +148,91 @@ def buildStatements(catalysts, inputs, outputs):
     return statements
 
 
-def buildBelEvidences(reactionList, belversion, pathways=None):
-    ''' Load reactions and build BEL Evidences'''
+def convertReaction(rxnId, belversion=None):
+    ''' Convert reaction to a BEL evidence
 
-    rxnUrlTpl = 'http://www.reactome.org/PathwayBrowser/#'
-    evidences = []
-    bad_namespaces_evidences = []  # collect bad evidences
+    Returns:
+        (evidence, bad_namespace_flag) or None if the reaction cannot be converted
+    '''
 
-    # indexCnt = 0
-    for rxnId, rxnName in reactionList:
+    version = str(belversion or getBelVersion())
+    results = convertReactionVersions(rxnId, [version])
+    return results[version] if results else None
 
-        print('rxnId: ', rxnId)
-
-        # indexCnt += 1
-        # if indexCnt > 2:
-        #     break
-
-        # Process Annotation information
-        rxnData = getEntityData(rxnId)
-        if 'stableIdentifier' not in rxnData:
-            continue
-
-        stableId = rxnData['stableIdentifier']['displayName']
-        rxnUrl = '{}{}'.format(rxnUrlTpl, stableId)
-        rxnName = escapeBelString(rxnData['displayName'])
-        rxnType = rxnData['schemaClass']
-
-        # Todo  collect all compartments and annotate
-        compartment = 'Unknown'
-        if 'compartment' in rxnData:
-            compartment = rxnData['compartment'][0]['displayName']
-
-        rxnAuthor = rxnDate = None
-        if 'created' in rxnData:
-            try:
-                matches = re.search(r'(.*?),\s+(\d{4,4}-\d{2,2}-\d{2,2})', rxnData['created']['displayName'])
-                if matches:
-                    rxnAuthor = matches.group(1)
-                    rxnDate = matches.group(2)
-            except:
-                log.info('Rxn - cannot find created date and author in object: {}'.format(rxnId))
-
-        if rxnDate and rxnAuthor:
-            citation = '{{"Online Resource", "{}", "{}", "{}", "{}"}}'.format(rxnName, rxnUrl, rxnDate, rxnAuthor)
-        else:
-            citation = '{{"Online Resource", "{}", "{}"}}'.format(rxnName, rxnUrl)
-
-        evidence = {
-            'name': rxnName,
-            'rxnId': rxnId,  # TODO remove after debugging
-            'rxnType': rxnType,
-            'compartment': compartment,
-            'species': rxnData['speciesName'],
-            'species_tax_id': convertSpeciesNameToTaxId(rxnData['speciesName']),
-            'summary_text': rxnName,
-            'citation': citation,
-        }
 
-        # Process BEL Statement
-        catalysts, inputs, outputs = [], [], []
+def convertReactionVersions(rxnId, belversions):
+    ''' Convert reaction to a BEL evidence per BEL version
+
+    Participants are converted once to version-neutral terms and rendered for
+    every version in belversions.  A reaction that fails to convert, e.g. for
+    an unknown species, is logged and skipped instead of ending the run.
 
+    Returns:
+        dict of version -> (evidence, bad_namespace_flag) or None if the reaction cannot be converted
+    '''
+
+    try:
+        return buildReactionEvidences(rxnId, belversions)
+    except Exception as e:
+        log.error('Cannot convert reaction {}: {!r}'.format(rxnId, e))
+        metrics.count('conversionErrors', type(e).__name__)
+        return None
+
+
+def buildReactionEvidences(rxnId, belversions):
+    ''' BEL evidence per BEL version for a reaction, see convertReactionVersions'''
+
+    rxnUrlTpl = 'http://www.reactome.org/PathwayBrowser/#'
+
+    log.debug('rxnId: %s', rxnId)
+
+    # Process Annotation information
+    rxnData = getEntityData(rxnId)
+    if not rxnData or 'stableIdentifier' not in rxnData:
+        return None
+
+    stableId = rxnData['stableIdentifier']['displayName']
+    rxnUrl = '{}{}'.format(rxnUrlTpl, stableId)
+    rxnName = escapeBelString(rxnData['displayName'])
+    rxnType = rxnData['schemaClass']
+
+    # Todo  collect all compartments and annotate
+    compartment = 'Unknown'
+    if 'compartment' in rxnData:
+        compartment = rxnData['compartment'][0]['displayName']
+
+    rxnAuthor = rxnDate = None
+    if 'created' in rxnData:
+        try:
+            matches = createdRegex.search(rxnData['created']['displayName'])
+            if matches:
+                rxnAuthor = matches.group(1)
+                rxnDate = matches.group(2)
+        except:
+            log.info('Rxn - cannot find created date and author in object: {}'.format(rxnId))
+
+    if rxnDate and rxnAuthor:
+        citation = '{{"Online Resource", "{}", "{}", "{}", "{}"}}'.format(rxnName, rxnUrl, rxnDate, rxnAuthor)
+    else:
+        citation = '{{"Online Resource", "{}", "{}"}}'.format(rxnName, rxnUrl)
+
+    metrics.count('reactionType', rxnType)
+
+    evidence = {
+        'name': rxnName,
+        'rxnId': rxnId,  # TODO remove after debugging
+        'rxnType': rxnType,
+        'compartment': compartment,
+        'species': rxnData['speciesName'],
+        'species_tax_id': convertSpeciesNameToTaxId(rxnData['speciesName']),
+        'summary_text': rxnName,
+        'citation': citation,
+    }
+
+    # Process BEL Statement
+    catalysts, inputs, outputs = [], [], []
+
+    with metrics.timer('conversion'):
         if 'catalystActivity' in rxnData:
 
             for catalyst in rxnData['catalystActivity']:
@@ -189,77 +246,522 @@ def buildBelEvidences(reactionList, belversion, pathways=None):
             for output in dedup(rxnData['output']):
                 outputs.append(toBel(output['dbId']))
 
-        print('Catalysts ', catalysts)
-        print('Inputs ', inputs)
-        print('Outputs ', outputs)
-        print('\n')
+    log.debug('rxnId: %s  Catalysts: %s  Inputs: %s  Outputs: %s', rxnId, catalysts, inputs, outputs)
+
+    # A participant missing from rxn() would make the evidence wrong, not just incomplete
+    if any(result is None for result in catalysts + inputs + outputs):
+        log.error('Cannot convert reaction {} - a participant could not be converted'.format(rxnId))
+        metrics.count('conversionErrors', 'participant')
+        return None
 
-        statements = buildStatements(catalysts, inputs, outputs)
-        evidence['statements'] = dedupList(statements)
+    results = {}
+    for version in belversions:
+        with metrics.timer('statements'):
+            statements = buildStatements([renderBel(catalyst, version) for catalyst in catalysts],
+                                         [renderBel(input, version) for input in inputs],
+                                         [renderBel(output, version) for output in outputs])
+            versionEvidence = dict(evidence, statements=dedupList(statements))
 
         bad_namespace_flag = False
         for statement in statements:
             if 'ENSEMBL' in statement or 'EMBL' in statement:
                 bad_namespace_flag = True
 
-        # with open('tmp_evidences.json', 'a') as f:
-        #     json.dump(evidence, f, indent=4)
-        #     f.write('\n\n')
+        results[version] = (versionEvidence, bad_namespace_flag)
+
+    return results
+
+
+def processCounts():
+    ''' Cache hit/miss and HTTP request counts of this process'''
+
+    counts = {}
+    for name, stats in (('belCache', getBelCacheStats()), ('entityCache', getEntityCacheStats())):
+        counts['{}.hits'.format(name)] = stats['hits']
+        counts['{}.misses'.format(name)] = stats['misses']
+    counts['http.requests'] = getClient().requestCnt
+    return counts
+
+
+def convertReactionChunk(belversions, rxnIds):
+    ''' Convert a chunk of reactions - unit of work for the process pool
+
+    Returns:
+        (list of (rxnId, result), metrics snapshot of this chunk)
+    '''
+
+    metrics.reset()
+    before = processCounts()
+
+    results = [(rxnId, convertReactionVersions(rxnId, belversions)) for rxnId in rxnIds]
+
+    for name, cnt in processCounts().items():
+        metrics.count('workers', name, cnt - before[name])
+
+    return results, metrics.snapshot()
+
+
+def initConversionWorker(entityStoreLocation, webserviceUrl, offline, compression, maxDepth, clientSettings):
+    ''' Process pool initializer
+
+    Forked workers inherit the parent's entity and conversion caches, this only
+    re-opens the entity store (SQLite connections must not cross a fork) and
+    restores settings for platforms that spawn instead of fork.  Every worker
+    gets its own HTTP client - an inherited one would share keep-alive sockets
+    with the parent and the other workers.
+    '''
+
+    configureClient(**clientSettings)
+    setCompression(compression)
+    setMaxDepth(maxDepth)
+    setEntityStore(entityStoreLocation)
+    setWsUrl(webserviceUrl)
+    setOffline(offline)
+
+
+def workerStarted():
+    ''' No-op submitted to start the workers of a new conversion pool'''
+
+    return os.getpid()
+
+
+def conversionPool(workers):
+    ''' Process pool of conversion workers set up like this process
+
+    Workers are started before returning: forked while fetch threads run
+    they could inherit locks those threads hold (caches, metrics, logging,
+    the entity store) and deadlock on them.
+    '''
+
+    # fork shares the read-only entity cache with the workers copy-on-write
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+
+    # --rate-limit is for the whole run - split it between the workers
+    clientSettings = dict(getClient().settings)
+    if clientSettings['rateLimit']:
+        clientSettings['rateLimit'] = clientSettings['rateLimit'] / workers
+
+    initargs = (reactome_webservice.getEntityStore().path, reactome_webservice.wsUrl, reactome_webservice.offline, getCompression(), getMaxDepth(),
+                clientSettings)
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initConversionWorker, initargs=initargs)
+    # fork pools start every worker on the first submit
+    executor.submit(workerStarted).result()
+    return executor
+
+
+def convertReactions(reactionList, belversions, workers=1, chunkSize=20):
+    ''' Convert reactions, optionally spread over a pool of worker processes
+
+    Results are yielded in reactionList order whatever the number of workers,
+    so the rendered output is the same for serial and parallel runs.
+
+    Yields:
+        (rxnId, result of convertReactionVersions)
+    '''
+
+    rxnIds = [rxnId for rxnId, rxnName in reactionList]
+
+    if workers <= 1:
+        for rxnId in rxnIds:
+            yield rxnId, convertReactionVersions(rxnId, belversions)
+        return
 
-        if bad_namespace_flag:
-            bad_namespaces_evidences.append(copy.deepcopy(evidence))
+    chunks = [rxnIds[i:i + chunkSize] for i in range(0, len(rxnIds), chunkSize)]
+
+    with conversionPool(workers) as executor:
+        for results, snapshot in executor.map(partial(convertReactionChunk, belversions), chunks):
+            metrics.merge(snapshot)
+            for rxnId, result in results:
+                yield rxnId, result
+
+
+def convertReactionsIncremental(reactionList, belversions, manifest, workers=1):
+    ''' Convert only reactions whose dependencies changed since the manifest was written
+
+    Unchanged reactions reuse the evidence recorded in the manifest, the rest
+    go through convertReactions.  Results are yielded in reactionList order.
+
+    Yields:
+        (rxnId, result of convertReactionVersions)
+    '''
+
+    plan = []
+    stale = []
+    for rxnId, rxnName in reactionList:
+        deps = manifest.dependencyHashes(rxnId)
+        found, result = manifest.lookup(rxnId, deps)
+        plan.append((rxnId, deps, found, result))
+        if not found:
+            stale.append((rxnId, rxnName))
+
+    log.info('Incremental conversion  Reactions: {}  Changed: {}'.format(len(plan), len(stale)))
+
+    converted = convertReactions(stale, belversions, workers=workers)
+    for rxnId, deps, found, result in plan:
+        if found:
+            manifest.reused += 1
         else:
-            evidences.append(copy.deepcopy(evidence))
+            convertedId, result = next(converted)
+            manifest.reconverted += 1
+            manifest.record(rxnId, deps, result)
+        yield rxnId, result
+
+
+def convertReactionsPipelined(reactionList, belversions, write, workers=1, fetchWorkers=8, manifest=None, written=None, progressInterval=10.0):
+    ''' Fetch, convert, classify and write reactions as overlapping stages, see pipeline.py
+
+    write(rxnId, version, evidence, bad_namespace_flag) is called in
+    reactionList order, then written(rxnId, result) once per reaction.  With
+    a manifest unchanged reactions skip conversion.
+
+    Returns:
+        pipeline statistics
+    '''
+
+    deps = {}  # rxnId -> dependency hashes of reactions being converted, for the manifest
+
+    def lookupManifest(rxnId):
+        deps[rxnId] = manifest.dependencyHashes(rxnId)
+        found, result = manifest.lookup(rxnId, deps[rxnId])
+        if found:
+            manifest.reused += 1
+            del deps[rxnId]
+        return found, result
+
+    def recordManifest(rxnId, result):
+        manifest.reconverted += 1
+        manifest.record(rxnId, deps.pop(rxnId), result)
+
+    if workers > 1:
+        executor = conversionPool(workers)
+        convertChunk = partial(convertReactionChunk, belversions)
+    else:
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='convert')
+
+        def convertChunk(rxnIds):
+            return [(rxnId, convertReactionVersions(rxnId, belversions)) for rxnId in rxnIds], None
+
+    with executor:
+        pipeline = ReactionPipeline(convertChunk, write, executor, converters=workers, fetchWorkers=fetchWorkers,
+                                    chunkSize=4 if workers > 1 else 1, lookup=lookupManifest if manifest else None,
+                                    record=recordManifest if manifest else None, written=written, progressInterval=progressInterval)
+        return pipeline.run(reactionList)
+
+
+def mergeSpeciesReactions(speciesReactions):
+    ''' Merge per-species reaction lists into one list without duplicate dbIds
+
+    Human, mouse and rat hierarchies share rxnIds - each reaction is converted
+    once and its results shared by every species that lists it.
+
+    Returns:
+        (reactionList sorted so group numbering is repeatable, dict of rxnId -> species listing it)
+    '''
+
+    reactions = {}
+    reactionSpecies = {}
+    for species, reactionList in speciesReactions.items():
+        for rxnId, rxnName in reactionList:
+            reactions.setdefault(rxnId, rxnName)
+            reactionSpecies.setdefault(rxnId, []).append(species)
+
+    return sorted(reactions.items()), reactionSpecies
+
+
+def belFilename(version):
+    ''' BEL script filename for a BEL version - reactome.bels or reactome.bels2'''
+
+    return 'reactome.bels2' if version == '2' else 'reactome.bels'
+
+
+def buildBelEvidences(reactionList, belversion, pathways=None, workers=1, manifest=None, progressInterval=10.0, mergeGroups=False,
+                      shardBy=None, shardKeys=None, maxStatements=0, maxBytes=0, pipeline=False, fetchWorkers=8, checkpoint=None):
+    ''' Load reactions and build BEL Evidences
 
-    belscript = render_template(template_filename, evidences, pathways=pathways)
+    belversion is '1', '2' or 'both' - with 'both' reactome.bels and
+    reactome.bels2 are written from one conversion pass.
 
-    fn = 'reactome.bels'
-    if belversion == '2':
-        fn += '2'
+    With a ConversionManifest only reactions whose entities changed since the
+    last run are converted again.  Progress is logged every progressInterval
+    seconds (0 = only when done).  With mergeGroups identical statement groups
+    are merged and repeated structural statements dropped, see evidence_dedup.py.
 
-    with open(fn, 'w') as f:
-        f.write(belscript)
+    Statement groups are split over BEL script shards (see shards.py) instead
+    of one reactome.bels with shardKeys - rxnId -> list of species or
+    top-level pathways named by shardBy - or with a maxStatements or maxBytes
+    limit per shard.
 
-    import json
-    with open('bad_evidences.json', 'w') as f:
-        json.dump(bad_namespaces_evidences, f, indent=4)
+    With pipeline entities are fetched (fetchWorkers batched requests at a
+    time), converted and written as overlapping stages, see pipeline.py - the output
+    is the same as for a sequential run.
+
+    With a Checkpoint written reactions are saved periodically.  If it was
+    loaded from an earlier run, reactions recorded in it are not converted
+    again - plain outputs are appended to, others are written again from the
+    checkpointed evidence, see checkpoint.py.
+
+    Returns:
+        dict with number of groups, statements and bad evidences written,
+        for 'both' a dict of version -> those counts
+    '''
+
+    belversions = belVersionChoices[str(belversion)]
+
+    # Statement groups are written as soon as their reaction is converted,
+    # or once all reactions are in when groups are deduplicated
+    template = TEMPLATE_ENVIRONMENT.get_template(template_filename)
+    context = buildContext([], pathways=pathways)
+
+    sharded = bool(shardKeys or maxStatements or maxBytes)
+
+    # Only plain streamed outputs can be truncated to a checkpoint and appended to
+    appendable = not (mergeGroups or sharded or getCompression())
+    resumed = checkpoint.outputs if checkpoint and appendable and checkpoint.canAppend() else None
+
+    def shardContext(key):
+        if shardBy == 'species' and key:
+            return buildContext([], pathways=pathways, species=key)
+        if shardBy == 'pathway' and key:
+            return buildContext([], pathways=[key])
+        return context
+
+    # writers are closed by the stack if conversion fails part way
+    with ExitStack() as stack:
+        outputs = {}
+        for version in belversions:
+            fn = belFilename(version)
+            badFn = 'bad_evidences2.json' if version == '2' and len(belversions) > 1 else 'bad_evidences.json'
+            if sharded:
+                belscript = ShardWriter(fn, template, shardContext, splitBy=shardBy, maxStatements=maxStatements, maxBytes=maxBytes, dedup=mergeGroups)
+            else:
+                belscript = BelScriptWriter(fn, template, context, resume=resumed and resumed[fn])
+            outputs[version] = {
+                'belscript': stack.enter_context(belscript),
+                'bad_evidences': stack.enter_context(JsonListWriter(badFn, resume=resumed and resumed[badFn])),
+                'deduplicator': stack.enter_context(EvidenceDeduplicator(spoolDir=os.path.dirname(os.path.abspath(fn)))) if mergeGroups and not sharded else None,
+            }
+
+        def writeEvidence(rxnId, version, evidence, bad_namespace_flag):
+            output = outputs[version]
+
+            if bad_namespace_flag:
+                output['bad_evidences'].write(evidence)
+            elif sharded:
+                output['belscript'].write(evidence, keys=(shardKeys or {}).get(rxnId) or (None,))
+            elif output['deduplicator']:
+                output['deduplicator'].add(evidence)
+            else:
+                output['belscript'].write(evidence)
+
+        if checkpoint:
+            def outputState():
+                if not appendable:
+                    return None
+                return {writer.fn: writer.state() for output in outputs.values() for writer in (output['belscript'], output['bad_evidences'])}
+
+            checkpoint.start(outputState)
+            stack.callback(checkpoint.close)
+
+            if checkpoint.done and not resumed:
+                log.info('Writing {} checkpointed reactions again'.format(len(checkpoint.done)))
+                for rxnId, result in checkpoint.replay():
+                    for version, (evidence, bad_namespace_flag) in result.items():
+                        writeEvidence(rxnId, version, evidence, bad_namespace_flag)
+
+            reactionList = [(rxnId, rxnName) for rxnId, rxnName in reactionList if str(rxnId) not in checkpoint.done]
+
+        if pipeline:
+            convertReactionsPipelined(reactionList, belversions, writeEvidence, workers=workers, fetchWorkers=fetchWorkers,
+                                      manifest=manifest, written=checkpoint and checkpoint.record, progressInterval=progressInterval)
+        else:
+            if manifest:
+                results = convertReactionsIncremental(reactionList, belversions, manifest, workers=workers)
+            else:
+                results = convertReactions(reactionList, belversions, workers=workers)
+
+            progress = ProgressReporter(len(reactionList), interval=progressInterval, label='Reactions')
+            for rxnId, result in results:
+                progress.update()
+                for version, (evidence, bad_namespace_flag) in (result or {}).items():
+                    writeEvidence(rxnId, version, evidence, bad_namespace_flag)
+                if checkpoint:
+                    checkpoint.record(rxnId, result)
+
+            progress.finish()
+
+        written = {}
+        for version, output in outputs.items():
+            belscript, bad_evidences, deduplicator = output['belscript'], output['bad_evidences'], output['deduplicator']
+
+            if deduplicator:
+                with deduplicator:
+                    for evidence in deduplicator.evidences():
+                        belscript.write(evidence)
+
+            belscript.close()
+            bad_evidences.close()
+
+            log.info('{} {}  Groups: {}  Statements: {}  Bad evidences: {}'.format(
+                'Sharded' if sharded else 'Wrote', belscript.fn, belscript.groupCnt, belscript.statementCnt, bad_evidences.cnt))
+            written[version] = {'groups': belscript.groupCnt, 'statements': belscript.statementCnt, 'badEvidences': bad_evidences.cnt}
+
+    if checkpoint:
+        checkpoint.finish()
+
+    if manifest:
+        manifest.save()
+
+    log.info('toBel conversion cache: {}'.format(getBelCacheStats()))
+    log.info('toBel traversal: {}'.format(getTraversalStats()))
+    log.info('Entity cache: {}'.format(getEntityCacheStats()))
+    log.info('Reactome HTTP client: {}'.format(getClient().stats()))
+
+    return written if len(belversions) > 1 else written[belversions[0]]
 
 
 @click.command()
-@click.option('--belversion', '-b', default='1', type=click.Choice(['1', '2']), help="Use Bel 1 by default or select Bel 2")
+@click.option('--belversion', '-b', default='1', type=click.Choice(['1', '2', 'both']), help="Use Bel 1 by default, select Bel 2 or write both from one conversion")
 @click.option('--species', '-s', multiple=True, type=click.Choice(['all', 'Homo sapiens', 'Mus musculus', 'Rattus norvegicus']))
 @click.option('--pathways', '-p', default=None, multiple=True, help="Restrict to specific Reactome Pathway(s) - e.g. Metabolism - can use multiple -p Metabolism -p Pathway2 ...")
-def main(belversion, species, pathways):
+@click.option('--max-depth', default=100, type=int, help="Skip entities nested deeper than this inside a converted participant")
+@click.option('--bel-cache-size', default=200000, type=int, help="Max number of converted entities kept in memory (0 = unbounded)")
+@click.option('--entity-cache-size', default=100000, type=int, help="Max number of parsed Reactome entities kept in memory (0 = unbounded)")
+@click.option('--preload', is_flag=True, default=False, help="Load all downloaded entities into memory before converting")
+@click.option('--entity-store', default='./downloadedEntities', help="Downloaded entity store - a directory or a single *.sqlite file (see entity_store.py)")
+@click.option('--prefetch-workers', default=8, type=int, help="Concurrent fetches when prefetching reaction entities before conversion (0 = fetch lazily)")
+@click.option('--http-timeout', default=120.0, type=float, help="Seconds to wait for a Reactome response")
+@click.option('--http-retries', default=5, type=int, help="Retries with exponential backoff for failed Reactome requests")
+@click.option('--rate-limit', default=None, type=float, help="Max Reactome requests per second")
+@click.option('--batch-size', default=100, type=int, help="dbIds per batched Reactome entity request when prefetching (1 = one request per entity)")
+@click.option('--ws-url', default=None, help="Reactome RESTfulWS base Url, e.g. a local stand-in server")
+@click.option('--workers', '-w', default=1, type=int, help="Number of processes converting reactions in parallel")
+@click.option('--manifest', default=None, help="Conversion manifest file - only reactions whose entities changed since it was written are reconverted")
+@click.option('--release', default='current', help="Reactome release - keys the cached pathway hierarchy and pathway index, 'current' is fetched again online once older than --current-max-age")
+@click.option('--current-max-age', default=24.0, type=float, help="Hours a fetched 'current' pathway hierarchy is reused before it is fetched again (0 = on every online run)")
+@click.option('--pathway-match', default='contains', type=click.Choice(['contains', 'exact', 'prefix']), help="How -p pathway names are matched (dbIds and stable IDs always match exactly)")
+@click.option('--any-depth', is_flag=True, default=False, help="Let -p match sub-pathways as well as top-level pathways")
+@click.option('--offline', is_flag=True, default=False, help="Never contact Reactome - use entities and hierarchies imported with bulk_import.py")
+@click.option('--metrics', 'metrics_fn', default=None, help="Write a JSON report of stage timings, cache, HTTP and conversion metrics to this file")
+@click.option('--progress-interval', default=10.0, type=float, help="Seconds between progress reports with rate and ETA (0 = only when done)")
+@click.option('--quiet', '-q', is_flag=True, default=False, help="Only show warnings and errors on the console")
+@click.option('--verbose', '-v', is_flag=True, default=False, help="Log per-reaction and per-entity conversion detail (slow)")
+@click.option('--dedup/--no-dedup', 'merge_groups', default=False, help="Merge statement groups with the same citation and statements and write each hasComponent statement once per document - output is written at the end")
+@click.option('--shard-by', default=None, type=click.Choice(shardModes), help="Split the BEL script into one document per species or top-level pathway, e.g. reactome-Homo_sapiens.bels")
+@click.option('--shard-max-statements', default=0, type=int, help="Start a new BEL script shard when one would exceed this many statements (0 = no limit)")
+@click.option('--shard-max-bytes', default=0, type=int, help="Start a new BEL script shard once one reaches this size in bytes, before compression (0 = no limit)")
+@click.option('--pipeline', is_flag=True, default=False, help="Fetch entities, convert and write as overlapping stages with bounded queues instead of prefetching everything first")
+@click.option('--compress', default='none', type=click.Choice(compressionModes), help="Compress BEL scripts, bad evidences, spool files and newly downloaded entities (zstd needs the zstandard package)")
+@click.option('--checkpoint', 'checkpoint_fn', default='reactome.checkpoint.jsonl', help="Checkpoint file of written reactions and their evidence, removed when the run completes")
+@click.option('--checkpoint-interval', default=60.0, type=float, help="Seconds between checkpoint saves (0 = no checkpoint)")
+@click.option('--resume', is_flag=True, default=False, help="Skip reactions saved in the checkpoint of an interrupted run with the same settings and append to its output")
+def main(belversion, species, pathways, max_depth, bel_cache_size, entity_cache_size, preload, entity_store, prefetch_workers, http_timeout, http_retries, rate_limit, batch_size, ws_url, workers, manifest, release, current_max_age, pathway_match, any_depth, offline, metrics_fn, progress_interval, quiet, verbose, merge_groups, shard_by, shard_max_statements, shard_max_bytes, pipeline, compress,
+         checkpoint_fn, checkpoint_interval, resume):
     """Process Reactome into BEL
 
     Example:  ./processReactome.py -b 1 -s "Homo sapiens" -s "Mus musculus" -p Metabolism
     Example:  ./processReactome.py -b 2 -s "Homo sapiens" -p Metabolism -p "Transmembrane transport of small molecules"
-    Result: reactome.bels
+    Example:  ./processReactome.py -b both -s "Homo sapiens"
+    Example:  ./processReactome.py -b 1 -s "Homo sapiens" --resume     (after an interrupted run)
+    Result: reactome.bels (reactome.bels2 for -b 2 or both, reactome.bels.gz with --compress gzip)
     """
-    setBelVersion(belversion)
+    started = time.time()
+    if verbose:
+        log_setup.setLevel('DEBUG', consoleLevel='WARNING' if quiet else 'DEBUG')
+    elif quiet:
+        log_setup.setLevel('INFO', consoleLevel='WARNING')
+
+    if belversion != 'both':
+        setBelVersion(belversion)
+    try:
+        setCompression(compress)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--compress')
+    setMaxDepth(max_depth)
+    setBelCacheSize(bel_cache_size)
+    configureClient(timeout=(10, http_timeout), retries=http_retries, rateLimit=rate_limit, poolSize=max(prefetch_workers, 10))
+    setEntityStore(entity_store)
+    setBatchSize(batch_size)
+    setRelease(release)
+    setCurrentMaxAge(current_max_age * 3600)
+    setOffline(offline)
+    if ws_url:
+        setWsUrl(ws_url)
+    setEntityCacheSize(entity_cache_size)
+    if preload:
+        log.info('Preloaded {} entities'.format(preloadEntities()))
 
     # quit and show help if no arguments are set
     if not species:
         click.help_option()
-        print('Here')
 
     if 'all' in species:
         species = speciesList
 
-    # Collect reactions
-    reactionList = []
-    for specie in species:
-        reactionList.extend(getReactions(specie, pathways=pathways))
+    # Collect reactions - hierarchies of all species are fetched and parsed concurrently
+    with metrics.timer('hierarchyFetch'):
+        speciesReactions = getSpeciesReactions(species, pathways=pathways, match=pathway_match, anyDepth=any_depth)
 
     # import json
     # with open('reactionlist.json', 'w') as f:
     #     json.dump(reactionList, f, indent=4)
     # quit()
 
-    # human, mouse and rat share rxnIds
-    reactionList = set(reactionList)
+    # human, mouse and rat share rxnIds - each is converted once for all species
+    reactionList, reactionSpecies = mergeSpeciesReactions(speciesReactions)
+    log.info('Reactions: {}  {}'.format(len(reactionList), ', '.join('{}: {}'.format(s, len(r)) for s, r in speciesReactions.items())))
 
-    buildBelEvidences(reactionList, belversion, pathways=pathways)
+    checkpoint = None
+    if checkpoint_interval > 0:
+        settings = {
+            'belversion': belversion, 'species': list(species), 'pathways': list(pathways or []), 'pathwayMatch': pathway_match,
+            'anyDepth': any_depth, 'release': release, 'maxDepth': max_depth, 'dedup': merge_groups, 'shardBy': shard_by,
+            'shardMaxStatements': shard_max_statements, 'shardMaxBytes': shard_max_bytes, 'compress': compress, 'converter': converterHash(),
+        }
+        checkpoint = Checkpoint(checkpoint_fn, settings, interval=checkpoint_interval)
+        if resume:
+            checkpoint.load()
+    elif resume:
+        log.warning('--resume needs a checkpoint, --checkpoint-interval is 0 - starting from scratch')
+
+    # the pipeline fetches entities itself, overlapped with conversion
+    if prefetch_workers and not pipeline:
+        with metrics.timer('entityFetch'):
+            prefetchEntities([reaction for reaction in reactionList if not checkpoint or str(reaction[0]) not in checkpoint.done], workers=prefetch_workers)
+
+    if manifest:
+        manifest = ConversionManifest(manifest, belversion)
+
+    shardKeys = None
+    if shard_by == 'species':
+        shardKeys = reactionSpecies
+    elif shard_by == 'pathway':
+        shardKeys = getTopLevelPathways(species, release=release)
+
+    with metrics.timer('buildBelEvidences'):
+        written = buildBelEvidences(reactionList, belversion, pathways=pathways, workers=workers, manifest=manifest, progressInterval=progress_interval, mergeGroups=merge_groups,
+                                    shardBy=shard_by, shardKeys=shardKeys, maxStatements=shard_max_statements, maxBytes=shard_max_bytes,
+                                    pipeline=pipeline, fetchWorkers=prefetch_workers or 1, checkpoint=checkpoint)
+
+    if metrics_fn:
+        evidenceSeconds = metrics.snapshot()['timers']['buildBelEvidences']
+        writeReport(
+            metrics_fn,
+            started=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+            seconds=round(time.time() - started, 3),
+            belversion=belversion,
+            species=list(species),
+            pathways=list(pathways or []),
+            workers=workers,
+            reactions=len(reactionList),
+            written=written,
+            reactionsPerSecond=round(len(reactionList) / evidenceSeconds, 2) if evidenceSeconds else 0.0,
+            caches={'belCache': getBelCacheStats(), 'entityCache': getEntityCacheStats()},
+            traversal=getTraversalStats(),
+            http=getClient().stats(),
+        )
 
     # buildBelEvidences([('109514', 'Test')])
     # # buildBelEvidences([('450092', 'Test')])
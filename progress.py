@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rate-limited progress reporting
+
+Logs items done, throughput and ETA at most once per interval instead of a
+line per item, so long runs stay readable and terminal output stays cheap.
+"""
+
+import time
+
+import logging
+log = logging.getLogger('root')
+
+
+def formatDuration(seconds):
+    """Seconds as H:MM:SS"""
+
+    seconds = int(round(seconds))
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class ProgressReporter(object):
+    """Report progress of a run over total items
+
+    Inputs:
+        total      number of items expected, None if unknown
+        interval   min seconds between reports (0 = only the final report)
+        label      what is being counted, e.g. Reactions
+    """
+
+    def __init__(self, total=None, interval=10.0, label='Items'):
+        self.total = total
+        self.interval = interval
+        self.label = label
+        self.done = 0
+        self.start = time.monotonic()
+        self.last = self.start
+
+    def update(self, n=1):
+        self.done += n
+        if self.interval:
+            now = time.monotonic()
+            if now - self.last >= self.interval:
+                self.last = now
+                self.report(now)
+
+    def report(self, now=None, final=False):
+        elapsed = (now or time.monotonic()) - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+
+        if final:
+            log.info('{}: {} done in {}  {:.1f}/s'.format(self.label, self.done, formatDuration(elapsed), rate))
+        elif self.total:
+            eta = (self.total - self.done) / rate if rate else 0.0
+            log.info('{}: {}/{} ({:.1f}%)  {:.1f}/s  ETA {}'.format(
+                self.label, self.done, self.total, 100.0 * self.done / self.total, rate, formatDuration(eta)))
+        else:
+            log.info('{}: {}  {:.1f}/s'.format(self.label, self.done, rate))
+
+    def finish(self):
+        self.report(final=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.finish()
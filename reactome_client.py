@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Shared HTTP client for the Reactome webservice
+
+One pooled requests.Session for the whole run with timeouts, exponential
+backoff retries on connection errors/5xx/429, an optional client-side rate
+limit and per-request latency statistics.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import logging
+log = logging.getLogger('root')
+
+# Status codes worth retrying - everything else is returned to the caller
+retryStatusCodes = (429, 500, 502, 503, 504)
+
+
+class ReactomeRequestError(Exception):
+    """Request still failing after all retries"""
+
+
+class RateLimiter(object):
+    """Token bucket allowing rate requests per second with bursts up to burst"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def tryAcquire(self):
+        """Take a token if one is available, never blocks"""
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """Block until a request may be sent"""
+
+        while not self.tryAcquire():
+            # Roughly until the next token, tryAcquire does the accounting
+            time.sleep(max(1 - self.tokens, 0.01) / self.rate)
+
+
+class ReactomeClient(object):
+    """Pooled, retrying HTTP client
+
+    Inputs:
+        timeout      (connect, read) timeout in seconds
+        retries      retries after the first attempt
+        backoff      first retry delay in seconds, doubled on every retry
+        maxBackoff   upper limit for a single retry delay
+        rateLimit    max requests per second (None = unlimited)
+        poolSize     max keep-alive connections per host
+    """
+
+    def __init__(self, timeout=(10, 120), retries=5, backoff=0.5, maxBackoff=60, rateLimit=None, poolSize=32):
+        # Options to build an equivalent client with, e.g. in a worker process
+        self.settings = {'timeout': timeout, 'retries': retries, 'backoff': backoff, 'maxBackoff': maxBackoff,
+                         'rateLimit': rateLimit, 'poolSize': poolSize}
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.rateLimiter = RateLimiter(rateLimit) if rateLimit else None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.lock = threading.Lock()
+        self.requestCnt = 0
+        self.retryCnt = 0
+        self.errorCnt = 0
+        self.totalLatency = 0.0
+        self.latencies = deque(maxlen=100000)  # most recent request latencies for percentiles
+
+    def recordLatency(self, latency):
+        with self.lock:
+            self.requestCnt += 1
+            self.totalLatency += latency
+            self.latencies.append(latency)
+
+    def retryDelay(self, attempt, response=None):
+        """Exponential backoff with jitter, honouring Retry-After when sent"""
+
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(self.maxBackoff, float(response.headers['Retry-After']))
+        delay = min(self.maxBackoff, self.backoff * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    def request(self, method, url, **kwargs):
+        """Send request, retrying transient failures
+
+        Returns:
+            requests.Response with a non-retryable status
+
+        Raises:
+            ReactomeRequestError once all retries are used up
+        """
+
+        kwargs.setdefault('timeout', self.timeout)
+        error = None
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                with self.lock:
+                    self.retryCnt += 1
+
+            if self.rateLimiter:
+                self.rateLimiter.acquire()
+
+            start = time.monotonic()
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            self.recordLatency(time.monotonic() - start)
+
+            if response is not None and response.status_code not in retryStatusCodes:
+                return response
+
+            if response is not None:
+                error = 'HTTP {}'.format(response.status_code)
+
+            if attempt < self.retries:
+                delay = self.retryDelay(attempt, response)
+                log.info('Reactome {} {} failed ({}) - retry in {:.1f}s'.format(method, url, error, delay))
+                time.sleep(delay)
+
+        with self.lock:
+            self.errorCnt += 1
+        raise ReactomeRequestError('{} {} failed after {} attempts: {}'.format(method, url, self.retries + 1, error))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """Request counts and latency summary in seconds"""
+
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                'requests': self.requestCnt,
+                'retries': self.retryCnt,
+                'errors': self.errorCnt,
+                'latency_mean': self.totalLatency / self.requestCnt if self.requestCnt else 0.0,
+            }
+
+        for name, pct in (('latency_p50', 0.50), ('latency_p95', 0.95), ('latency_p99', 0.99)):
+            stats[name] = latencies[int(pct * (len(latencies) - 1))] if latencies else 0.0
+        stats['latency_max'] = latencies[-1] if latencies else 0.0
+
+        return stats
+
+
+client = None
+clientLock = threading.Lock()
+
+
+def configureClient(**kwargs):
+    """Replace the shared client - see ReactomeClient for options"""
+
+    global client
+    client = ReactomeClient(**kwargs)
+    return client
+
+
+def getClient():
+    """Shared client, created with default settings on first use"""
+
+    global client
+    with clientLock:
+        if client is None:
+            client = ReactomeClient()
+    return client
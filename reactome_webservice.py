@@ -14,93 +14,374 @@ Options:
 """
 
 import os
-import requests
-from lxml import etree
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from bioservices import Reactome
+from cache import LRUCache
+from entity_store import openEntityStore
+from reactome_client import getClient, ReactomeRequestError
+from pathway_index import PathwayIndex, indexFilename
+from metrics import metrics
 
 import logging
 log = logging.getLogger('root')
 
-s = Reactome()
-
 wsUrl = 'http://reactome.org/ReactomeRESTfulAPI/RESTfulWS'  # base Url for Reactome Webservice
 
+defaultDownloadDir = './downloadedEntities'
 
-def getEntityData(dbId, downloadDir=None):
-    ''' Get reactome entities by database id'''
+# Reactome release used to key cached hierarchies and pathway indexes
+defaultRelease = 'current'
+
+# Seconds a fetched 'current' hierarchy is reused before it is fetched again
+currentMaxAge = 24 * 3600
+
+# Never contact the webservice - everything must come from local imports
+offline = False
+
+# Max dbIds per queryByIds request in getEntitiesData
+batchSize = 100
+
+# Backend holding downloaded entities - see entity_store.py
+entityStore = None
+
+# Pathway indexes loaded in this run keyed by (species, release)
+pathwayIndexes = {}
+
+# Parsed entities keyed by (store location, dbId) so popular entities are not
+# re-read and re-parsed from the entity store on every lookup
+entityCache = LRUCache(maxsize=100000)
+
+
+def setWsUrl(url):
+    ''' Point the webservice calls at another base Url, e.g. a local stand-in server'''
+
+    global wsUrl
+    wsUrl = url.rstrip('/')
+
+
+def setOffline(flag=True):
+    ''' Serve entities and hierarchies only from local stores, see bulk_import.py'''
+
+    global offline
+    offline = flag
+
+
+def setRelease(release):
+    ''' Set Reactome release used to key cached hierarchies and pathway indexes'''
+
+    global defaultRelease
+    defaultRelease = str(release)
+
+
+def setCurrentMaxAge(seconds):
+    ''' Set how long a fetched 'current' pathway hierarchy is reused, 0 = fetch on every run'''
+
+    global currentMaxAge
+    currentMaxAge = seconds
+
+
+def setBatchSize(size):
+    ''' Set max number of dbIds fetched per queryByIds request'''
+
+    global batchSize
+    batchSize = size
+
+
+def setEntityStore(store):
+    ''' Use store (DirectoryStore, SqliteStore or a location for openEntityStore) for downloaded entities'''
+
+    global entityStore
+    if not hasattr(store, 'get'):
+        store = openEntityStore(store)
+    entityStore = store
 
-    if not downloadDir:
-        downloadDir = './downloadedEntities'
 
-    fn = '{}/{}.json'.format(downloadDir, dbId)
+def getEntityStore(downloadDir=None):
+    ''' Entity store for downloadDir, or the configured default store'''
 
-    if os.path.isfile(fn):
-        with open(fn, 'r') as f:
-            entity = json.load(f)
+    global entityStore
+    if downloadDir:
+        return openEntityStore(downloadDir)
+    if entityStore is None:
+        entityStore = openEntityStore(defaultDownloadDir)
+    return entityStore
 
-    else:
-        try:
-            r = requests.get("{}/queryById/DatabaseObject/{}".format(wsUrl, dbId))
-        except:
-            log.info('Reactome GET failed: {}'.format(dbId))
 
-        entity = r.json()
-        with open(fn, 'w') as f:
-            json.dump(entity, f, indent=4)
+def setEntityCacheSize(size):
+    ''' Set maximum number of parsed entities kept in memory (0 or None is unbounded)'''
+
+    entityCache.resize(size)
+
+
+def getEntityCacheStats():
+    ''' Hit/miss/eviction counts for the in-memory entity cache'''
+
+    return entityCache.stats()
+
+
+def preloadEntities(downloadDir=None):
+    ''' Load all stored entities into the in-memory entity cache
+
+    Stops early once the cache is full so the preload never evicts itself.
+
+    Returns:
+        number of entities loaded
+    '''
+
+    store = getEntityStore(downloadDir)
+
+    cnt = 0
+    for dbId, entity in store.items():
+        if entityCache.maxsize and len(entityCache) >= entityCache.maxsize:
+            log.info('Entity cache full after preloading {} entities'.format(cnt))
+            break
+        entityCache.put((store.path, dbId), entity)
+        cnt += 1
+
+    log.debug('preloadEntities  Store: {}  Cnt: {}'.format(store.path, cnt))
+    return cnt
+
+
+def getEntityData(dbId, downloadDir=None):
+    ''' Get reactome entities by database id
+
+    Entities are served from the in-memory cache, then the entity store, then
+    the Reactome webservice.  Treat the returned dict as read-only, it is
+    shared with other callers.
+    '''
+
+    store = getEntityStore(downloadDir)
+
+    key = (store.path, str(dbId))
+    entity = entityCache.get(key)
+    if entity is not None:
+        return entity
+
+    with metrics.timer('entityLoad'):
+        entity = store.get(dbId)
+
+        if entity is None:
+            if offline:
+                log.error('Entity not in local store (offline): {}'.format(dbId))
+                return None
+            try:
+                r = getClient().get("{}/queryById/DatabaseObject/{}".format(wsUrl, dbId))
+                r.raise_for_status()
+                entity = r.json()
+            except (ReactomeRequestError, ValueError, IOError) as e:
+                log.error('Reactome GET failed: {}  {}'.format(dbId, e))
+                return None
+
+            store.put(dbId, entity)
+            metrics.count('entitySource', 'webservice')
+        else:
+            metrics.count('entitySource', 'store')
+
+    entityCache.put(key, entity)
 
     return entity
 
 
-def getReactions(species, pathways=None, xmlFn=None):
-    ''' Collect all reactions for specified species
+def fetchEntityBatch(dbIds):
+    ''' Fetch several entities with one queryByIds request
 
-    Inputs:
-        xmlfn      optional xml filename for pathway hierarchy
-        pathway    filter by an optional pathway
+    Returns:
+        dict of str(dbId) -> entity for the entities the webservice returned
+    '''
+
+    r = getClient().post(
+        "{}/queryByIds/DatabaseObject".format(wsUrl),
+        data='ID={}'.format(','.join([str(dbId) for dbId in dbIds])),
+        headers={'Content-Type': 'text/plain', 'Accept': 'application/json'})
+    r.raise_for_status()
+
+    return {str(entity['dbId']): entity for entity in r.json() if entity and 'dbId' in entity}
+
+
+def getEntitiesData(dbIds, downloadDir=None):
+    ''' Get many reactome entities by database id
+
+    Entities missing from the cache and the entity store are fetched batchSize
+    at a time and split back into per-entity store records.  Anything a batch
+    does not return falls back to a single getEntityData request.
 
     Returns:
-        reactionList   list of tuples containing (dbId, displayName) of each reaction
+        dict of str(dbId) -> entity, entities that cannot be fetched are left out
+    '''
+
+    store = getEntityStore(downloadDir)
+
+    entities = {}
+    missing = []
+    for dbId in dbIds:
+        dbId = str(dbId)
+        if dbId in entities:
+            continue
+        key = (store.path, dbId)
+        entity = entityCache.get(key)
+        if entity is None:
+            entity = store.get(dbId)
+            if entity is None:
+                missing.append(dbId)
+                continue
+            entityCache.put(key, entity)
+        entities[dbId] = entity
+
+    missing = list(dict.fromkeys(missing))
+    if offline and missing:
+        log.error('{} entities not in local store (offline)'.format(len(missing)))
+        missing = []
+
+    size = batchSize if batchSize and batchSize > 1 else 1
+    for start in range(0, len(missing), size):
+        chunk = missing[start:start + size]
+
+        fetched = {}
+        if len(chunk) > 1:
+            try:
+                fetched = fetchEntityBatch(chunk)
+            except (ReactomeRequestError, ValueError, IOError) as e:
+                log.error('Reactome batch query failed for {} dbIds: {}'.format(len(chunk), e))
+
+        store.putMany(fetched.items())
+        for dbId, entity in fetched.items():
+            entityCache.put((store.path, dbId), entity)
+        entities.update(fetched)
 
-    Caching results of query locally in the xmlfn or (/tmp/reactome_pathway_hierarchy.xml).
+        for dbId in chunk:
+            if dbId not in fetched:
+                entity = getEntityData(dbId, downloadDir=downloadDir)
+                if entity is not None:
+                    entities[dbId] = entity
+
+    return entities
+
+
+def fetchPathwayHierarchy(species):
+    ''' Get pathway hierarchy XML for species from the Reactome webservice'''
+
+    if offline:
+        raise ReactomeRequestError('No local pathway hierarchy for {} (offline) - install one with bulk_import.py hierarchy'.format(species))
+
+    r = getClient().get("{}/pathwayHierarchy/{}".format(wsUrl, species))
+    r.raise_for_status()
+    return r.text
+
+
+def hierarchyFilename(species, release):
+    ''' Cache location of the pathway hierarchy XML for species and release'''
+
+    return 'downloads/pathway_hierarchy-{}-{}.xml'.format(species.replace(' ', '_'), release)
+
+
+def loadPathwayIndex(species, release=None, xmlFn=None):
+    ''' Load the pathway index for species and release, building it on first use
+
+    The hierarchy XML is only fetched (or read from xmlFn) when no index has
+    been saved yet for this species and release.  The 'current' release
+    changes under the same name, so online its hierarchy is fetched again
+    once the saved index is older than currentMaxAge seconds.
     '''
-    reaction_types = ['Reaction', 'BlackBoxEvent', 'Polymerisation', 'Depolymerisation', 'FailedReaction']
 
+    release = release or defaultRelease
+    key = (species, release)
+    if key in pathwayIndexes:
+        return pathwayIndexes[key]
+
+    indexFn = indexFilename(species, release)
+    index = PathwayIndex.load(indexFn) if os.path.isfile(indexFn) else None
+
+    refresh = False
+    if release == 'current' and not offline and not xmlFn:
+        age = time.time() - (index.fetched or 0) if index else None
+        if age is None or age >= currentMaxAge:
+            refresh = True
+            if index:
+                log.info('Release "current" - the {} pathway hierarchy is {:.1f} hours old, fetching it again'.format(species, age / 3600))
+            index = None
+
+    if index:
+        pathwayIndexes[key] = index
+        return index
+
+    fetched = None
     if not xmlFn:
-        xmlFn = '/tmp/reactome_pathway_hierarchy.xml'
-    reactionList = []
-    if os.path.isfile('pathway_hierarchy.xml'):
-        with open('downloads/pathway_hierarchy.xml', 'r') as f:
-            hierarchyXml = f.read()
-    else:
-        hierarchyXml = s.pathway_hierarchy(species)
-
-        with open('downloads/hierarchy.xml', 'w') as f:
+        xmlFn = hierarchyFilename(species, release)
+    if refresh or not os.path.isfile(xmlFn):
+        fetched = time.time()
+        hierarchyXml = fetchPathwayHierarchy(species)
+
+        dirname = os.path.dirname(xmlFn)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(xmlFn, 'w') as f:
             f.write(hierarchyXml)
+        del hierarchyXml
 
-    root = etree.fromstring(hierarchyXml)
+    index = PathwayIndex.build(xmlFn, species, release)
+    index.fetched = fetched
+    index.save(indexFn)
+    pathwayIndexes[key] = index
 
-    docs = []
+    return index
 
-    for reaction_type in reaction_types:
-        if pathways:
-            for pathway in pathways:
-                docs.append(root.xpath("/Pathways/Pathway[contains(@displayName, '{}')]//{}".format(pathway, reaction_type)))
-        else:
-            docs.append(root.xpath("//{}".format(reaction_type)))
 
-    for doc in docs:
-        for rxn in doc:
-            dbId = rxn.get('dbId')
-            displayName = rxn.get('displayName')
-            # print('Reactions: ', displayName)
-            reactionList.append((dbId, displayName))
+def getReactions(species, pathways=None, xmlFn=None, release=None, match='contains', anyDepth=False):
+    ''' Collect all reactions for specified species
+
+    Inputs:
+        xmlfn      optional xml filename for pathway hierarchy
+        pathway    filter by an optional pathway - dbId, stable ID or name
+        release    Reactome release the cached hierarchy and index belong to
+        match      pathway name match: contains, exact or prefix
+        anyDepth   match sub-pathways too, not only top-level pathways
+
+    Returns:
+        reactionList   list of tuples containing (dbId, displayName) of each reaction
+
+    Queries are answered from the persistent pathway index (see pathway_index.py),
+    the hierarchy is cached in xmlfn or downloads/pathway_hierarchy-<species>-<release>.xml.
+    '''
+
+    index = loadPathwayIndex(species, release=release, xmlFn=xmlFn)
+    reactionList = index.getReactions(pathways, match=match, anyDepth=anyDepth)
 
     log.debug('getReactions  Species: {}  Cnt: {}'.format(species, len(reactionList)))
     return reactionList
-    # print('DumpVar:\n', json.dumps(reactionList, indent=4))
-    # print('Length ', len(reactionList))
+
+
+def getSpeciesReactions(speciesList, pathways=None, release=None, match='contains', anyDepth=False):
+    ''' Collect reactions for several species, fetching and parsing their hierarchies concurrently
+
+    Returns:
+        dict of species -> reactionList, see getReactions
+    '''
+
+    speciesList = list(dict.fromkeys(speciesList))
+    if len(speciesList) <= 1:
+        return {species: getReactions(species, pathways=pathways, release=release, match=match, anyDepth=anyDepth) for species in speciesList}
+
+    with ThreadPoolExecutor(max_workers=len(speciesList)) as executor:
+        futures = {species: executor.submit(getReactions, species, pathways=pathways, release=release, match=match, anyDepth=anyDepth)
+                   for species in speciesList}
+        return {species: future.result() for species, future in futures.items()}
+
+
+def getTopLevelPathways(speciesList, release=None):
+    ''' Top-level pathways of every reaction in the pathway indexes of species
+
+    Returns:
+        dict of rxnId -> list of top-level pathway names
+    '''
+
+    reactionPathways = {}
+    for species in dict.fromkeys(speciesList):
+        for rxnId, names in loadPathwayIndex(species, release=release).topLevelPathways().items():
+            merged = reactionPathways.setdefault(rxnId, [])
+            merged.extend(name for name in names if name not in merged)
+    return reactionPathways
 
 
 def getSets():
@@ -115,7 +396,8 @@ def getSets():
         fn = 'downloads/{}.json'.format(key)
 
         if not os.path.isfile(fn):
-            r = requests.get("{}/{}".format(wsUrl, queries[key]))
+            r = getClient().get("{}/{}".format(wsUrl, queries[key]))
+            r.raise_for_status()
             data = r.json()
             with open(fn, 'w') as f:
                 json.dump(data, f, indent=4)
@@ -128,21 +410,18 @@ def getSets():
         fn = 'downloads/{}.txt'.format(key)
 
         if not os.path.isfile(fn):
-            r = requests.get("{}/{}".format(wsUrl, queries[key]))
+            r = getClient().get("{}/{}".format(wsUrl, queries[key]))
+            r.raise_for_status()
             data = r.text
             with open(fn, 'w') as f:
                 f.write(data)
 
 
 def indexEntities():
-    import glob
-    files = glob.glob('./downloadedEntities/*.json')
 
     with open('./entityIndex.txt', mode='w') as o:
-        for fn in files:
-            print('FN: ', fn)
-            with open(fn, 'r') as f:
-                entity = json.load(f)
+        for fn, entity in getEntityStore().items():
+            log.debug('indexEntities: %s', fn)
             if 'dbId' in entity:
                 dbId = entity['dbId']
                 schemaClass = entity['schemaClass']
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Sharded BEL script output
+
+Statement groups are split over several BEL documents - by a key such as
+species or top-level pathway, by a maximum number of statements or bytes
+per document, or both.  Every shard is a complete document with its own
+header and namespace definitions, so shards can be checked and loaded in
+parallel.  A manifest listing every shard is written next to them.
+
+Shard filenames are built from the base filename, e.g. for reactome.bels
+
+    reactome-Homo_sapiens.bels          split by key
+    reactome-Homo_sapiens-002.bels      split by key and size
+    reactome-002.bels                   split by size only
+"""
+
+import os
+import re
+import json
+
+from belscript_writer import BelScriptWriter
+from evidence_dedup import EvidenceDeduplicator, isStructural, fingerprint
+
+import logging
+log = logging.getLogger('root')
+
+manifestFormat = 1
+
+shardModes = ['species', 'pathway']
+
+nonFilenameRegex = re.compile(r'[^\w.-]+')
+
+
+def shardFilename(fn, key=None, part=None):
+    """Shard filename for key and part number (None when not split that way)"""
+
+    base, ext = os.path.splitext(fn)
+    if key:
+        base = '{}-{}'.format(base, nonFilenameRegex.sub('_', key).strip('_'))
+    if part:
+        base = '{}-{:03d}'.format(base, part)
+    return '{}{}'.format(base, ext)
+
+
+class ShardWriter(object):
+    """Write statement groups to BEL script shards
+
+    Inputs:
+        fn              base filename, shards are named after it (see shardFilename)
+        template        jinja2 Template, see BelScriptWriter
+        contextFor      function key -> template context of the shards for that key
+        splitBy         what keys are, e.g. species or pathway - recorded in the manifest
+        maxStatements   start a new part when a shard would exceed this many statements (0 = no limit)
+        maxBytes        start a new part once a shard reaches this many bytes (0 = no limit)
+        dedup           merge identical groups per key and write each structural
+                        statement once per shard, see evidence_dedup.py
+        manifestFn      shard manifest filename, default <fn>.shards.json
+    """
+
+    def __init__(self, fn, template, contextFor, splitBy=None, maxStatements=0, maxBytes=0, dedup=False, manifestFn=None):
+        self.fn = fn
+        self.template = template
+        self.contextFor = contextFor
+        self.splitBy = splitBy
+        self.maxStatements = maxStatements or 0
+        self.maxBytes = maxBytes or 0
+        self.dedup = dedup
+        self.manifestFn = manifestFn or '{}.shards.json'.format(fn)
+        self.spoolDir = os.path.dirname(os.path.abspath(fn))
+
+        self.current = {}  # key -> (BelScriptWriter, part, seen structural statement fingerprints) of the open shard
+        self.deduplicators = {}  # key -> EvidenceDeduplicator
+        self.shards = []  # manifest entries of finished shards
+        self.groupCnt = 0
+        self.statementCnt = 0
+
+    @property
+    def split(self):
+        return bool(self.maxStatements or self.maxBytes)
+
+    def write(self, evidence, keys=(None,)):
+        """Write evidence to the shards of every key"""
+
+        for key in keys:
+            if self.dedup:
+                if key not in self.deduplicators:
+                    self.deduplicators[key] = EvidenceDeduplicator(spoolDir=self.spoolDir)
+                self.deduplicators[key].add(evidence)
+            else:
+                self.writeShard(key, evidence)
+
+    def writeShard(self, key, evidence):
+        writer, part, seen = self.current.get(key, (None, None, None))
+
+        # The limit applies to the statements actually written, after the per-shard structural filter
+        statements = self.unseenStatements(evidence['statements'], seen)
+        if writer and writer.groupCnt and (
+                (self.maxStatements and writer.statementCnt + len(statements) > self.maxStatements)
+                or (self.maxBytes and writer.byteCnt >= self.maxBytes)):
+            self.closeShard(key)
+            writer = None
+
+        if writer is None:
+            part = len([shard for shard in self.shards if shard['key'] == key]) + 1 if self.split else None
+            context = dict(self.contextFor(key))
+            if part:
+                context['BEL_DOCUMENT_NAME'] = '{} part {}'.format(context['BEL_DOCUMENT_NAME'], part)
+            writer = BelScriptWriter(shardFilename(self.fn, key, part), self.template, context)
+            seen = set()
+            self.current[key] = (writer, part, seen)
+            statements = self.unseenStatements(evidence['statements'], seen)
+
+        if self.dedup:
+            seen.update(fingerprint(statement) for statement in statements if isStructural(statement))
+            evidence = dict(evidence, statements=statements)
+
+        writer.write(evidence)
+        self.groupCnt += 1
+        self.statementCnt += len(evidence['statements'])
+
+    def unseenStatements(self, statements, seen):
+        """statements without the structural ones already in seen or repeated (with dedup)"""
+
+        if not self.dedup:
+            return statements
+
+        unseen = []
+        keys = set()
+        for statement in statements:
+            if isStructural(statement):
+                statementKey = fingerprint(statement)
+                if statementKey in keys or (seen and statementKey in seen):
+                    continue
+                keys.add(statementKey)
+            unseen.append(statement)
+        return unseen
+
+    def closeShard(self, key):
+        writer, part, seen = self.current.pop(key)
+        writer.close()
+        self.shards.append({
+            'fn': os.path.basename(writer.fn),
+            'key': key,
+            'part': part,
+            'groups': writer.groupCnt,
+            'statements': writer.statementCnt,
+            'bytes': writer.byteCnt,
+        })
+
+    def writeManifest(self):
+        """Write shard manifest atomically"""
+
+        data = {
+            'format': manifestFormat,
+            'source': os.path.basename(self.fn),
+            'splitBy': self.splitBy,
+            'maxStatements': self.maxStatements,
+            'maxBytes': self.maxBytes,
+            'groups': self.groupCnt,
+            'statements': self.statementCnt,
+            'shards': self.shards,
+        }
+        tmpFn = '{}.tmp'.format(self.manifestFn)
+        with open(tmpFn, 'w') as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmpFn, self.manifestFn)
+
+    def close(self):
+        """Write out deduplicated groups, close all shards and write the manifest"""
+
+        if self.current is None:
+            return
+
+        for key, deduplicator in self.deduplicators.items():
+            with deduplicator:
+                for evidence in deduplicator.evidences(dropStructural=False):
+                    self.writeShard(key, evidence)
+        self.deduplicators = {}
+
+        for key in list(self.current):
+            self.closeShard(key)
+        self.current = None
+
+        self.shards.sort(key=lambda shard: shard['fn'])
+        self.writeManifest()
+
+        log.info('Wrote {} shards of {}  Groups: {}  Statements: {}  Manifest: {}'.format(
+            len(self.shards), self.fn, self.groupCnt, self.statementCnt, self.manifestFn))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            for writer, part, seen in (self.current or {}).values():
+                writer.close()
+            for deduplicator in self.deduplicators.values():
+                deduplicator.close()
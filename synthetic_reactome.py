@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Usage:  synthetic_reactome.py <outDir> [--reactions 1000] [--depth 3] [--sharing 0.8]
+
+Synthetic Reactome fixtures for benchmarks and the fake Reactome server
+
+Generates an entity graph in the shape queryById/DatabaseObject returns -
+small molecules, proteins, polymers, nested complexes and sets, catalyst
+activities and reactions - together with a matching pathway hierarchy XML.
+Popular entities are drawn far more often than the rest (like ATP or water
+in the real data) so conversion caches see a realistic sharing ratio.
+"""
+
+import os
+import random
+
+import click
+
+from entity_store import openEntityStore
+
+speciesNames = ['Homo sapiens', 'Mus musculus', 'Rattus norvegicus']
+speciesCodes = {'Homo sapiens': 'HSA', 'Mus musculus': 'MMU', 'Rattus norvegicus': 'RNO'}
+compartments = ['cytosol', 'nucleoplasm', 'plasma membrane', 'mitochondrial matrix', 'extracellular region']
+reactionClasses = ['Reaction', 'Reaction', 'Reaction', 'BlackBoxEvent', 'Polymerisation', 'Depolymerisation', 'FailedReaction']
+setClasses = ['DefinedSet', 'CandidateSet', 'OpenSet']
+
+
+class FixtureBuilder(object):
+    """Accumulates synthetic entities with increasing dbIds"""
+
+    def __init__(self, seed=1, firstId=100000):
+        self.random = random.Random(seed)
+        self.nextId = firstId
+        self.entities = {}
+
+    def add(self, schemaClass, **fields):
+        self.nextId += 1
+        entity = {'dbId': self.nextId, 'schemaClass': schemaClass}
+        entity.update(fields)
+        entity.setdefault('displayName', '{} {}'.format(schemaClass, self.nextId))
+        self.entities[self.nextId] = entity
+        return entity
+
+    def compartment(self):
+        return [{'dbId': 1, 'displayName': self.random.choice(compartments), 'schemaClass': 'EntityCompartment'}]
+
+    def pick(self, pool, cnt, skew=1.0):
+        """Pick cnt distinct entities, earlier ones far more often (Zipf-like)"""
+
+        picked = {}
+        while len(picked) < min(cnt, len(pool)):
+            index = int(len(pool) * (self.random.random() ** (1 + skew * 3)))
+            entity = pool[min(index, len(pool) - 1)]
+            picked[entity['dbId']] = entity
+        return list(picked.values())
+
+
+def reference(entity):
+    """Shallow reference as embedded in Reactome objects"""
+
+    return {'dbId': entity['dbId'], 'displayName': entity['displayName'], 'schemaClass': entity['schemaClass']}
+
+
+def generateEntities(builder, reactions=1000, fanout=3, depth=3, sharing=0.8, species=None):
+    """Build entity graph and reactions
+
+    Inputs:
+        reactions   number of reactions
+        fanout      max inputs/outputs per reaction and components per complex
+        depth       max nesting depth of complexes and sets
+        sharing     0..1, higher values mean fewer distinct participants
+
+    Returns:
+        list of reaction entities
+    """
+
+    rnd = builder.random
+    species = species or ['Homo sapiens']
+
+    nLeaves = max(20, int(reactions * 3 * (1 - sharing)))
+    leaves = []
+    for i in range(nLeaves):
+        kind = rnd.random()
+        name = 'mol{}'.format(i)
+        if kind < 0.35:
+            leaves.append(builder.add('SimpleEntity', name=[name], compartment=builder.compartment(),
+                                      referenceEntity={'displayName': '{} [ChEBI:{}]'.format(name, 15000 + i)}))
+        elif kind < 0.80:
+            leaves.append(builder.add('EntityWithAccessionedSequence', name=['PROT{}'.format(i)], compartment=builder.compartment(),
+                                      referenceEntity={'displayName': 'UniProt:Q{:05d} GENE{}'.format(i, i)}))
+        elif kind < 0.88:
+            leaves.append(builder.add('OtherEntity', name=['other "{}"'.format(i)]))
+        elif kind < 0.94:
+            leaves.append(builder.add('Polymer', name=['poly{}'.format(i)], compartment=builder.compartment(),
+                                      crossReference=[{'displayName': 'ChEBI:{}'.format(30000 + i)}]))
+        else:
+            leaves.append(builder.add('GenomeEncodedEntity', name=['gee{}'.format(i)], compartment=builder.compartment()))
+
+    # Complexes and sets nest up to depth levels, each level built from the ones below
+    levels = [leaves]
+    pool = list(leaves)
+    for level in range(1, depth + 1):
+        current = []
+        for i in range(max(5, nLeaves // (2 * level))):
+            members = builder.pick(pool, rnd.randint(2, fanout + 1), skew=sharing)
+            if rnd.random() < 0.7:
+                current.append(builder.add('Complex', name=['cx{}-{}'.format(level, i)], compartment=builder.compartment(),
+                                           hasComponent=[reference(m) for m in members]))
+            else:
+                key = 'hasMember' if rnd.random() < 0.6 else 'hasCandidate'
+                fields = {'name': ['set{}-{}'.format(level, i)], 'compartment': builder.compartment(), key: [reference(m) for m in members]}
+                current.append(builder.add(rnd.choice(setClasses), **fields))
+        levels.append(current)
+        pool = current + pool
+
+    catalystPool = [e for e in pool if e['schemaClass'] in ('Complex', 'EntityWithAccessionedSequence')]
+
+    rxns = []
+    for i in range(reactions):
+        specie = rnd.choice(species)
+        fields = {
+            'displayName': 'Reaction "{}" of {}'.format(i, specie),
+            'speciesName': specie,
+            'stableIdentifier': {'displayName': 'R-{}-{}.1'.format(speciesCodes[specie], 9000000 + i)},
+            'compartment': builder.compartment(),
+            'created': {'displayName': 'Curator, A, 20{:02d}-0{}-1{}'.format(rnd.randint(3, 16), rnd.randint(1, 9), rnd.randint(0, 9))},
+            'input': [reference(e) for e in builder.pick(pool, rnd.randint(1, fanout), skew=sharing)],
+            'output': [reference(e) for e in builder.pick(pool, rnd.randint(1, fanout), skew=sharing)],
+        }
+        catalysts = []
+        for j in range(rnd.choice([0, 1, 1, 2])):
+            catalysts.append(builder.add('CatalystActivity', physicalEntity=reference(rnd.choice(catalystPool))))
+        if catalysts:
+            fields['catalystActivity'] = [reference(c) for c in catalysts]
+        rxns.append(builder.add(rnd.choice(reactionClasses), **fields))
+
+    return rxns
+
+
+def hierarchyXml(builder, reactions, pathwaysPerLevel=4, perPathway=25):
+    """Pathway hierarchy XML with two pathway levels above the reactions"""
+
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<Pathways>']
+    nTop = max(1, len(reactions) // (pathwaysPerLevel * perPathway))
+    chunks = [reactions[i::nTop] for i in range(nTop)]
+    for top, chunk in enumerate(chunks):
+        builder.nextId += 1
+        lines.append('<Pathway dbId="{}" displayName="Top pathway {}">'.format(builder.nextId, top))
+        for sub in range(0, len(chunk), perPathway):
+            builder.nextId += 1
+            lines.append('<Pathway dbId="{}" displayName="Sub pathway {}-{}">'.format(builder.nextId, top, sub // perPathway))
+            for rxn in chunk[sub:sub + perPathway]:
+                lines.append('<{} dbId="{}" displayName="{}"/>'.format(rxn['schemaClass'], rxn['dbId'], 'Reaction {}'.format(rxn['dbId'])))
+            lines.append('</Pathway>')
+        lines.append('</Pathway>')
+    lines.append('</Pathways>')
+    return '\n'.join(lines) + '\n'
+
+
+def generateFixture(outDir, reactions=1000, fanout=3, depth=3, sharing=0.8, species=None, seed=1, store='downloadedEntities'):
+    """Write a synthetic fixture into outDir
+
+    Creates the entity store (outDir/<store>, a *.sqlite name gives a
+    SqliteStore) and outDir/hierarchy.xml.
+
+    Returns:
+        dict with the reactionList, entity count and file locations
+    """
+
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+
+    builder = FixtureBuilder(seed=seed)
+    rxns = generateEntities(builder, reactions=reactions, fanout=fanout, depth=depth, sharing=sharing, species=species)
+
+    storeLocation = os.path.join(outDir, store)
+    entityStore = openEntityStore(storeLocation)
+    entityStore.putMany((str(dbId), entity) for dbId, entity in builder.entities.items())
+    entityStore.close()
+
+    hierarchyFn = os.path.join(outDir, 'hierarchy.xml')
+    with open(hierarchyFn, 'w') as f:
+        f.write(hierarchyXml(builder, rxns))
+
+    return {
+        'reactionList': [(str(rxn['dbId']), rxn['displayName']) for rxn in rxns],
+        'entities': len(builder.entities),
+        'store': storeLocation,
+        'hierarchy': hierarchyFn,
+    }
+
+
+@click.command()
+@click.argument('outdir')
+@click.option('--reactions', '-n', default=1000, type=int, help="Number of reactions")
+@click.option('--fanout', default=3, type=int, help="Max inputs/outputs per reaction and components per complex")
+@click.option('--depth', default=3, type=int, help="Max nesting depth of complexes and sets")
+@click.option('--sharing', default=0.8, type=float, help="0..1, higher means more reuse of the same participants")
+@click.option('--seed', default=1, type=int, help="Random seed")
+@click.option('--store', default='downloadedEntities', help="Entity store name inside outdir, *.sqlite for a single file")
+def main(outdir, reactions, fanout, depth, sharing, seed, store):
+    """Generate a synthetic Reactome fixture"""
+
+    fixture = generateFixture(outdir, reactions=reactions, fanout=fanout, depth=depth, sharing=sharing, seed=seed, store=store)
+    print('{} reactions, {} entities in {}'.format(len(fixture['reactionList']), fixture['entities'], fixture['store']))
+
+
+if __name__ == '__main__':
+    main()
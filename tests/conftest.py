@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Shared fixtures - the modules live at the top of the repository
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compression
+import reactome_client
+import reactome_webservice
+import toBel
+from synthetic_reactome import generateFixture
+
+
+@pytest.fixture(scope='session')
+def syntheticFixture(tmp_path_factory):
+    """Small synthetic Reactome fixture, see synthetic_reactome.generateFixture"""
+
+    return generateFixture(str(tmp_path_factory.mktemp('fixture')), reactions=20)
+
+
+@pytest.fixture(autouse=True)
+def resetGlobals(monkeypatch):
+    """Module level settings back to their defaults for every test"""
+
+    compression.setCompression(None)
+    monkeypatch.setattr(reactome_webservice, 'wsUrl', reactome_webservice.wsUrl)
+    monkeypatch.setattr(reactome_webservice, 'offline', False)
+    monkeypatch.setattr(reactome_webservice, 'batchSize', 100)
+    monkeypatch.setattr(reactome_webservice, 'entityStore', None)
+    monkeypatch.setattr(reactome_webservice, 'defaultRelease', 'current')
+    monkeypatch.setattr(reactome_webservice, 'pathwayIndexes', {})
+    monkeypatch.setattr(reactome_client, 'client', None)
+    reactome_webservice.entityCache.clear()
+    toBel.belCache.clear()
+    yield
+    compression.setCompression(None)
+    reactome_webservice.entityCache.clear()
+    toBel.belCache.clear()
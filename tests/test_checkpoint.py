@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Checkpoints and resuming interrupted runs
+"""
+
+import os
+import json
+
+import click
+import pytest
+
+import processReactome
+from bulk_import import importHierarchy
+from checkpoint import Checkpoint
+from compression import compressedFilename, openText
+
+settings = {'species': ['Homo sapiens'], 'belversion': '1'}
+result = {'1': ['evidence', False]}
+
+
+def outputState():
+    return {'reactome.bels': {'size': 0}}
+
+
+def test_checkpoint_resumes_saved_reactions(tmp_path):
+    fn = str(tmp_path / 'run.checkpoint.jsonl')
+
+    checkpoint = Checkpoint(fn, settings, interval=3600)
+    checkpoint.start(outputState)
+    checkpoint.record('1', result)
+    checkpoint.record('2', None)  # no result - retried on resume
+    checkpoint.save()
+    checkpoint.record('3', result)  # after the last save point - lost
+    checkpoint.close()
+
+    checkpoint = Checkpoint(fn, settings)
+    assert checkpoint.load()
+    assert checkpoint.done == {'1'}
+    assert list(checkpoint.replay()) == [('1', {'1': ('evidence', False)})]
+    assert checkpoint.outputs == outputState()
+
+
+def test_checkpoint_ignores_torn_write(tmp_path):
+    fn = str(tmp_path / 'run.checkpoint.jsonl')
+
+    checkpoint = Checkpoint(fn, settings, interval=3600)
+    checkpoint.start(outputState)
+    checkpoint.record('1', result)
+    checkpoint.save()
+    checkpoint.close()
+    with open(fn, 'a') as f:
+        f.write('{"rxnId": "2", "res')
+
+    checkpoint = Checkpoint(fn, settings)
+    assert checkpoint.load()
+    assert checkpoint.done == {'1'}
+
+    # Recording starts again right after the last save point
+    checkpoint.start(outputState)
+    checkpoint.record('2', result)
+    checkpoint.save()
+    checkpoint.close()
+    checkpoint = Checkpoint(fn, settings)
+    assert checkpoint.load()
+    assert checkpoint.done == {'1', '2'}
+
+
+def test_checkpoint_with_other_settings_is_not_resumed(tmp_path):
+    fn = str(tmp_path / 'run.checkpoint.jsonl')
+
+    checkpoint = Checkpoint(fn, settings, interval=3600)
+    checkpoint.start(outputState)
+    checkpoint.record('1', result)
+    checkpoint.save()
+    checkpoint.close()
+
+    assert not Checkpoint(fn, dict(settings, belversion='2')).load()
+    assert not Checkpoint(str(tmp_path / 'missing.jsonl'), settings).load()
+
+    Checkpoint(fn, settings).finish()
+    assert not os.path.exists(fn)
+
+
+def runMain(args):
+    processReactome.main.main(args, standalone_mode=False)
+
+
+def readOutput(fn):
+    with openText(fn, 'r') as f:
+        return [line for line in f if 'DATE' not in line and 'Copyright' not in line]
+
+
+@pytest.mark.parametrize('options', [[], ['--dedup'], ['--compress', 'gzip'], ['--workers', '2']])
+def test_resume_after_crash(syntheticFixture, tmp_path, monkeypatch, options):
+    monkeypatch.chdir(str(tmp_path))
+    importHierarchy('Homo sapiens', syntheticFixture['hierarchy'])
+    args = ['-s', 'Homo sapiens', '--offline', '--entity-store', syntheticFixture['store'], '--prefetch-workers', '0', '-q',
+            '--checkpoint-interval', '0.00001'] + options
+    fn = compressedFilename('reactome.bels', options[1] if options[:1] == ['--compress'] else None)
+
+    runMain(args)
+    expected = readOutput(fn)
+    assert sum('SET STATEMENT_GROUP' in line for line in expected) > 12
+    assert not os.path.exists('reactome.checkpoint.jsonl')
+    os.remove(fn)
+
+    # Interrupt the run in the main process after the 12th written reaction
+    record = Checkpoint.record
+    written = []
+
+    def interrupting(self, rxnId, result):
+        record(self, rxnId, result)
+        written.append(rxnId)
+        if len(written) == 12:
+            raise KeyboardInterrupt('simulated crash')
+
+    monkeypatch.setattr(Checkpoint, 'record', interrupting)
+    with pytest.raises((KeyboardInterrupt, click.exceptions.Abort)):
+        runMain(args)
+    monkeypatch.setattr(Checkpoint, 'record', record)
+
+    with open('reactome.checkpoint.jsonl') as f:
+        header = json.loads(f.readline())
+    checkpoint = Checkpoint('reactome.checkpoint.jsonl', header['settings'])
+    assert checkpoint.load()
+    assert 0 < len(checkpoint.done) <= 12
+
+    # Only the reactions after the last save point are converted again
+    resumed = []
+    monkeypatch.setattr(Checkpoint, 'record', lambda self, rxnId, result: resumed.append(rxnId) or record(self, rxnId, result))
+    runMain(args + ['--resume'])
+    assert resumed and not checkpoint.done.intersection(str(rxnId) for rxnId in resumed)
+    assert readOutput(fn) == expected
+    assert not os.path.exists('reactome.checkpoint.jsonl')
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compressed manifest and entity store round-trips
+"""
+
+import os
+
+import pytest
+
+import compression
+from compression import compressedFilename, detectCompression, openText
+from entity_store import DirectoryStore, openEntityStore
+from manifest import ConversionManifest
+
+modes = ['gzip', pytest.param('zstd', marks=pytest.mark.skipif(compression.zstandard is None, reason='needs zstandard'))]
+
+entity = {'dbId': 109581, 'schemaClass': 'Complex', 'displayName': 'ATP [cytosol]', 'hasComponent': [{'dbId': 1}]}
+
+
+def test_compressedFilename():
+    assert compressedFilename('a.json', 'gzip') == 'a.json.gz'
+    assert compressedFilename('a.json', None) == 'a.json'
+    assert compressedFilename('a.json', 'none') == 'a.json'
+    assert compressedFilename('a.json') == 'a.json'
+
+    compression.setCompression('gzip')
+    assert compressedFilename('a.json') == 'a.json.gz'
+    # An explicit None is plain, not the configured compression
+    assert compressedFilename('a.json', None) == 'a.json'
+
+
+@pytest.mark.parametrize('mode', modes)
+def test_openText_roundtrip(tmp_path, mode):
+    fn = compressedFilename(str(tmp_path / 'a.txt'), mode)
+    with openText(fn, 'w') as f:
+        f.write('Größe\n')
+    with openText(fn, 'a') as f:
+        f.write('more\n')
+
+    assert detectCompression(fn) == mode
+    with openText(fn, 'r') as f:
+        assert f.read() == 'Größe\nmore\n'
+
+
+@pytest.mark.parametrize('fn', ['m.json', 'm.json.gz'])
+def test_manifest_roundtrip(tmp_path, fn):
+    # The configured compression must not change how a named manifest is written
+    compression.setCompression('gzip')
+    fn = str(tmp_path / fn)
+
+    manifest = ConversionManifest(fn, '1')
+    manifest.record('109581', {'109581': 'abc'}, {'1': ['evidence', False]})
+    manifest.save()
+
+    assert os.listdir(str(tmp_path)) == [os.path.basename(fn)]
+    loaded = ConversionManifest(fn, '1')
+    assert loaded.lookup('109581', {'109581': 'abc'}) == (True, {'1': ('evidence', False)})
+    assert loaded.lookup('109581', {'109581': 'changed'}) == (False, None)
+
+
+@pytest.mark.parametrize('mode', [None] + modes)
+def test_directoryStore_roundtrip(tmp_path, mode):
+    compression.setCompression('gzip')
+    store = DirectoryStore(str(tmp_path), compression=mode)
+    store.put('109581', entity)
+
+    assert os.listdir(str(tmp_path)) == [compressedFilename('109581.json', mode)]
+    assert '109581' in store
+    assert store.get('109581') == entity
+    assert dict(store.items()) == {'109581': entity}
+
+
+@pytest.mark.parametrize('mode', modes)
+def test_directoryStore_reads_mixed_files(tmp_path, mode):
+    DirectoryStore(str(tmp_path)).put('1', dict(entity, dbId=1))
+    store = DirectoryStore(str(tmp_path), compression=mode)
+    store.put('2', dict(entity, dbId=2))
+
+    assert store.get('1')['dbId'] == 1
+    assert store.get('2')['dbId'] == 2
+    assert len(store) == 2
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_sqliteStore_roundtrip(tmp_path, compress):
+    fn = str(tmp_path / 'entities.sqlite')
+    store = openEntityStore(fn, compress=compress)
+    store.putMany([('109581', entity), ('2', dict(entity, dbId=2))])
+    store.close()
+
+    # Compression is recorded in the file, a reader need not know it
+    store = openEntityStore(fn, compress=False)
+    assert store.get('109581') == entity
+    assert len(store) == 2
+    store.close()
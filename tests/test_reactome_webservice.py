@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+getEntitiesData against fake_reactome_server.py - batching, retries and 429s
+"""
+
+import pytest
+
+import reactome_webservice
+from reactome_client import configureClient, getClient
+from entity_store import openEntityStore
+from fake_reactome_server import FakeReactomeServer
+
+
+def fixtureDbIds(syntheticFixture, cnt=None):
+    store = openEntityStore(syntheticFixture['store'])
+    dbIds = sorted(dbId for dbId, entity in store.items())
+    store.close()
+    return dbIds[:cnt] if cnt else dbIds
+
+
+@pytest.fixture
+def serve(syntheticFixture, tmp_path):
+    """Start a fake webservice over the fixture and point reactome_webservice at it, with an empty local store"""
+
+    servers = []
+
+    def start(retries=5, **kwargs):
+        server = FakeReactomeServer(syntheticFixture['store'], seed=1, **kwargs)
+        reactome_webservice.setWsUrl(server.start())
+        reactome_webservice.setEntityStore(str(tmp_path / 'downloadedEntities'))
+        configureClient(retries=retries, backoff=0.01, maxBackoff=0.05)
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.stop()
+
+
+def test_getEntitiesData_batches(serve, syntheticFixture):
+    server = serve()
+    reactome_webservice.setBatchSize(10)
+    dbIds = fixtureDbIds(syntheticFixture, 35)
+
+    entities = reactome_webservice.getEntitiesData(dbIds)
+
+    assert sorted(entities) == dbIds
+    assert all(str(entity['dbId']) == dbId for dbId, entity in entities.items())
+    stats = server.stats()
+    assert stats['queryByIds'] == 4
+    assert 'queryById' not in stats
+
+    # Split back into per-entity store records - a second call does not hit the webservice
+    store = reactome_webservice.getEntityStore()
+    assert all(dbId in store for dbId in dbIds)
+    reactome_webservice.entityCache.clear()
+    assert sorted(reactome_webservice.getEntitiesData(dbIds)) == dbIds
+    assert server.stats()['requests'] == stats['requests']
+
+
+def test_getEntitiesData_leaves_out_missing(serve, syntheticFixture):
+    server = serve()
+    dbIds = fixtureDbIds(syntheticFixture, 5)
+
+    entities = reactome_webservice.getEntitiesData(dbIds + ['999999999'])
+
+    assert sorted(entities) == dbIds
+    # The dbId the batch did not return is tried once more on its own
+    assert server.stats()['queryById'] == 1
+
+
+def test_getEntitiesData_retries_errors(serve, syntheticFixture):
+    server = serve(errorRate=0.3, retries=10)
+    reactome_webservice.setBatchSize(5)
+    dbIds = fixtureDbIds(syntheticFixture, 40)
+
+    entities = reactome_webservice.getEntitiesData(dbIds)
+
+    assert sorted(entities) == dbIds
+    assert server.stats()['errors'] > 0
+    assert getClient().stats()['retries'] == server.stats()['errors']
+
+
+def test_rate_limited_requests_are_retried(serve, syntheticFixture):
+    server = serve(rateLimit=20, retries=20)
+    reactome_webservice.setBatchSize(1)
+    dbIds = fixtureDbIds(syntheticFixture, 40)
+
+    entities = reactome_webservice.getEntitiesData(dbIds)
+
+    assert sorted(entities) == dbIds
+    assert server.stats()['throttled'] > 0
+    assert getClient().stats()['errors'] == 0
+
+
+def test_failed_entity_is_not_stored(serve, syntheticFixture):
+    server = serve(errorRate=1.0, retries=1)
+    dbId = fixtureDbIds(syntheticFixture, 1)[0]
+
+    assert reactome_webservice.getEntityData(dbId) is None
+    assert server.stats()['errors'] == 2
+    assert dbId not in reactome_webservice.getEntityStore()
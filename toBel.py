@@ -16,34 +16,116 @@ Options:
 import re
 
 from reactome_webservice import getEntityData
+from cache import LRUCache
+from metrics import metrics
+from bel_terms import Term, ComplexTerm, Statement, renderResult
 
 import logging
 log = logging.getLogger('root')
 
-belVersion = 1
+# Default BEL version for renderBel() callers that do not pass one - conversion
+# itself is version-neutral, see bel_terms.py
+belVersion = '1'
 
 namespaces = ["AFFX", "CHEBIID", "CHEBI", "DOID", "DO", "EGID",
     "GOBPID", "GOBP", "GOCCID", "GOCC", "HGNC", "MESHPP", "MESHCS",
     "MESHC", "MESHCID", "MESHD", "MESHPPID", "MESHCSID", "MESHDID",
     "MGI", "RGD", "SCHEM", "SDIS", "SFAM", "SCOMP", "SPID", "SP"]
 
+# Finished toBel() results keyed by dbId - shared complexes, sets and small
+# molecules are converted once per run, for every BEL version, instead of once
+# per reference
+belCache = LRUCache(maxsize=200000)
+cacheMiss = object()
+
+# Entities nested deeper than this below the entity passed to toBel() are
+# skipped - real Reactome nesting is far shallower, see setMaxDepth
+maxDepth = 100
+
+# schemaClass -> (handler(entity, childResults), children(entity)), see registerHandler
+handlers = {}
+# (compiled pattern, handler, children) tried in order for classes without an exact handler
+patternHandlers = []
+# schemaClass -> (handler, children) resolved through patternHandlers or the fallback
+resolvedHandlers = {}
+
+chebiRegex = re.compile(r'(.*?)\s+\[ChEBI:(\d+)\]')
+accessionRegex = re.compile(r'(\w+):(\w+)[\W\s]*')
+namespaceRegex = re.compile(r'(\w+):(.*)\s*')
+nonWordRegex = re.compile(r'\W')
+
 
 ####################################################
 # Common utilities
 ####################################################
 
 def setBelVersion(version):
-    """Set BEL Version to 1 or 2"""
+    """Set default BEL Version (1 or 2) for renderBel()"""
 
     global belVersion
-    belVersion = version
+    belVersion = str(version)
+
+
+def getBelVersion():
+    return belVersion
+
+
+def setMaxDepth(depth):
+    """Set nesting depth below which toBel() skips entities"""
+
+    global maxDepth
+    maxDepth = int(depth)
+
+
+def getMaxDepth():
+    return maxDepth
+
+
+def getTraversalStats():
+    """Traversals, entities converted, worst-case depth, cycles and depth limit hits"""
+
+    snapshot = metrics.snapshot()
+    nodes = snapshot['distributions'].get('toBel.traversalNodes', {})
+    depths = snapshot['distributions'].get('toBel.traversalDepth', {})
+    counts = snapshot['counters'].get('traversal', {})
+    return {
+        'traversals': sum(nodes.values()),
+        'nodes': sum(value * n for value, n in nodes.items()),
+        'maxNodes': max(nodes) if nodes else 0,
+        'maxDepth': max(depths) if depths else 0,
+        'cycles': counts.get('cycles', 0),
+        'depthLimited': counts.get('depthLimited', 0),
+    }
+
+
+def renderBel(result, version=None):
+    """Render a toBel() result to {term: [statements]} text for a BEL version"""
+
+    return renderResult(result, version or belVersion)
+
+
+def setBelCacheSize(size):
+    """Set maximum number of cached toBel() results (0 or None is unbounded)"""
+
+    belCache.resize(size)
+
+
+def getBelCacheStats():
+    """Hit/miss/eviction counts for the toBel() conversion cache"""
+
+    return belCache.stats()
+
+
+def clearBelCache():
+    """Drop all cached toBel() results, e.g. after switching entity data"""
+
+    belCache.clear()
 
 
 def dedupList(seq):
-    """De-duplicate list"""
+    """De-duplicate list, keeping the first occurrence of each item in order"""
 
-    seqset = set(seq)
-    return list(seqset)
+    return list(dict.fromkeys(seq))
 
 
 def dedup(objects):
@@ -67,7 +149,7 @@ def escapeBelString(belstring):
     return belstring.replace('"', '\\"')
 
 
-def processReferenceEntity(entity):
+def processReferenceEntity(entity, replace=None):
 
     compartment = getCompartment(entity)
 
@@ -75,32 +157,20 @@ def processReferenceEntity(entity):
     name = entity['name'][0]
 
     # ChEBI ID
-    matches = re.search(r'(.*?)\s+\[ChEBI:(\d+)\]', displayName, flags=0)
+    matches = chebiRegex.search(displayName)
     if matches:
         chebiId = matches.group(2)
-        if belVersion == '2' and compartment:
-            bel = 'a(CHEBIID:{}, loc(REACTCOMP:"{}"))'.format(chebiId, compartment)
-        else:
-            bel = 'a(CHEBIID:{})'.format(chebiId)
-        return bel
+        return Term('a', 'CHEBIID:{}'.format(chebiId), location=compartment, replace=replace)
 
     # UniProt ID
-    matches = re.search(r'(\w+):(\w+)[\W\s]*', displayName, flags=0)
+    matches = accessionRegex.search(displayName)
     if matches:
         namespace = matches.group(1)
         accessionId = matches.group(2)
-        if belVersion == '2' and compartment:
-            bel = 'p({}:{}, loc(REACTCOMP:"{}"))'.format(namespace, accessionId, compartment)
-        else:
-            bel = 'p({}:{})'.format(namespace, accessionId)
-        return bel
+        return Term('p', '{}:{}'.format(namespace, accessionId), location=compartment, replace=replace)
 
     # Default
-    if belVersion == '2' and compartment:
-        bel = 'p({}, loc(REACTCOMP:"{}"))'.format(name, compartment)
-    else:
-        bel = 'p({})'.format(name)
-    return bel
+    return Term('p', name, location=compartment, replace=replace)
 
     log.info('Cannot process referenceEntity: {}  displayName: {}'.format(entity['dbId'], displayName))
 
@@ -112,14 +182,14 @@ def convertCHEBI(chebiTerm):
 
 
 def formatBelEntity(belEntity):
-    matches = re.search('(\w+):(.*)\s*', belEntity, flags=0)
+    matches = namespaceRegex.search(belEntity)
     if matches:
         ns = matches.group(1)
         entityId = matches.group(2)
         if ns not in namespaces:
             log.info('Unknown namespace: {}'.format(belEntity))
 
-    matches = re.search('\W', entityId, flags=0)
+    matches = nonWordRegex.search(entityId)
     if matches:
         entityId = '"{}"'.format(entityId)
 
@@ -138,7 +208,7 @@ def getCompartment(entity):
 ####################################################
 # Convert to BEL Annotations
 ####################################################
-def toBelCompartment(entity):
+def toBelCompartment(entity, childResults=()):
 
     if entity['displayName'] == 'smooth endoplasmic reticulum':
         annotation = 'SET CellStructure = "Endoplasmic Reticulum, Smooth"'
@@ -147,7 +217,7 @@ def toBelCompartment(entity):
     log.info("Cannot process Compartment: {}".format(entity['dbId']))
 
 
-def toBelEntityCompartment(entity):
+def toBelEntityCompartment(entity, childResults=()):
 
     if 'displayName' in entity:
         annotation = 'SET EntityCompartment = "{}"'.format(entity['displayName'])
@@ -159,17 +229,17 @@ def toBelEntityCompartment(entity):
 ####################################################
 # Convert to BEL terms
 ####################################################
-def toBelOtherEntity(entity):
+def toBelOtherEntity(entity, childResults=()):
 
     if 'name' in entity:
-        bel = 'a("{}")'.format(escapeBelString(entity['name'][0]))
-        log.debug('toBelOtherEntity: {}  dbId: {}'.format(bel, entity['dbId']))
+        bel = Term('a', '"{}"'.format(escapeBelString(entity['name'][0])))
+        log.debug('toBelOtherEntity: %s  dbId: %s', bel, entity['dbId'])
         return {bel: []}
 
     log.info('Cannot process OtherEntity: {}'.format(entity['dbId']))
 
 
-def toBelPolymer(entity):
+def toBelPolymer(entity, childResults=()):
 
     compartment = getCompartment(entity)
 
@@ -177,57 +247,67 @@ def toBelPolymer(entity):
         for cross in entity['crossReference']:
             if 'ChEBI' in cross['displayName']:
                 chebi = convertCHEBI(cross['displayName'])
-                if belVersion == '2' and compartment:
-                    bel = 'a({}, loc(REACTCOMP:"{}"))'.format(chebi, compartment)
-                else:
-                    bel = 'a({})'.format(chebi)
-                log.debug('toBelPolymer crossReference: {}  dbId: {}'.format(bel, entity['dbId']))
+                bel = Term('a', chebi, location=compartment)
+                log.debug('toBelPolymer crossReference: %s  dbId: %s', bel, entity['dbId'])
                 return {bel: []}
 
     if 'name' in entity:
-        bel = 'a("{}")'.format(escapeBelString(entity['name'][0]))
-        log.debug('toBelPolymer name: {}  dbId: {}'.format(bel, entity['dbId']))
+        bel = Term('a', '"{}"'.format(escapeBelString(entity['name'][0])))
+        log.debug('toBelPolymer name: %s  dbId: %s', bel, entity['dbId'])
         return {bel: []}
 
     log.info('Cannot process Polymer: {}'.format(entity['dbId']))
 
 
-def toBelSimpleEntity(entity):
+def toBelSimpleEntity(entity, childResults=()):
 
     if 'referenceEntity' in entity:
         bel = processReferenceEntity(entity)
-        log.debug('toBelSimpleEntity: {}  dbId: {}'.format(bel, entity['dbId']))
+        log.debug('toBelSimpleEntity: %s  dbId: %s', bel, entity['dbId'])
         return {bel: []}
 
     log.info('Cannot process SimpleEntity: {}'.format(entity['dbId']))
 
 
-def toBelSets(entity):
+def locatedNameTerm(entity, compartment):
+    """a("name") - BEL 2 writes the name unquoted when it adds the location"""
+
+    name = escapeBelString(entity['name'][0])
+    return Term('a', '"{}"'.format(name), location=compartment, locatedArg=name)
+
+
+def setMembers(entity):
+    """dbIds of set members (or candidates) to convert before the set"""
+
+    if 'name' not in entity:
+        return []
+
+    members = []
+    if 'hasMember' in entity:
+        members = entity['hasMember']
+    elif 'hasCandidate' in entity:
+        members = entity['hasCandidate']
+    else:
+        log.error('problem with Set: no members')
+
+    return [str(member['dbId']) for member in dedup(members)]
+
+
+def toBelSets(entity, childResults):
 
     compartment = getCompartment(entity)
     # log.debug('toBelSets Compartment: {}'.format(compartment))
 
     if 'name' in entity:
-        if belVersion == '2' and compartment:
-            bel = 'a({}, loc(REACTCOMP:"{}"))'.format(escapeBelString(entity['name'][0]), compartment)
-        else:
-            bel = 'a("{}")'.format(escapeBelString(entity['name'][0]))
-        log.debug('toBelSets: {}  dbId: {}'.format(bel, entity['dbId']))
+        bel = locatedNameTerm(entity, compartment)
+        log.debug('toBelSets: %s  dbId: %s', bel, entity['dbId'])
 
         results = {bel: []}
-        members = []
-        if 'hasMember' in entity:
-            members = entity['hasMember']
-        elif 'hasCandidate' in entity:
-            members = entity['hasCandidate']
-        else:
-            log.error('problem with Set: no members')
-
-        for member in dedup(members):
-            # Recursively process complex components which can have complexes inside them
-            result = toBel(member['dbId'])
+        for result in childResults:
+            # Members are converted first, complexes with complexes inside them included
+            result = result or {}
             for key in result:
-                results[bel].append('{} hasComponent {}'.format(bel, key))
+                results[bel].append(Statement(bel, 'hasComponent', key))
                 for statement in result[key]:
                     results[bel].append(statement)
 
@@ -236,153 +316,292 @@ def toBelSets(entity):
     log.info('problem with Set: '.format(entity['dbId']))
 
 
-def toBelGenomeEncodedEntity(entity):
+def toBelGenomeEncodedEntity(entity, childResults=()):
 
     compartment = getCompartment(entity)
 
     if 'name' in entity:
-        if belVersion == '2' and compartment:
-            bel = 'a({}, loc(REACTCOMP:"{}"))'.format(escapeBelString(entity['name'][0]), compartment)
-        else:
-            bel = 'a("{}")'.format(escapeBelString(entity['name'][0]))
+        bel = locatedNameTerm(entity, compartment)
 
-        log.debug('toBelGenomeEncodedEntity: {}  dbId: {}'.format(bel, entity['dbId']))
+        log.debug('toBelGenomeEncodedEntity: %s  dbId: %s', bel, entity['dbId'])
         return {bel: []}
 
     log.info('problem with Set: '.format(entity['dbId']))
 
 
 ####################################################
-# Recursive conversion to BEL terms
+# Conversion of nested entities - children are converted first, see toBel()
 ####################################################
-def toBelComplexNamed(entity):
+def complexComponents(entity):
+    """dbIds of complex components to convert before the complex"""
+
+    return [str(component['dbId']) for component in dedup(entity.get('hasComponent', []))]
+
+
+def physicalEntityChildren(entity):
+    """dbId of the physicalEntity a catalyst activity or accessioned sequence stands for"""
+
+    if 'referenceEntity' not in entity and 'physicalEntity' in entity:
+        return [str(entity['physicalEntity']['dbId'])]
+    return []
+
+
+def toBelComplexNamed(entity, childResults):
     """Version that uses Reactome name of complex for complex entity name"""
 
     compartment = getCompartment(entity)
 
-    if belVersion == '2' and compartment:
-        bel = 'a({}, loc(REACTCOMP:"{}"))'.format(escapeBelString(entity['name'][0]), compartment)
-    else:
-        bel = 'complex("{}")'.format(escapeBelString(entity['name'][0]))
+    name = escapeBelString(entity['name'][0])
+    bel = Term('complex', '"{}"'.format(name), location=compartment, locatedArg=name, locatedFunc='a')
 
     results = {bel: []}
     if 'hasComponent' in entity:
-        components = dedup(entity['hasComponent'])
-
-        for component in components:
-            result = toBel(component['dbId'])
+        for result in childResults:
+            result = result or {}
             for key in result:
-                results[bel].append('{} hasComponent {}'.format(bel, key))
+                results[bel].append(Statement(bel, 'hasComponent', key))
                 for statement in result[key]:
                     results[bel].append(statement)
 
-        log.debug('toBelComplex: {}  dbId: {}'.format(bel, entity['dbId']))
+        log.debug('toBelComplex: %s  dbId: %s', bel, entity['dbId'])
         return results
 
     log.info('Cannot process Complex: {}'.format(entity['dbId']))
 
 
-####################################################
-# Recursive conversion to BEL terms
-####################################################
-def toBelComplexComponents(entity):
+def toBelComplexComponents(entity, childResults):
     """Version that uses complex components for complex entity name"""
 
     compartment = getCompartment(entity)
 
-    results = []
     belComponents = []
     childStatements = []
     if 'hasComponent' in entity:
-        components = dedup(entity['hasComponent'])
-
-        for component in components:
-            results.append(toBel(component['dbId']))
+        results = [result or {} for result in childResults]
 
         for result in results:
             for key in result:
                 belComponents.append(key)
 
-        belComponents = dedupList(belComponents)
-        belList = ', '.join(belComponents)
+        if not belComponents:
+            # Every component was skipped or could not be converted - complex() is not valid BEL
+            log.warning('Complex without convertible components: {}'.format(entity['dbId']))
+            return None
 
-        if belVersion == '2' and compartment:
-            bel = 'complex({}, loc(REACTCOMP:"{}"))'.format(belList, compartment)
-        else:
-            bel = 'complex({})'.format(belList)
+        # Components rendering to the same term are listed once - see ComplexTerm
+        bel = ComplexTerm(belComponents, location=compartment)
 
         for result in results:
             for key in result:
-                childStatements.append('{} hasComponent {}'.format(bel, key))
+                childStatements.append(Statement(bel, 'hasComponent', key))
                 for statement in result[key]:
                     childStatements.append(statement)
 
-        log.debug('toBelComplex: {}  dbId: {}'.format(bel, entity['dbId']))
+        log.debug('toBelComplex: %s  dbId: %s', bel, entity['dbId'])
 
         return {bel: childStatements}
 
     log.info('Cannot process Complex: {}'.format(entity['dbId']))
 
 
-def toBelEntityWithAccessionedSequence(entity):
+def toBelEntityWithAccessionedSequence(entity, childResults):
 
     if 'referenceEntity' in entity:
-        bel = processReferenceEntity(entity)
-
-        if bel:
-            bel = bel.replace('UniProt', 'SPID')
+        bel = processReferenceEntity(entity, replace=('UniProt', 'SPID'))
 
-        log.debug('toBelEntityWithAccessionedSequence: {}  dbId: {}'.format(bel, entity['dbId']))
+        log.debug('toBelEntityWithAccessionedSequence: %s  dbId: %s', bel, entity['dbId'])
         return {bel: []}
 
     elif 'physicalEntity' in entity:
-        return toBel(entity['physicalEntity']['dbId'])
+        return childResults[0]
 
     log.info('Cannot process AccessionedSequence: {}'.format(entity['dbId']))
 
 
-def toBelCatalystActivity(entity):
+def toBelCatalystActivity(entity, childResults):
 
     if 'physicalEntity' in entity:
-        return(toBel(entity['physicalEntity']['dbId']))
+        return childResults[0]
 
     log.info('Cannot process CatalystActivity: {}'.format(entity['dbId']))
 
 
+####################################################
+# schemaClass dispatch
+####################################################
+def noChildren(entity):
+    return []
+
+
+def registerHandler(schemaClass, handler, pattern=False, children=noChildren):
+    """Register a converter for a Reactome schemaClass
+
+    handler(entity, childResults) -> {Term: [Statement]} gets the toBel()
+    results of the dbIds children(entity) returns, in the same order - toBel()
+    converts them first.  Leaf handlers use the default children.
+
+    With pattern=True schemaClass is a regular expression searched in classes
+    that have no exact handler, patterns are tried in registration order.
+    A later registration for the same class replaces the earlier one.
+    """
+
+    if pattern:
+        patternHandlers.append((re.compile(schemaClass), handler, children))
+    else:
+        handlers[schemaClass] = (handler, children)
+    resolvedHandlers.clear()
+
+
+def toBelUnknown(entity, childResults=()):
+    """Fallback for schemaClasses without a handler - counted and skipped"""
+
+    metrics.count('unknownSchemaClass', entity['schemaClass'])
+    log.warning('No BEL handler for schemaClass {}: {}'.format(entity['schemaClass'], entity['dbId']))
+    return None
+
+
+def getHandler(schemaClass):
+    """(handler, children) for schemaClass - exact match, first matching pattern or toBelUnknown"""
+
+    handler = handlers.get(schemaClass)
+    if handler is not None:
+        return handler
+
+    handler = resolvedHandlers.get(schemaClass)
+    if handler is None:
+        handler = (toBelUnknown, noChildren)
+        for regex, patternHandler, children in patternHandlers:
+            if regex.search(schemaClass):
+                handler = (patternHandler, children)
+                break
+        resolvedHandlers[schemaClass] = handler
+    return handler
+
+
+registerHandler('Compartment', toBelCompartment)
+registerHandler('EntityCompartment', toBelEntityCompartment)
+registerHandler('OtherEntity', toBelOtherEntity)
+registerHandler('Polymer', toBelPolymer)
+registerHandler('Complex', toBelComplexComponents, children=complexComponents)  # alternative version - toBelComplexNamed()
+registerHandler('SimpleEntity', toBelSimpleEntity)
+registerHandler('EntityWithAccessionedSequence', toBelEntityWithAccessionedSequence, children=physicalEntityChildren)
+registerHandler('Set', toBelSets, pattern=True, children=setMembers)  # DefinedSet, CandidateSet, OpenSet
+registerHandler('GenomeEncodedEntity', toBelGenomeEncodedEntity, pattern=True)
+registerHandler('CatalystActivity', toBelCatalystActivity, pattern=True, children=physicalEntityChildren)
+
+
 ####################################################
 # Master conversion to BEL terms
 ####################################################
 def toBel(dbId):
-    ''' Convert to BEL formats '''
-
-    entity = getEntityData(dbId)
-
-    print('toBel dbId: ', dbId)
-
-    type = entity['schemaClass']
-
-    if (type == 'Compartment'):
-        bel = toBelCompartment(entity)
-    elif type == 'EntityCompartment':
-        bel = toBelEntityCompartment(entity)
-    elif type == 'OtherEntity':
-        bel = toBelOtherEntity(entity)
-    elif type == 'Polymer':
-        bel = toBelPolymer(entity)
-    elif type == 'Complex':
-        bel = toBelComplexComponents(entity)  # alternative version - toBelComplexNamed()
-    elif type == 'SimpleEntity':
-        bel = toBelSimpleEntity(entity)
-    elif type == 'EntityWithAccessionedSequence':
-        bel = toBelEntityWithAccessionedSequence(entity)
-    elif 'Set' in type:
-        bel = toBelSets(entity)
-    elif 'GenomeEncodedEntity' in type:
-        bel = toBelGenomeEncodedEntity(entity)
-    elif 'CatalystActivity' in type:
-        bel = toBelCatalystActivity(entity)
-
-    return bel
+    ''' Convert to BEL formats
+
+    Returns a version-neutral {Term: [Statement]} dict, see bel_terms.py and
+    renderBel().  Results are cached per dbId and shared between callers - treat
+    them as read-only.
+
+    Nested entities are converted bottom-up from an explicit stack rather than
+    by recursion: every child is converted once, before its parents.  A child
+    that refers back to an entity still being converted (a cycle) or that is
+    nested deeper than maxDepth is skipped with a warning and counted.
+
+    An entity whose data cannot be fetched or whose schemaClass has no
+    handler makes every entity it is nested in None.  Results missing skipped
+    children are returned but not cached, so a shallower path to the same
+    entity converts it in full, and neither are failures so a later
+    reference retries them.
+    '''
+
+    key = str(dbId)
+    bel = belCache.get(key, cacheMiss)
+    if bel is not cacheMiss:
+        return bel
+
+    results = {}  # dbId -> result of this traversal, safe from cache eviction
+    converting = set()  # dbIds whose children are being converted - the path to the top frame
+    failed = set()  # dbIds without entity data, or with such a child
+    truncated = set()  # dbIds with a skipped child - results kept out of belCache
+    stack = [[key, 1, None, None, None]]  # dbId, depth, entity, child dbIds, handler
+    nodes = deepest = 0
+
+    while stack:
+        frame = stack[-1]
+        dbId, depth, entity, children, handler = frame
+
+        if children is not None:
+            # All children done - convert the entity itself
+            stack.pop()
+            converting.discard(dbId)
+            if failed.intersection(children):
+                failed.add(dbId)
+                results[dbId] = None
+                metrics.count('traversal', 'failedChildren')
+            else:
+                bel = handler(entity, [results.get(child) for child in children])
+                results[dbId] = bel
+                if handler is toBelUnknown:
+                    # Dropping it would leave a parent complex or set silently incomplete
+                    failed.add(dbId)
+                elif truncated.intersection(children):
+                    truncated.add(dbId)
+                else:
+                    belCache.put(dbId, bel)
+            nodes += 1
+            deepest = max(deepest, depth)
+            metrics.observe('toBel.depth', depth)
+            continue
+
+        if dbId in results:
+            stack.pop()
+            continue
+
+        bel = belCache.get(dbId, cacheMiss)
+        if bel is not cacheMiss:
+            results[dbId] = bel
+            stack.pop()
+            continue
+
+        if dbId in converting:
+            stack.pop()
+            truncated.add(dbId)
+            metrics.count('traversal', 'cycles')
+            log.warning('toBel cycle - {} refers back to itself, skipped  Root: {}'.format(dbId, key))
+            continue
+
+        if depth > maxDepth:
+            stack.pop()
+            truncated.add(dbId)
+            metrics.count('traversal', 'depthLimited')
+            log.warning('toBel depth limit {} reached at {}, skipped  Root: {}'.format(maxDepth, dbId, key))
+            continue
+
+        log.debug('toBel dbId: %s', dbId)
+        entity = getEntityData(dbId)
+        if not entity:
+            log.error('Cannot convert - no entity data: {}'.format(dbId))
+            stack.pop()
+            results[dbId] = None
+            failed.add(dbId)
+            continue
+
+        type = entity['schemaClass']
+        metrics.count('schemaClass', type)
+
+        handler, childrenOf = getHandler(type)
+        children = childrenOf(entity)
+        metrics.observe('toBel.fanout', len(children))
+        frame[2:] = entity, children, handler
+        converting.add(dbId)
+
+        # Reversed so children are converted in the order the handler lists them
+        for child in reversed(children):
+            if child not in results:
+                stack.append([child, depth + 1, None, None, None])
+
+    metrics.observe('toBel.traversalNodes', nodes)
+    metrics.observe('toBel.traversalDepth', deepest)
+
+    return results.get(key)
 
 
 def main():